@@ -0,0 +1,403 @@
+import re
+import os
+import json
+import asyncio
+import logging
+import secrets
+import subprocess
+import urllib.error
+import urllib.request
+from urllib.parse import urlparse
+from datetime import timedelta
+from job_module import current_job
+from rc_module import run_process, format_bytes
+from progress_module import ProgressReporter
+from metrics_module import metrics
+
+logger = logging.getLogger(__name__)
+
+# aria2c limits --max-connection-per-server to 16
+MAX_CONNECTIONS_PER_SERVER = 16
+
+# Progress readout printed every --summary-interval, e.g.
+# [#2089b0 400.0KiB/33.2MiB(1%) CN:1 DL:115.7KiB ETA:4m51s]
+ARIA2_PROGRESS = re.compile(
+    r'\[#\w+\s+(?P<done>[\d.]+\w*)/(?P<total>[\d.]+\w*)\((?P<percent>\d+)%\)'
+    r'(?:\s+CN:(?P<connections>\d+))?'
+    r'(?:\s+(?:SD:\d+\s+)?DL:(?P<speed>[\d.]+\w*))?'
+    r'(?:\s+ETA:(?P<eta>\w+))?'
+)
+ARIA2_COMPLETE = re.compile(r'Download complete:\s*(?P<path>.+)$')
+
+SIZE = re.compile(r'(?P<number>[\d.]+)(?P<unit>[KMGT]?i?B)?$')
+SIZE_UNITS = {'B': 1, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3, 'TiB': 1024 ** 4}
+
+def parse_size(text):
+    """Convert an aria2c size such as ``33.2MiB`` to bytes, or None if it isn't one."""
+    match = SIZE.match(text or '')
+    if not match:
+        return None
+    return int(float(match.group('number')) * SIZE_UNITS.get(match.group('unit') or 'B', 1))
+
+class ConnectionBudget:
+    """
+    A global pool of HTTP connections shared by all aria2c downloads.
+
+    Each download reserves as many connections as it may open; downloads that
+    don't fit wait until enough connections are released.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.available = size
+        self._condition = None
+
+    def _cond(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self, count):
+        count = min(count, self.size)
+        async with self._cond():
+            await self._cond().wait_for(lambda: self.available >= count)
+            self.available -= count
+        return count
+
+    async def release(self, count):
+        async with self._cond():
+            self.available += count
+            self._cond().notify_all()
+
+def parse_download_args(text):
+    """
+    Split a message into URLs and aria2c options.
+
+    Besides the URLs, the message may contain ``split=N`` and ``conn=N``
+    to set --split and --max-connection-per-server for this job.
+
+    Returns:
+    - tuple: (list of URLs, split, max_connections)
+    """
+    urls = []
+    split = 4
+    max_connections = 4
+    for token in text.split():
+        if token.startswith(("http://", "https://")):
+            urls.append(token)
+            continue
+        key, _, value = token.partition('=')
+        if not value.isdigit():
+            continue
+        if key == 'split':
+            split = max(1, int(value))
+        elif key in ('conn', 'connections'):
+            max_connections = min(max(1, int(value)), MAX_CONNECTIONS_PER_SERVER)
+    return urls, split, max_connections
+
+def _head(url):
+    request = urllib.request.Request(url, method='HEAD')
+    with urllib.request.urlopen(request, timeout=15) as response:
+        return response.headers
+
+async def url_info(url):
+    """
+    Ask a URL for its size and cache validators with a HEAD request.
+
+    Returns:
+    - tuple: (size from Content-Length, or None if unknown; fingerprint of
+      the content from its size, ETag and Last-Modified, or None if the
+      server sent none of them)
+    """
+    try:
+        headers = await asyncio.to_thread(_head, url)
+        length = headers.get('Content-Length')
+        size = int(length) if length else None
+    except (OSError, ValueError) as e:
+        logger.error(f"Error sizing {url}: {e}")
+        return None, None
+    validators = [('size', size), ('etag', headers.get('ETag')), ('modified', headers.get('Last-Modified'))]
+    fingerprint = "; ".join(f"{name}={value}" for name, value in validators if value is not None)
+    return size, fingerprint or None
+
+async def aria2_download(status, url, local_path, filename=None, split=4, max_connections=4, budget=None):
+    """
+    Download a direct URL with aria2c, reporting progress on the status message.
+
+    Parameters:
+    - url (str): The URL to download.
+    - local_path (str): The local directory where the file will be saved.
+    - filename (str): The output file name (default: chosen by aria2c).
+    - split (int): Value for aria2c --split.
+    - max_connections (int): Value for aria2c --max-connection-per-server.
+    - budget (ConnectionBudget): Global connection pool to reserve from (optional).
+
+    Returns:
+    - str: The path of the downloaded file, or None on failure.
+    """
+    command = [
+        "aria2c",
+        "--continue=true",
+        f"--max-connection-per-server={max_connections}",
+        f"--split={split}",
+        "--summary-interval=1",
+        "--console-log-level=notice",
+        "--dir=" + local_path,
+    ]
+    if filename:
+        command.append("--out=" + filename)
+    command.append(url)
+
+    downloaded_path = os.path.join(local_path, filename) if filename else None
+    reporter = ProgressReporter(status)
+
+    async def on_line(line):
+        nonlocal downloaded_path
+        complete = ARIA2_COMPLETE.search(line)
+        if complete:
+            downloaded_path = complete.group('path').strip()
+            return
+        match = ARIA2_PROGRESS.search(line)
+        if match:
+            measurement.observe(parse_size(match.group('done')))
+            reporter.update(f"**Downloading**: `{filename or url}`\n {match.group('done')} of {match.group('total')} "
+                            f"({match.group('percent')}%)\n**Speed**: {match.group('speed') or '-'}/s | "
+                            f"**ETA**: {match.group('eta') or '-'} | **Connections**: {match.group('connections') or '-'}")
+
+    # aria2c opens at most min(split, max_connections) connections to one server
+    reserved = min(split, max_connections)
+    if budget is not None:
+        reserved = await budget.acquire(reserved)
+    try:
+        with metrics.measure('aria2c', urlparse(url).netloc) as measurement:
+            async with reporter:
+                returncode = await run_process(command, on_line)
+            measurement.exit_code = returncode
+        if returncode == 0:
+            await status.delete()
+            return downloaded_path
+        await status.edit_text(f"aria2c command failed with return code {returncode}")
+    except OSError as e:
+        logger.error(f"Error: {e}")
+    finally:
+        if budget is not None:
+            await budget.release(reserved)
+    return None
+
+class Aria2RPCError(Exception):
+    pass
+
+class Aria2RPC:
+    """
+    A long-lived aria2c daemon driven over JSON-RPC.
+
+    The daemon saves its queue to ``session_file`` and reloads it on start, so
+    downloads interrupted by a bot restart resume where they stopped.
+
+    Parameters:
+    - local_path (str): Default download directory of the daemon.
+    - session_file (str): Path of the aria2c session file.
+    - port (int): The RPC listen port (localhost only).
+    - secret (str): The RPC secret token (default: random per start).
+    - max_concurrent (int): Value for aria2c --max-concurrent-downloads.
+    """
+
+    def __init__(self, local_path, session_file, port=6800, secret=None, max_concurrent=5):
+        self.local_path = local_path
+        self.session_file = session_file
+        self.port = port
+        self.secret = secret or secrets.token_hex(16)
+        self.max_concurrent = max_concurrent
+        self.url = f"http://127.0.0.1:{port}/jsonrpc"
+        self.daemon = None
+        self._ids = 0
+
+    def start(self):
+        """Spawn the aria2c daemon. Returns immediately; calls retry until it listens."""
+        if self.daemon is not None and self.daemon.poll() is None:
+            return
+        os.makedirs(self.local_path, exist_ok=True)
+        if not os.path.exists(self.session_file):
+            open(self.session_file, 'a').close()
+
+        command = [
+            "aria2c",
+            "--enable-rpc",
+            "--rpc-listen-all=false",
+            f"--rpc-listen-port={self.port}",
+            f"--rpc-secret={self.secret}",
+            f"--input-file={self.session_file}",
+            f"--save-session={self.session_file}",
+            "--save-session-interval=30",
+            f"--max-concurrent-downloads={self.max_concurrent}",
+            "--continue=true",
+            "--dir=" + self.local_path,
+            "--console-log-level=warn",
+        ]
+        self.daemon = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        logger.info(f"Started aria2c RPC daemon on port {self.port} (pid {self.daemon.pid})")
+
+    def stop(self):
+        if self.daemon is not None and self.daemon.poll() is None:
+            # SIGTERM makes aria2c write the session file before exiting
+            self.daemon.terminate()
+            self.daemon.wait()
+        self.daemon = None
+
+    def _post(self, payload):
+        request = urllib.request.Request(self.url, data=json.dumps(payload).encode(),
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return json.load(response)
+
+    async def call(self, method, *params, retries=10):
+        """
+        Call an aria2 RPC method and return its result.
+
+        Connection errors are retried, which covers the daemon still starting up.
+        """
+        self._ids += 1
+        payload = {
+            'jsonrpc': '2.0',
+            'id': str(self._ids),
+            'method': method,
+            'params': [f'token:{self.secret}', *params],
+        }
+        for attempt in range(retries):
+            try:
+                reply = await asyncio.to_thread(self._post, payload)
+                break
+            except urllib.error.HTTPError as e:
+                # aria2 answers RPC errors with HTTP 400 and a JSON body
+                reply = json.load(e)
+                break
+            except OSError:
+                if attempt == retries - 1:
+                    raise
+                await asyncio.sleep(0.5)
+        if 'error' in reply:
+            raise Aria2RPCError(reply['error'].get('message', reply['error']))
+        return reply['result']
+
+async def aria2_rpc_download(status, rpc, url, local_path, filename=None, split=4, max_connections=4, budget=None,
+                             gid=None, on_submit=None):
+    """
+    Download a direct URL through the aria2c RPC daemon, polling tellStatus for progress.
+
+    Parameters are the same as aria2_download, plus:
+    - rpc (Aria2RPC): The daemon to submit the download to.
+    - gid (str): The GID of an earlier submission of this download. The daemon
+      reloads its session on start, so after a restart the job re-attaches to
+      it instead of adding the URL again (which aria2 rejects as a duplicate).
+    - on_submit (coroutine function): Awaited with the GID when the URL is newly added, to persist it.
+
+    Returns:
+    - str: The path of the downloaded file, or None on failure.
+    """
+    options = {
+        'dir': local_path,
+        'split': str(split),
+        'max-connection-per-server': str(max_connections),
+    }
+    if filename:
+        options['out'] = filename
+
+    reserved = min(split, max_connections)
+    if budget is not None:
+        reserved = await budget.acquire(reserved)
+    job = current_job.get()
+    reporter = ProgressReporter(status)
+    try:
+        if gid is not None:
+            gid = await reattach_rpc_download(rpc, gid)
+        if gid is None:
+            gid = await rpc.call('aria2.addUri', [url], options)
+            if on_submit is not None:
+                await on_submit(gid)
+        with metrics.measure('aria2c', urlparse(url).netloc) as measurement:
+            async with reporter:
+                info = await poll_rpc_download(rpc, gid, job, reporter, filename or url, measurement)
+            if info is not None and info['status'] == 'complete':
+                measurement.observe(int(info['completedLength']))
+                measurement.exit_code = 0
+        if info is None:
+            return None
+        if info['status'] == 'complete':
+            await status.delete()
+            return info['files'][0]['path']
+        await status.edit_text(f"aria2c download failed: {info.get('errorMessage') or info['status']}")
+    except (OSError, Aria2RPCError) as e:
+        logger.error(f"Error: {e}")
+        await status.edit_text(f"aria2c RPC error: {e}")
+    finally:
+        if budget is not None:
+            await budget.release(reserved)
+    return None
+
+async def reattach_rpc_download(rpc, gid):
+    """
+    Pick up a download the daemon still knows from its session.
+
+    Returns:
+    - str: The GID to poll, or None if the download must be added again
+      (unknown to the daemon, removed or failed).
+    """
+    try:
+        state = (await rpc.call('aria2.tellStatus', gid, ['status']))['status']
+    except Aria2RPCError:
+        # Not in the session (e.g. it was never saved)
+        return None
+    if state in ('removed', 'error'):
+        return None
+    if state == 'paused':
+        await rpc.call('aria2.unpause', gid)
+    logger.info(f"Re-attached to aria2 download {gid} ({state})")
+    return gid
+
+async def poll_rpc_download(rpc, gid, job, reporter, label, measurement=None, interval=3):
+    """
+    Poll aria2.tellStatus until a download stops, reporting its progress (and
+    the bytes downloaded to ``measurement``, if given).
+
+    Returns:
+    - dict: The final status (complete, error or removed), or None if the job was cancelled.
+    """
+    try:
+        while True:
+            if job is not None and not job.active:
+                await rpc.call('aria2.remove', gid)
+                return None
+
+            info = await rpc.call('aria2.tellStatus', gid, [
+                'status', 'totalLength', 'completedLength', 'downloadSpeed',
+                'connections', 'files', 'errorMessage', 'followedBy'
+            ])
+            state = info['status']
+
+            if state == 'complete' and info.get('followedBy'):
+                # Metalink/torrent URLs are followed by the real downloads
+                gid = info['followedBy'][0]
+                continue
+            if state in ('complete', 'error', 'removed'):
+                return info
+
+            total = int(info['totalLength'])
+            done = int(info['completedLength'])
+            speed = int(info['downloadSpeed'])
+            if measurement is not None:
+                measurement.observe(done)
+            percent = done * 100 // total if total else 0
+            eta = str(timedelta(seconds=(total - done) // speed)) if speed else '-'
+            reporter.update(f"**Downloading**: `{label}`\n {format_bytes(done)} of {format_bytes(total)} "
+                            f"({percent}%)\n**Speed**: {format_bytes(speed)}/s | "
+                            f"**ETA**: {eta} | **Connections**: {info['connections']}")
+            await asyncio.sleep(interval)
+    except asyncio.CancelledError:
+        # Job.cancel also cancels the task; a bot shutting down leaves the
+        # download in the daemon for the resumed job to re-attach to
+        if job is not None and not job.active:
+            try:
+                await rpc.call('aria2.remove', gid)
+            except (OSError, Aria2RPCError) as e:
+                logger.error(f"Error removing cancelled aria2 download {gid}: {e}")
+        raise
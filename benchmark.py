@@ -0,0 +1,415 @@
+"""
+Benchmarks for the processing pipeline.
+
+Drives rc_module.download / merge / changeindex / softmux / upload, the aria2c
+downloader, the JobScheduler and run_pipeline against fake status messages
+and stub rclone / aria2c / ffmpeg / ffprobe binaries. The stubs print
+realistic progress output at a configurable rate, so what is measured is the
+bot's own overhead: how long the event loop is blocked while jobs run, the
+CPU spent per progress line, and how jobs overlap.
+
+If a real ffmpeg is installed, merge / changeindex / softmux are also run on
+short generated ``testsrc`` clips.
+
+Usage:
+    python benchmark.py [--lines 200] [--rate 200] [--jobs 4] [--items 4]
+                        [--max-lag-ms 50] [--output bench_output.txt]
+
+With --max-lag-ms the exit status is 1 if the event loop was ever blocked for
+longer, e.g. because a blocking read crept back into a coroutine.
+"""
+import os
+import sys
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+import statistics
+
+from rc_module import download, merge, changeindex, softmux, upload
+from aria_module import aria2_download, ARIA2_PROGRESS
+from job_module import JobScheduler, NETWORK_JOB
+from pipeline_module import run_pipeline
+from progress_module import FFmpegProgressParser, parse_rclone_log
+
+# Keep the benchmark output readable
+logging.getLogger().setLevel(logging.WARNING)
+
+RCLONE_STUB = r'''
+import os, sys, json, time, shutil
+LINES = int(os.environ.get('BENCH_LINES', 100))
+RATE = float(os.environ.get('BENCH_RATE', 100))
+REMOTE = os.environ['BENCH_REMOTE']
+args = sys.argv[1:]
+if '--config' in args:
+    i = args.index('--config')
+    del args[i:i + 2]
+command, paths = args[0], [a for a in args[1:] if not a.startswith('-')]
+
+def local(path):
+    # "remote:dir/file" lives under BENCH_REMOTE
+    return os.path.join(REMOTE, path.split(':', 1)[1]) if ':' in path else path
+
+if command == 'size':
+    path = local(paths[0])
+    files = [os.path.join(r, f) for r, _, fs in os.walk(path) for f in fs] if os.path.isdir(path) else [path]
+    print(json.dumps({'count': len(files), 'bytes': sum(os.path.getsize(f) for f in files)}))
+elif command == 'cat':
+    with open(local(paths[0]), 'rb') as f:
+        shutil.copyfileobj(f, sys.stdout.buffer)
+elif command == 'rcat':
+    os.makedirs(os.path.dirname(local(paths[0])), exist_ok=True)
+    with open(local(paths[0]), 'wb') as f:
+        shutil.copyfileobj(sys.stdin.buffer, f)
+elif command == 'deletefile':
+    os.remove(local(paths[0]))
+elif command == 'copy':
+    source, destination = local(paths[0]), local(paths[1])
+    size = os.path.getsize(source) if os.path.isfile(source) else 1 << 20
+    for i in range(1, LINES + 1):
+        done = size * i // LINES
+        stats = {
+            'bytes': done, 'totalBytes': size, 'speed': size * RATE / LINES, 'eta': (LINES - i) / RATE,
+            'transfers': int(i == LINES), 'totalTransfers': 1, 'errors': 0, 'checks': 0, 'elapsedTime': i / RATE,
+            'transferring': [{'name': os.path.basename(source), 'size': size, 'bytes': done, 'percentage': i * 100 // LINES}],
+        }
+        sys.stderr.write(json.dumps({'level': 'notice', 'msg': 'stats', 'stats': stats}) + '\n')
+        sys.stderr.flush()
+        time.sleep(1 / RATE)
+    os.makedirs(destination, exist_ok=True)
+    if os.path.isdir(source):
+        shutil.copytree(source, destination, dirs_exist_ok=True)
+    else:
+        shutil.copy(source, destination)
+'''
+
+FFMPEG_STUB = r'''
+import os, sys, time, shutil
+LINES = int(os.environ.get('BENCH_LINES', 100))
+RATE = float(os.environ.get('BENCH_RATE', 100))
+args = sys.argv[1:]
+inputs = [args[i + 1] for i, a in enumerate(args) if a == '-i']
+output = args[-1]
+sys.stderr.write('  Duration: 00:01:00.00, start: 0.000000, bitrate: 5000 kb/s\n')
+for i in range(1, LINES + 1):
+    sys.stderr.write(f'frame={i * 25}\nfps=250.0\ntotal_size={i * 65536}\nout_time_us={i * 60000000 // LINES}\n'
+                     f'bitrate=5000.0kbits/s\nspeed=10.0x\nprogress={"end" if i == LINES else "continue"}\n')
+    sys.stderr.flush()
+    time.sleep(1 / RATE)
+source = inputs[0]
+if source.endswith('input.txt'):
+    # concat demuxer: copy the first listed file
+    source = open(source).readline().split("'")[1]
+if output == 'pipe:1':
+    shutil.copyfileobj(sys.stdin.buffer, sys.stdout.buffer)
+else:
+    shutil.copy(source, output)
+'''
+
+FFPROBE_STUB = r'''
+import json
+print(json.dumps({
+    'format': {'duration': '60.000000'},
+    'streams': [
+        {'codec_type': 'video', 'codec_name': 'h264', 'profile': 'High', 'width': 1920, 'height': 1080,
+         'pix_fmt': 'yuv420p', 'time_base': '1/1000'},
+        {'codec_type': 'audio', 'codec_name': 'aac', 'sample_rate': '48000', 'channels': 2},
+    ],
+}))
+'''
+
+ARIA2C_STUB = r'''
+import os, sys, time
+LINES = int(os.environ.get('BENCH_LINES', 100))
+RATE = float(os.environ.get('BENCH_RATE', 100))
+SIZE = 64 << 20
+options = dict(a[2:].split('=', 1) for a in sys.argv[1:] if a.startswith('--') and '=' in a)
+url = sys.argv[-1]
+path = os.path.join(options['dir'], options.get('out') or os.path.basename(url))
+for i in range(1, LINES + 1):
+    done = SIZE * i // LINES
+    print(f'[#2089b0 {done / 1048576:.1f}MiB/{SIZE / 1048576:.1f}MiB({i * 100 // LINES}%) CN:4 '
+          f'DL:{SIZE * RATE / LINES / 1048576:.1f}MiB ETA:{int((LINES - i) / RATE)}s]', flush=True)
+    time.sleep(1 / RATE)
+os.makedirs(options['dir'], exist_ok=True)
+with open(path, 'wb') as f:
+    f.truncate(SIZE)
+print(f'Download complete: {path}', flush=True)
+'''
+
+class FakeStatus:
+    """Stands in for a Pyrogram status message and counts the edits it receives."""
+    chat = None
+
+    def __init__(self):
+        self.edits = 0
+        self.text = None
+
+    async def edit_text(self, text):
+        self.edits += 1
+        self.text = text
+
+    async def delete(self):
+        pass
+
+    async def reply_text(self, text):
+        return FakeStatus()
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up a task sleeping ``interval`` seconds.
+
+    Anything that blocks the loop (a synchronous read, a long computation)
+    shows up as lag, since nothing else can run meanwhile.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(time.perf_counter() - start - self.interval)
+
+    @property
+    def max_ms(self):
+        return max(self.samples, default=0.0) * 1000
+
+    @property
+    def p99_ms(self):
+        if len(self.samples) < 2:
+            return self.max_ms
+        # Inclusive: the default method extrapolates past the largest sample when there are few
+        return statistics.quantiles(self.samples, n=100, method='inclusive')[98] * 1000
+
+    async def __aenter__(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+class Benchmark:
+    """Collects result rows and applies the --max-lag-ms gate."""
+
+    def __init__(self, max_lag_ms=None):
+        self.max_lag_ms = max_lag_ms
+        self.rows = []
+        self.failed = []
+
+    def add(self, name, seconds, monitor=None, detail=''):
+        row = f"{name:<28} {seconds * 1000:>10.1f} ms"
+        if monitor is not None:
+            row += f"   loop lag max {monitor.max_ms:7.2f} ms, p99 {monitor.p99_ms:6.2f} ms"
+            if self.max_lag_ms is not None and monitor.max_ms > self.max_lag_ms:
+                self.failed.append(name)
+                row += "   SLOW"
+        if detail:
+            row += f"   {detail}"
+        self.rows.append(row)
+        print(row, flush=True)
+
+    async def run(self, name, coroutine, detail=None):
+        """Time one coroutine while watching the event loop; returns its result."""
+        async with LoopLagMonitor() as monitor:
+            start = time.perf_counter()
+            result = await coroutine
+            seconds = time.perf_counter() - start
+        self.add(name, seconds, monitor, detail(result) if detail else '')
+        return result
+
+def write_stub(directory, name, source):
+    path = os.path.join(directory, name)
+    with open(path, 'w') as f:
+        f.write(f"#!{sys.executable}\n{source}")
+    os.chmod(path, 0o755)
+
+def make_file(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.truncate(size)
+
+def bench_parsers(bench, count=100000):
+    """CPU time per line of each progress parser."""
+    parser = FFmpegProgressParser(60.0)
+    block = ['frame=1500', 'fps=250.0', 'total_size=10485760', 'out_time_us=60000000',
+             'bitrate=5000.0kbits/s', 'speed=10.0x', 'progress=continue']
+    ffmpeg_lines = (block * (count // len(block) + 1))[:count]
+    rclone_line = ('{"level":"notice","msg":"stats","stats":{"bytes":524288000,"totalBytes":1048576000,'
+                   '"speed":10485760,"eta":50,"transfers":0,"totalTransfers":1,"errors":0,"checks":0,'
+                   '"elapsedTime":5,"transferring":[{"name":"clip.mkv","size":1048576000,"bytes":524288000,'
+                   '"percentage":50,"speed":10485760,"eta":50}]}}')
+    aria2_line = '[#2089b0 400.0KiB/33.2MiB(1%) CN:1 DL:115.7KiB ETA:4m51s]'
+
+    for name, func, lines in (
+        ('parse ffmpeg -progress', parser.feed, ffmpeg_lines),
+        ('parse rclone json log', parse_rclone_log, [rclone_line] * count),
+        ('parse aria2c summary', ARIA2_PROGRESS.search, [aria2_line] * count),
+    ):
+        start = time.process_time()
+        for line in lines:
+            func(line)
+        seconds = time.process_time() - start
+        bench.add(name, seconds, detail=f"{seconds / count * 1e6:.2f} µs/line CPU")
+
+async def bench_operations(bench, work, args):
+    """Each operation on its own, with stub binaries."""
+    remote = os.environ['BENCH_REMOTE']
+    make_file(os.path.join(remote, 'single', 'clip.mkv'), 8 << 20)
+    lines = lambda status: f"{status.edits} status edits"
+
+    status = FakeStatus()
+    await bench.run('download (rclone copy)', download(status, 'single', os.path.join(work, 'download'), 'bench', '/dev/null'),
+                    lambda _: lines(status))
+
+    parts = os.path.join(work, 'parts')
+    for index in range(3):
+        make_file(os.path.join(parts, f'part{index}.mkv'), 4 << 20)
+    status = FakeStatus()
+    await bench.run('merge (3 parts)', merge(status, parts, 'merged.mkv', 'Title', '0:a'), lambda _: lines(status))
+
+    status = FakeStatus()
+    await bench.run('changeindex', changeindex(status, parts, 'part0.mkv', 'index.mkv', 'Title', '0:a'), lambda _: lines(status))
+
+    with open(os.path.join(parts, 'part0.srt'), 'w') as f:
+        f.write("1\n00:00:01,000 --> 00:00:02,000\nHello\n")
+    status = FakeStatus()
+    await bench.run('softmux', softmux(status, parts, 'part0.mkv', 'softmux.mkv', 'Title', '0:a', 'part0.srt'), lambda _: lines(status))
+
+    status = FakeStatus()
+    await bench.run('changeindex (streaming)',
+                    changeindex(status, None, 'clip.mkv', 'streamed.mkv', 'Title', '0:a',
+                                source='bench:single/clip.mkv', destination='bench:out/streamed.mkv',
+                                rclone_config_path='/dev/null'),
+                    lambda _: lines(status))
+
+    status = FakeStatus()
+    await bench.run('upload (rclone copy)', upload(status, os.path.join(parts, 'merged.mkv'), 'out', 'bench', '/dev/null'),
+                    lambda _: lines(status))
+
+    status = FakeStatus()
+    await bench.run('aria2c download', aria2_download(status, 'https://example.com/file.bin', os.path.join(work, 'aria2')),
+                    lambda _: lines(status))
+
+async def bench_concurrency(bench, work, args):
+    """Many downloads at once through the JobScheduler."""
+    remote = os.environ['BENCH_REMOTE']
+    for index in range(args.jobs):
+        make_file(os.path.join(remote, 'many', f'clip{index}.mkv'), 4 << 20)
+    scheduler = JobScheduler(network_limit=args.jobs)
+
+    async def run_all():
+        jobs = [
+            scheduler.submit(0, 'download', NETWORK_JOB, download, FakeStatus(), f'many/clip{index}.mkv',
+                             os.path.join(work, 'many', str(index)), 'bench', '/dev/null')
+            for index in range(args.jobs)
+        ]
+        return await asyncio.gather(*(job.task for job in jobs))
+
+    start = time.perf_counter()
+    results = await bench.run(f'{args.jobs} concurrent downloads', run_all(),
+                              lambda results: f"{sum(1 for r in results if r)}/{args.jobs} ok")
+    seconds = time.perf_counter() - start
+    bench.add('  throughput', seconds, detail=f"{args.jobs / seconds:.2f} jobs/s, "
+                                              f"{args.jobs * args.lines / seconds:.0f} progress lines/s")
+    return results
+
+async def bench_pipeline(bench, work, args):
+    """download -> changeindex -> upload over several items, stages overlapping."""
+    remote = os.environ['BENCH_REMOTE']
+    items = []
+    for index in range(args.items):
+        make_file(os.path.join(remote, 'pipeline', f'item{index}', 'clip.mkv'), 4 << 20)
+        items.append({'remote_path': f'pipeline/item{index}', 'local_path': os.path.join(work, 'pipeline', f'item{index}')})
+
+    async def download_stage(item):
+        return item if await download(FakeStatus(), item['remote_path'], item['local_path'], 'bench', '/dev/null') else None
+
+    async def process_stage(item):
+        output = await changeindex(FakeStatus(), item['local_path'], 'clip.mkv', 'out.mkv', 'Title', '0:a')
+        return dict(item, output=output) if output else None
+
+    async def upload_stage(item):
+        return item if await upload(FakeStatus(), item['output'], 'pipeline-out', 'bench', '/dev/null') else None
+
+    stages = [('download', download_stage), ('changeindex', process_stage), ('upload', upload_stage)]
+    await bench.run(f'pipeline ({args.items} items)', run_pipeline(items, stages),
+                    lambda results: f"{sum(1 for r in results if r)}/{args.items} ok")
+
+async def bench_real_ffmpeg(bench, work):
+    """merge / changeindex / softmux with the real ffmpeg on generated testsrc clips."""
+    clips = os.path.join(work, 'clips')
+    os.makedirs(clips)
+    for index in range(3):
+        process = await asyncio.create_subprocess_exec(
+            'ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', 'testsrc=duration=5:size=640x360:rate=25',
+            '-f', 'lavfi', '-i', 'sine=duration=5', '-c:v', 'libx264', '-preset', 'ultrafast',
+            '-c:a', 'aac', '-shortest', os.path.join(clips, f'clip{index}.mkv'))
+        if await process.wait() != 0:
+            print("Could not generate testsrc clips, skipping the real ffmpeg benchmarks")
+            return
+    with open(os.path.join(clips, 'clip0.srt'), 'w') as f:
+        f.write("1\n00:00:01,000 --> 00:00:02,000\nHello\n")
+
+    await bench.run('real merge (3 x 5s)', merge(FakeStatus(), clips, 'merged.mkv', 'Title', '0:a'))
+    await bench.run('real changeindex', changeindex(FakeStatus(), clips, 'clip0.mkv', 'index.mp4', 'Title', '0:a'))
+    await bench.run('real softmux', softmux(FakeStatus(), clips, 'clip0.mkv', 'softmux.mp4', 'Title', '0:a', 'clip0.srt'))
+
+async def main(args):
+    real_ffmpeg = shutil.which('ffmpeg')
+    work = tempfile.mkdtemp(prefix='rclmerge-bench-')
+    stubs = os.path.join(work, 'bin')
+    ffmpeg_stubs = os.path.join(work, 'ffbin')
+    os.makedirs(stubs)
+    os.makedirs(ffmpeg_stubs)
+    write_stub(stubs, 'rclone', RCLONE_STUB)
+    write_stub(stubs, 'aria2c', ARIA2C_STUB)
+    write_stub(ffmpeg_stubs, 'ffmpeg', FFMPEG_STUB)
+    write_stub(ffmpeg_stubs, 'ffprobe', FFPROBE_STUB)
+
+    path = os.environ.get('PATH', '')
+    os.environ.update(BENCH_LINES=str(args.lines), BENCH_RATE=str(args.rate), BENCH_REMOTE=os.path.join(work, 'remote'))
+    os.environ['PATH'] = os.pathsep.join([stubs, ffmpeg_stubs, path])
+
+    bench = Benchmark(args.max_lag_ms)
+    print(f"{args.lines} progress lines per process at {args.rate:g} lines/s\n")
+    try:
+        bench_parsers(bench)
+        await bench_operations(bench, work, args)
+        await bench_concurrency(bench, work, args)
+        await bench_pipeline(bench, work, args)
+        if real_ffmpeg:
+            os.environ['PATH'] = os.pathsep.join([stubs, path])
+            await bench_real_ffmpeg(bench, work)
+        else:
+            print("ffmpeg not found, skipping the real ffmpeg benchmarks")
+    finally:
+        os.environ['PATH'] = path
+        shutil.rmtree(work, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write("\n".join(bench.rows) + "\n")
+    if bench.failed:
+        print(f"\nEvent loop blocked for more than {args.max_lag_ms} ms in: {', '.join(bench.failed)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the rclone/aria2c/ffmpeg processing pipeline.")
+    parser.add_argument('--lines', type=int, default=200, help="progress lines printed by each stub process")
+    parser.add_argument('--rate', type=float, default=200, help="progress lines per second of each stub process")
+    parser.add_argument('--jobs', type=int, default=4, help="concurrent downloads in the concurrency benchmark")
+    parser.add_argument('--items', type=int, default=4, help="items in the pipeline benchmark")
+    parser.add_argument('--max-lag-ms', type=float, default=None, help="fail if the event loop is ever blocked longer")
+    parser.add_argument('--output', default='bench_output.txt', help="file the results are written to")
+    sys.exit(asyncio.run(main(parser.parse_args())))
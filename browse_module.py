@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import itertools
+from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from progress_module import format_bytes
+
+logger = logging.getLogger(__name__)
+
+# Entries shown per keyboard page
+PAGE_SIZE = 8
+
+# Prefix of the browser's callback data: "br:<session>:<action>[:<argument>]"
+CALLBACK_PREFIX = "br:"
+
+class BrowserSession:
+    """One user's walk through a remote, waiting for them to pick a path."""
+
+    def __init__(self, session_id, owner, remote_name, path):
+        self.id = session_id
+        self.owner = owner
+        self.remote_name = remote_name
+        self.path = path.strip('/')
+        self.page = 0
+        self.entries = []
+        self.choice = asyncio.get_running_loop().create_future()
+
+    def child(self, name):
+        return f"{self.path}/{name}" if self.path else name
+
+class RemoteBrowser:
+    """
+    Lets users pick a remote path from inline keyboard pages instead of typing it.
+
+    Folders are listed through a ListingCache, so going back and forth
+    doesn't list the same folder twice. Tapping a folder opens it, tapping a
+    file or "Download this folder" picks it.
+
+    Parameters:
+    - listings (ListingCache): The listing cache.
+    - page_size (int): Entries per page.
+    - timeout (float): Seconds to wait for a pick before giving up.
+    """
+
+    def __init__(self, listings, page_size=PAGE_SIZE, timeout=600):
+        self.listings = listings
+        self.page_size = page_size
+        self.timeout = timeout
+        self.sessions = {}
+        self._ids = itertools.count(1)
+
+    async def choose(self, message, remote_name, path=''):
+        """
+        Show a browser below ``message`` and wait for the user to pick a path.
+
+        Returns:
+        - str: The picked path, or None if the browser was cancelled or timed out.
+        """
+        session = BrowserSession(str(next(self._ids)), message.from_user.id, remote_name, path)
+        self.sessions[session.id] = session
+        browser = await message.reply_text(f"Listing `{remote_name}:{session.path}`..")
+        try:
+            await self._show(browser, session)
+            return await asyncio.wait_for(session.choice, self.timeout)
+        except asyncio.TimeoutError:
+            await browser.edit_text("Path selection timed out.")
+            return None
+        finally:
+            self.sessions.pop(session.id, None)
+
+    async def _show(self, browser, session):
+        entries = await self.listings.get(session.remote_name, session.path, recursive=False)
+        if entries is None:
+            await browser.edit_text(f"Could not list `{session.remote_name}:{session.path}`.",
+                                    reply_markup=self._keyboard(session, []))
+            session.entries = []
+            return
+        # Folders first, then files, each by name
+        session.entries = sorted(entries, key=lambda entry: (not entry.get('IsDir'), entry.get('Path', '').lower()))
+        pages = max(1, -(-len(session.entries) // self.page_size))
+        session.page = min(session.page, pages - 1)
+        folders = sum(1 for entry in session.entries if entry.get('IsDir'))
+        files = len(session.entries) - folders
+        size = sum(max(entry.get('Size', 0), 0) for entry in session.entries if not entry.get('IsDir'))
+        text = (f"**Browse** `{session.remote_name}:{session.path or '/'}`\n"
+                f"{folders} folder(s), {files} file(s) ({format_bytes(size)}) | page {session.page + 1}/{pages}")
+        await browser.edit_text(text, reply_markup=self._keyboard(session, session.entries))
+
+    def _keyboard(self, session, entries):
+        data = f"{CALLBACK_PREFIX}{session.id}:"
+        start = session.page * self.page_size
+        rows = []
+        for index, entry in enumerate(entries[start:start + self.page_size], start):
+            name = entry.get('Path', '')
+            label = f"📁 {name}" if entry.get('IsDir') else f"{name} ({format_bytes(entry.get('Size', 0))})"
+            rows.append([InlineKeyboardButton(label, callback_data=f"{data}open:{index}")])
+        navigation = []
+        if session.path:
+            navigation.append(InlineKeyboardButton("⬆ Up", callback_data=f"{data}up"))
+        if session.page > 0:
+            navigation.append(InlineKeyboardButton("◀ Prev", callback_data=f"{data}page:{session.page - 1}"))
+        if start + self.page_size < len(entries):
+            navigation.append(InlineKeyboardButton("Next ▶", callback_data=f"{data}page:{session.page + 1}"))
+        if navigation:
+            rows.append(navigation)
+        rows.append([
+            InlineKeyboardButton("✅ Download this folder", callback_data=f"{data}pick"),
+            InlineKeyboardButton("✖ Cancel", callback_data=f"{data}cancel"),
+        ])
+        return InlineKeyboardMarkup(rows)
+
+    async def handle(self, callback_query):
+        """Handle a press on a browser button (callback data starting with CALLBACK_PREFIX)."""
+        session_id, _, action = callback_query.data[len(CALLBACK_PREFIX):].partition(':')
+        action, _, argument = action.partition(':')
+        session = self.sessions.get(session_id)
+        if session is None or session.choice.done():
+            await callback_query.answer("This browser has expired.")
+            return
+        if callback_query.from_user.id != session.owner:
+            await callback_query.answer("This browser belongs to someone else.")
+            return
+        await callback_query.answer()
+        browser = callback_query.message
+
+        if action == "open" and argument.isdigit() and int(argument) < len(session.entries):
+            entry = session.entries[int(argument)]
+            path = session.child(entry.get('Path', ''))
+            if not entry.get('IsDir'):
+                await browser.edit_text(f"Picked `{session.remote_name}:{path}`")
+                session.choice.set_result(path)
+                return
+            session.path, session.page = path, 0
+        elif action == "up":
+            session.path, session.page = session.path.rpartition('/')[0], 0
+        elif action == "page" and argument.isdigit():
+            session.page = int(argument)
+        elif action == "pick":
+            await browser.edit_text(f"Picked `{session.remote_name}:{session.path or '/'}`")
+            session.choice.set_result(session.path)
+            return
+        elif action == "cancel":
+            await browser.edit_text("Path selection cancelled.")
+            session.choice.set_result(None)
+            return
+        try:
+            await self._show(browser, session)
+        except Exception as e:
+            logger.error(f"Error showing browser for {session.remote_name}:{session.path}: {e}")
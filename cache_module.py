@@ -0,0 +1,279 @@
+import os
+import time
+from collections import OrderedDict
+import sqlite3
+import asyncio
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    local_path TEXT NOT NULL,
+    signature TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT NOT NULL,
+    hash_type TEXT NOT NULL,
+    signature TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (path, hash_type)
+);
+"""
+
+# Hashes rclone may report that can be computed locally, cheapest first
+LOCAL_HASHES = ('md5', 'sha1', 'sha256')
+
+def local_signature(path):
+    """
+    Describe the current state of a local file or folder: size, file count and newest mtime.
+
+    Returns:
+    - str: The signature, or None if the path doesn't exist.
+    """
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return f"{stat.st_size}:1:{stat.st_mtime_ns}"
+    if not os.path.isdir(path):
+        return None
+    size = count = newest = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            size += stat.st_size
+            count += 1
+            newest = max(newest, stat.st_mtime_ns)
+    return f"{size}:{count}:{newest}"
+
+def remote_fingerprint(entries):
+    """
+    Fingerprint an ``rclone lsjson`` listing from its paths, sizes and modification times.
+
+    Returns:
+    - str: A hash of the listing, or None for an empty or missing listing.
+    """
+    if not entries:
+        return None
+    digest = hashlib.sha1()
+    for entry in sorted(entries, key=lambda e: e.get('Path', '')):
+        digest.update(f"{entry.get('Path')}|{entry.get('Size')}|{entry.get('ModTime')}\n".encode())
+    return digest.hexdigest()
+
+def _hash_file(path, hash_type, chunk_size=1024 * 1024):
+    digest = hashlib.new(hash_type)
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def local_files(local_path):
+    """
+    List the files ``rclone copy local_path remote:dir`` would create, as (relative path, local path).
+
+    A file is copied into the directory under its own name, a folder's contents keep their layout.
+    """
+    if os.path.isfile(local_path):
+        return [(os.path.basename(local_path), local_path)]
+    files = []
+    for root, _, names in os.walk(local_path):
+        for name in names:
+            path = os.path.join(root, name)
+            files.append((os.path.relpath(path, local_path).replace(os.sep, '/'), path))
+    return files
+
+class ContentIndex:
+    """
+    Persistent index of content already on the local disk, to skip redundant transfers.
+
+    Sources (a URL, or ``remote:path``) map to the local file or folder they
+    were downloaded to, together with a fingerprint of the source (its size,
+    or a listing of the remote) and a signature of the local copy. A lookup
+    only hits while both are unchanged, so a modified source or a deleted or
+    edited local copy is downloaded again. The least recently used entries
+    beyond ``max_entries`` are dropped.
+
+    Local file hashes, used to check whether a remote already has a file
+    before uploading it, are cached by path, size and mtime.
+
+    Parameters:
+    - path (str): The SQLite database file.
+    - max_entries (int): The number of sources remembered.
+    """
+
+    def __init__(self, path, max_entries=1000):
+        self.path = path
+        self.max_entries = max_entries
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def lookup(self, key, fingerprint):
+        """
+        Return the local copy of a source, or None if there is no valid one.
+
+        Parameters:
+        - key (str): The source, e.g. 'url:https://...' or 'rclone:remote:path'.
+        - fingerprint (str): The source's current fingerprint.
+        """
+        row = self.db.execute(
+            "SELECT fingerprint, local_path, signature FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        stored_fingerprint, local_path, signature = row
+        if stored_fingerprint != fingerprint or local_signature(local_path) != signature:
+            with self.db:
+                self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            return None
+        with self.db:
+            self.db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        logger.info(f"Content index hit for {key}: {local_path}")
+        return local_path
+
+    def store(self, key, fingerprint, local_path):
+        """Remember that a source with ``fingerprint`` was downloaded to ``local_path``."""
+        signature = local_signature(local_path)
+        if fingerprint is None or signature is None:
+            return
+        try:
+            with self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO entries (key, fingerprint, local_path, signature, last_used) VALUES (?, ?, ?, ?, ?)",
+                    (key, fingerprint, local_path, signature, time.time())
+                )
+                self.db.execute(
+                    "DELETE FROM entries WHERE key NOT IN (SELECT key FROM entries ORDER BY last_used DESC LIMIT ?)",
+                    (self.max_entries,)
+                )
+                # Hashes of files no longer indexed (or long gone) aren't worth keeping forever
+                self.db.execute(
+                    "DELETE FROM hashes WHERE rowid NOT IN (SELECT rowid FROM hashes ORDER BY rowid DESC LIMIT ?)",
+                    (self.max_entries * 10,)
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Error writing content index {self.path}: {e}")
+
+    async def file_hash(self, path, hash_type):
+        """Return the hex digest of a local file, hashing it in a thread unless cached."""
+        signature = local_signature(path)
+        row = self.db.execute(
+            "SELECT signature, hash FROM hashes WHERE path = ? AND hash_type = ?", (path, hash_type)
+        ).fetchone()
+        if row is not None and row[0] == signature:
+            return row[1]
+        digest = await asyncio.to_thread(_hash_file, path, hash_type)
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO hashes (path, hash_type, signature, hash) VALUES (?, ?, ?, ?)",
+                (path, hash_type, signature, digest)
+            )
+        return digest
+
+    async def already_uploaded(self, local_path, remote_entries):
+        """
+        Check whether a remote already has every file ``rclone copy local_path`` would upload.
+
+        Parameters:
+        - local_path (str): The file or folder to upload.
+        - remote_entries (list): ``rclone lsjson -R --hash`` of the destination.
+
+        Returns:
+        - bool: True only if every file is there with the same size and a
+          matching hash. Without a hash both sides support, rclone decides.
+        """
+        if remote_entries is None:
+            return False
+        remote = {entry.get('Path'): entry for entry in remote_entries}
+        files = local_files(local_path)
+        if not files:
+            return False
+        for relative, path in files:
+            entry = remote.get(relative)
+            if entry is None or entry.get('Size') != os.path.getsize(path):
+                return False
+            hashes = {name.lower(): value for name, value in (entry.get('Hashes') or {}).items() if value}
+            hash_type = next((name for name in LOCAL_HASHES if name in hashes), None)
+            if hash_type is None:
+                return False
+            if await self.file_hash(path, hash_type) != hashes[hash_type].lower():
+                return False
+        return True
+
+    def close(self):
+        self.db.close()
+
+def listing_totals(entries):
+    """
+    Sum up an ``rclone lsjson`` listing.
+
+    Returns:
+    - tuple: (file count, total size in bytes), or (None, None) for a failed listing.
+    """
+    if entries is None:
+        return None, None
+    files = [entry for entry in entries if not entry.get('IsDir')]
+    return len(files), sum(max(entry.get('Size', 0), 0) for entry in files)
+
+class ListingCache:
+    """
+    In-memory TTL/LRU cache of remote listings.
+
+    Listing a large Drive folder takes seconds, and the browser, the size
+    check and the content index fingerprint of a download all need the same
+    listing. Concurrent requests for a listing that is being fetched wait for
+    that fetch instead of starting another one; failed listings aren't cached.
+
+    Parameters:
+    - fetch (callable): async (remote_path, remote_name, recursive) -> list or None.
+    - ttl (float): Seconds a listing stays valid.
+    - max_entries (int): The number of listings kept.
+    """
+
+    def __init__(self, fetch, ttl=300, max_entries=256):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.listings = OrderedDict()  # (remote, path, recursive) -> (fetched at, entries)
+        self._pending = {}
+
+    async def get(self, remote_name, remote_path, recursive=True):
+        """Return the (possibly cached) listing of ``remote_name:remote_path``, or None on failure."""
+        key = (remote_name, remote_path.strip('/'), recursive)
+        cached = self.listings.get(key)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl:
+            self.listings.move_to_end(key)
+            return cached[1]
+        if key not in self._pending:
+            self._pending[key] = asyncio.ensure_future(self._fetch(key))
+        return await asyncio.shield(self._pending[key])
+
+    async def _fetch(self, key):
+        remote_name, remote_path, recursive = key
+        try:
+            entries = await self.fetch(remote_path, remote_name, recursive)
+        finally:
+            self._pending.pop(key, None)
+        if entries is not None:
+            self.listings[key] = (time.monotonic(), entries)
+            self.listings.move_to_end(key)
+            while len(self.listings) > self.max_entries:
+                self.listings.popitem(last=False)
+        return entries
+
+    def invalidate(self, remote_name, remote_path=None):
+        """Drop the cached listings of a remote, or of a path and the folders containing it."""
+        path = remote_path.strip('/') if remote_path is not None else None
+        for key in list(self.listings):
+            name, listed, _ = key
+            if name != remote_name:
+                continue
+            if path is None or listed == '' or path == listed or path.startswith(listed + '/') or listed.startswith(path + '/'):
+                del self.listings[key]
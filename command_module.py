@@ -0,0 +1,90 @@
+import os
+import json
+import shlex
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Arguments a preset may hold
+PRESET_KEYS = ('title', 'map', 'profile', 'remote')
+
+# The preset applied when a command doesn't name one
+DEFAULT_PRESET = 'default'
+
+def parse_command_args(text):
+    """
+    Split a command message into positional and ``key=value`` arguments.
+
+    Values may be quoted, e.g. ``/merge path=/downloads/x title="REPACKED BY @thetgflix"``.
+
+    Returns:
+    - tuple: (list of positional arguments, dict of key=value arguments),
+      both without the command itself.
+    """
+    try:
+        tokens = shlex.split(text or '')
+    except ValueError:
+        # Unbalanced quotes: fall back to plain whitespace splitting
+        tokens = (text or '').split()
+    positional = []
+    args = {}
+    for token in tokens[1:]:
+        key, sep, value = token.partition('=')
+        if sep and key.isidentifier():
+            args[key.lower()] = value
+        else:
+            positional.append(token)
+    return positional, args
+
+class PresetStore:
+    """
+    Named sets of command arguments saved per user, kept in a JSON file.
+
+    Parameters:
+    - path (str): The JSON file, {user_id: {preset name: {key: value}}}.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.presets = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.presets = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"Error loading presets {path}: {e}")
+
+    def _save(self):
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump(self.presets, f, indent=2)
+        os.replace(temporary_path, self.path)
+
+    def get(self, user_id, name):
+        """Return a user's preset as a dict, or None if it doesn't exist."""
+        return self.presets.get(str(user_id), {}).get(name)
+
+    def list(self, user_id):
+        return self.presets.get(str(user_id), {})
+
+    def save(self, user_id, name, values):
+        """
+        Store a preset, keeping only the keys in PRESET_KEYS.
+
+        Returns:
+        - dict: The saved values; empty (and nothing saved) if no key was valid.
+        """
+        values = {key: value for key, value in values.items() if key in PRESET_KEYS}
+        if not values:
+            # Don't replace an existing preset with nothing
+            return values
+        self.presets.setdefault(str(user_id), {})[name] = values
+        self._save()
+        return values
+
+    def delete(self, user_id, name):
+        """Remove a preset; returns False if it didn't exist."""
+        if self.presets.get(str(user_id), {}).pop(name, None) is None:
+            return False
+        self._save()
+        return True
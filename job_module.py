@@ -0,0 +1,228 @@
+import asyncio
+import itertools
+import logging
+from contextvars import ContextVar
+from datetime import datetime
+from metrics_module import metrics
+
+logger = logging.getLogger(__name__)
+
+# Job kinds, each limited by its own concurrency slot pool
+NETWORK_JOB = 'network'    # rclone / aria2c transfers
+UPLOAD_JOB = 'upload'      # uploads; own pool so downloads waiting for disk space can't starve them
+DISK_JOB = 'disk'          # ffmpeg remuxing
+PIPELINE_JOB = 'pipeline'  # multi-stage jobs, each stage takes its own slot
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+# The job whose task is currently executing, used by rc_module.run_process to
+# attach spawned processes to the right job for cancellation.
+current_job = ContextVar('current_job', default=None)
+
+class Job:
+    """
+    A unit of work owned by a user and tracked by the JobScheduler.
+
+    Attributes:
+    - id (int): The job ID shown to users.
+    - owner (int): The Telegram user ID that submitted the job.
+    - name (str): The operation name (e.g. 'download', 'merge').
+    - kind (str): NETWORK_JOB, UPLOAD_JOB, DISK_JOB or PIPELINE_JOB.
+    - state (str): One of QUEUED, RUNNING, DONE, FAILED or CANCELLED.
+    """
+
+    def __init__(self, job_id, owner, name, kind):
+        self.id = job_id
+        self.owner = owner
+        self.name = name
+        self.kind = kind
+        self.state = QUEUED
+        self.created = datetime.now()
+        self.started = None
+        self.finished = None
+        self.processes = set()
+        self.task = None
+
+    @property
+    def active(self):
+        return self.state in ACTIVE_STATES
+
+    def elapsed(self):
+        """Return the running (or total) time of the job as a timedelta."""
+        if self.started is None:
+            return datetime.now() - self.created
+        return (self.finished or datetime.now()) - self.started
+
+    def describe(self):
+        elapsed = str(self.elapsed()).split('.')[0]
+        return f"`#{self.id}` **{self.name}** - {self.state} ({elapsed})"
+
+    def cancel(self):
+        """
+        Terminate the job's processes and cancel its task (or drop it if it has
+        not started yet), so the runner stops without reporting completion.
+        """
+        if not self.active:
+            return False
+        for proc in list(self.processes):
+            if proc.returncode is None:
+                try:
+                    proc.terminate()
+                except ProcessLookupError:
+                    pass
+        # Set first: runners cleaning up on CancelledError check job.active
+        self.state = CANCELLED
+        if self.task is not None:
+            self.task.cancel()
+        return True
+
+class RemoteSlots:
+    """
+    Caps the concurrent transfers to each rclone remote, across all jobs.
+
+    Parameters:
+    - limit (int): Max concurrent transfers per remote.
+    """
+
+    def __init__(self, limit=2):
+        self.limit = limit
+        self._slots = {}
+
+    def slot(self, remote_name):
+        """Return the semaphore limiting transfers to ``remote_name``."""
+        if remote_name not in self._slots:
+            self._slots[remote_name] = asyncio.Semaphore(self.limit)
+        return self._slots[remote_name]
+
+class JobScheduler:
+    """
+    Registry of user jobs that runs them concurrently up to per-kind limits.
+
+    Parameters:
+    - network_limit (int): Max concurrent NETWORK_JOB jobs.
+    - disk_limit (int): Max concurrent DISK_JOB jobs.
+    - upload_limit (int): Max concurrent UPLOAD_JOB jobs.
+    - history (int): Number of finished jobs kept for /jobs.
+    - journal (JobJournal): If given, job state changes are persisted to it
+      and job IDs continue after the highest one it has seen.
+    """
+
+    def __init__(self, network_limit=3, disk_limit=1, upload_limit=2, history=50, journal=None):
+        self.limits = {NETWORK_JOB: network_limit, DISK_JOB: disk_limit, UPLOAD_JOB: upload_limit}
+        self.history = history
+        self.journal = journal
+        self.jobs = {}
+        self._ids = itertools.count((journal.last_id() if journal is not None else 0) + 1)
+        self._slots = None
+        self._writes = set()
+
+    def slot(self, kind):
+        """Return the semaphore limiting concurrent work of ``kind``."""
+        # Semaphores are created lazily so they bind to the running loop
+        if self._slots is None:
+            self._slots = {k: asyncio.Semaphore(v) for k, v in self.limits.items()}
+        return self._slots[kind]
+
+    def submit(self, owner, name, kind, func, *args, **kwargs):
+        """
+        Queue ``func(*args, **kwargs)`` as a new job and return it.
+
+        The coroutine is only created once a slot for ``kind`` is free.
+        """
+        return self._start(Job(self.new_id(), owner, name, kind), func, *args, **kwargs)
+
+    def new_id(self):
+        """Allocate the next job ID, e.g. for a job a worker process will run."""
+        return next(self._ids)
+
+    def resubmit(self, job_id, owner, name, kind, func, *args, **kwargs):
+        """Queue a job from the journal again under its original ID."""
+        return self._start(Job(job_id, owner, name, kind), func, *args, **kwargs)
+
+    def _start(self, job, func, *args, **kwargs):
+        self.jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job, func, *args, **kwargs))
+        self._prune()
+        return job
+
+    async def _journal_state(self, job):
+        if self.journal is not None:
+            # The journal file is shared with other processes and may wait on their lock
+            await asyncio.to_thread(self.journal.set_state, job.id, job.state)
+
+    async def _run(self, job, func, *args, **kwargs):
+        try:
+            if job.kind == PIPELINE_JOB:
+                # Pipeline stages acquire NETWORK_JOB/DISK_JOB/UPLOAD_JOB slots themselves
+                return await self._execute(job, func, *args, **kwargs)
+            async with self.slot(job.kind):
+                return await self._execute(job, func, *args, **kwargs)
+        except asyncio.CancelledError:
+            # Not journaled: a task cancelled by the bot shutting down is resumed
+            # on the next start, only cancel() records a user's cancellation.
+            job.state = CANCELLED
+            raise
+        except Exception as e:
+            job.state = FAILED
+            logger.error(f"Job #{job.id} ({job.name}) failed: {e}")
+            await self._journal_state(job)
+        finally:
+            job.finished = datetime.now()
+            job.processes.clear()
+
+    async def _execute(self, job, func, *args, **kwargs):
+        if job.state == CANCELLED:
+            return None
+        job.state = RUNNING
+        job.started = datetime.now()
+        metrics.record_queue_wait(job.name, (job.started - job.created).total_seconds())
+        current_job.set(job)
+        await self._journal_state(job)
+        result = await func(*args, **kwargs)
+        if job.state == RUNNING:
+            job.state = DONE
+            await self._journal_state(job)
+        return result
+
+    def _prune(self):
+        finished = [j for j in self.jobs.values() if not j.active]
+        for job in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[job.id]
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list(self, owner=None, active_only=False):
+        return [
+            j for j in self.jobs.values()
+            if (owner is None or j.owner == owner) and (j.active or not active_only)
+        ]
+
+    def cancel(self, job_id, owner=None):
+        """
+        Cancel a job by ID.
+
+        Parameters:
+        - job_id (int): The job to cancel.
+        - owner (int): If given, only a job owned by this user is cancelled.
+
+        Returns:
+        - str: A message describing the result.
+        """
+        job = self.jobs.get(job_id)
+        if job is None or (owner is not None and job.owner != owner):
+            return f"No job #{job_id} found."
+        if not job.cancel():
+            return f"Job #{job_id} is already {job.state}."
+        # Recorded in the background; the task is referenced until it's written
+        write = asyncio.create_task(self._journal_state(job))
+        self._writes.add(write)
+        write.add_done_callback(self._writes.discard)
+        return f"Job #{job_id} ({job.name}) cancelled."
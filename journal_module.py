@@ -0,0 +1,130 @@
+import json
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from job_module import ACTIVE_STATES
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    owner INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    state TEXT NOT NULL,
+    artefacts TEXT NOT NULL DEFAULT '{}',
+    created TEXT NOT NULL,
+    updated TEXT NOT NULL
+)
+"""
+
+class JobJournal:
+    """
+    On-disk record of submitted jobs, so unfinished ones can be resumed after a restart.
+
+    Each job is stored with the parameters it was submitted with, its state and
+    the artefacts of the stages it has completed (e.g. the output of a pipeline
+    item's merge). Writes are small and committed immediately, so whatever is
+    in the journal when the process dies is what a restart resumes from.
+
+    The bot and its workers share the file, so calls may wait on another
+    process's lock (up to 30s); async code calls them through
+    asyncio.to_thread. The connection is shared by those threads and
+    serialised by a lock.
+
+    Parameters:
+    - path (str): The SQLite database file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(SCHEMA)
+        self.db.commit()
+        self._lock = threading.Lock()
+
+    def _write(self, query, params):
+        try:
+            with self._lock, self.db:
+                self.db.execute(query, params)
+        except sqlite3.Error as e:
+            # The state only helps after a restart, never fail the job over it
+            logger.error(f"Error writing job journal {self.path}: {e}")
+
+    def record(self, job, chat_id, params):
+        """
+        Store a newly submitted job.
+
+        Parameters:
+        - job (Job): The submitted job.
+        - chat_id (int): The chat its status messages go to.
+        - params (dict): JSON serialisable arguments needed to run the job again.
+        """
+        now = datetime.now().isoformat()
+        self._write(
+            "INSERT OR REPLACE INTO jobs (id, owner, chat_id, name, kind, params, state, created, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job.id, job.owner, chat_id, job.name, job.kind, json.dumps(params), job.state, now, now)
+        )
+
+    def set_state(self, job_id, state):
+        self._write(
+            "UPDATE jobs SET state = ?, updated = ? WHERE id = ?",
+            (state, datetime.now().isoformat(), job_id)
+        )
+
+    def artefacts(self, job_id):
+        """Return the completed stages of a job as a dict of stage -> artefact."""
+        with self._lock:
+            return self._artefacts(job_id)
+
+    def _artefacts(self, job_id):
+        row = self.db.execute("SELECT artefacts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row['artefacts']) if row is not None else {}
+
+    def checkpoint(self, job_id, stage, artefact=None):
+        """
+        Record that ``stage`` of a job completed, producing ``artefact`` (e.g. a file path).
+
+        Raises:
+        - sqlite3.Error: If it could not be recorded; a resumed job would
+          redo (or duplicate) the stage, so this isn't ignored like state changes.
+        """
+        with self._lock, self.db:
+            artefacts = self._artefacts(job_id)
+            artefacts[stage] = artefact
+            self.db.execute(
+                "UPDATE jobs SET artefacts = ?, updated = ? WHERE id = ?",
+                (json.dumps(artefacts), datetime.now().isoformat(), job_id)
+            )
+
+    def unfinished(self):
+        """
+        Return the jobs that were queued or running when the bot stopped.
+
+        Returns:
+        - list: dicts with id, owner, chat_id, name, kind and params, oldest first.
+        """
+        placeholders = ", ".join("?" for _ in ACTIVE_STATES)
+        with self._lock:
+            rows = self.db.execute(
+                f"SELECT id, owner, chat_id, name, kind, params FROM jobs WHERE state IN ({placeholders}) ORDER BY id",
+                ACTIVE_STATES
+            ).fetchall()
+        return [dict(row, params=json.loads(row['params'])) for row in rows]
+
+    def last_id(self):
+        """Return the highest job ID ever recorded, or 0."""
+        with self._lock:
+            row = self.db.execute("SELECT MAX(id) FROM jobs").fetchone()
+        return row[0] or 0
+
+    def close(self):
+        with self._lock:
+            self.db.close()
@@ -0,0 +1,91 @@
+import os
+import gzip
+import queue
+import atexit
+import shutil
+import tempfile
+import logging
+from collections import deque
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FORMAT = "[%(asctime)s - %(levelname)s] - %(name)s - %(message)s"
+LOG_DATEFMT = '%d-%b-%y %H:%M:%S'
+
+class RingBufferHandler(logging.Handler):
+    """
+    Keeps the last ``capacity`` formatted log lines in memory, for /log N.
+
+    Parameters:
+    - capacity (int): The number of lines kept.
+    """
+
+    def __init__(self, capacity=5000):
+        super().__init__()
+        self.lines = deque(maxlen=capacity)
+
+    def emit(self, record):
+        try:
+            self.lines.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def tail(self, count):
+        """Return the last ``count`` lines, oldest first."""
+        # The listener thread appends under the same lock
+        with self.lock:
+            lines = list(self.lines)
+        return lines[-count:] if count > 0 else []
+
+def setup_logging(log_file, max_bytes=50000000, backup_count=10, buffer_lines=5000, level=logging.INFO):
+    """
+    Route all logging through a queue, so writing the log never blocks the event loop.
+
+    Loggers only put records on a queue; a QueueListener thread formats them
+    and writes them to the rotating log file, the console and an in-memory
+    ring buffer.
+
+    Parameters:
+    - log_file (str): The log file, rotated at ``max_bytes`` with ``backup_count`` backups.
+    - buffer_lines (int): The number of recent lines kept in memory.
+
+    Returns:
+    - RingBufferHandler: The in-memory buffer, see RingBufferHandler.tail.
+    """
+    formatter = logging.Formatter(LOG_FORMAT, datefmt=LOG_DATEFMT)
+    buffer = RingBufferHandler(buffer_lines)
+    handlers = [RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count), logging.StreamHandler(), buffer]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(records))
+    root.setLevel(level)
+
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    # Flush what is still queued when the process exits
+    atexit.register(listener.stop)
+    return buffer
+
+def compress_log(log_file):
+    """
+    Compress the current log file (rotation caps its size) into a new temporary gzip file.
+
+    Blocking; run it in a thread. Every call gets its own file, so concurrent
+    /log full requests don't overwrite each other; the caller removes it.
+
+    Returns:
+    - str: The path of the ``.gz`` file.
+    """
+    fd, archive_path = tempfile.mkstemp(prefix=f"{os.path.basename(log_file)}-", suffix='.gz')
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as archive:
+            with open(log_file, 'rb') as f:
+                shutil.copyfileobj(f, archive)
+    except BaseException:
+        os.remove(archive_path)
+        raise
+    return archive_path
@@ -1,12 +1,27 @@
 import os
-from shutil import rmtree
+import html
 import time
+import socket
+import asyncio
 from datetime import datetime
-import subprocess
-from pyrogram import filters, Client
+from pyrogram import filters, Client, idle
+from pyrogram.enums import ParseMode
 from pyromod import listen
 from urllib.parse import urlparse, parse_qs, unquote
-from rc_module import download, merge, upload, logger, LOG_FILE_NAME, cancel_download, changeindex, softmux
+from rc_module import download, merge, upload, upload_fanout, logger, log_buffer, LOG_FILE_NAME, changeindex, softmux, batch_remux, can_stream, find_media, rclone_lsjson, load_rclone_profiles, choose_rclone_profile, RCLONE_PROFILES, REMOTE_PROFILES, VIDEO_EXTENSIONS, SUBTITLE_EXTENSIONS
+from job_module import Job, JobScheduler, RemoteSlots, NETWORK_JOB, UPLOAD_JOB, DISK_JOB, PIPELINE_JOB, FAILED, current_job
+from journal_module import JobJournal
+from metrics_module import metrics
+from cache_module import ContentIndex, ListingCache, remote_fingerprint, listing_totals
+from browse_module import RemoteBrowser, CALLBACK_PREFIX
+from telegram_module import TelegramSender
+from queue_module import WorkQueue, QueueMessenger, relay_outbox, describe_task
+from worker_module import Worker
+from log_module import compress_log
+from command_module import PresetStore, parse_command_args, PRESET_KEYS, DEFAULT_PRESET
+from pipeline_module import run_pipeline
+from aria_module import aria2_download, aria2_rpc_download, parse_download_args, url_info, ConnectionBudget, Aria2RPC
+from workspace_module import Workspace, path_size, path_count
 from dotenv import load_dotenv
 from pyrogram.errors import FloodWait
 
@@ -15,18 +30,118 @@ load_dotenv()
 # Set the default local path
 DEFAULT_LOCAL_PATH = '/downloads'
 
+# Free space always kept on the DEFAULT_LOCAL_PATH disk, and whether job folders
+# are removed once their output has been uploaded
+DISK_SPACE_MARGIN_MB = int(os.environ.get("DISK_SPACE_MARGIN_MB", 512))
+AUTO_CLEANUP = os.environ.get("AUTO_CLEANUP", "true").lower() in ("1", "true", "yes")
+
 # Set the rclone configuration file path
 RCLONE_CONFIG_PATH = os.environ.get("RCLONE_CONFIG_PATH", "/path/to/rclone.conf")
 
+# Optional JSON file with extra rclone transfer profiles and per-remote defaults
+RCLONE_PROFILES_FILE = os.environ.get("RCLONE_PROFILES_FILE", "rclone_profiles.json")
+load_rclone_profiles(RCLONE_PROFILES_FILE)
+
 # Initialize Pyrogram client
 api_id = int(os.environ.get("API_ID", 0))  # Replace 0 with your actual API ID
 api_hash = os.environ.get("API_HASH", "")   # Replace "" with your actual API Hash
 bot_token = os.environ.get("BOT_TOKEN", "")  # Replace "" with your actual Bot Token
 
+# Concurrency limits for network-bound (rclone/aria2c) and disk-bound (ffmpeg) jobs
+MAX_NETWORK_JOBS = int(os.environ.get("MAX_NETWORK_JOBS", 3))
+MAX_DISK_JOBS = int(os.environ.get("MAX_DISK_JOBS", 1))
+# Uploads have their own limit: they free the disk space that waiting downloads and remuxes need
+MAX_UPLOAD_JOBS = int(os.environ.get("MAX_UPLOAD_JOBS", 2))
+
+# Remux single remote files rclone -> ffmpeg -> rclone without a local copy when possible
+STREAM_REMUX = os.environ.get("STREAM_REMUX", "true").lower() in ("1", "true", "yes")
+
+# Re-encode merge inputs whose streams differ from the rest instead of refusing
+# the merge (also per command with `/merge smart`)
+SMART_MERGE = os.environ.get("SMART_MERGE", "false").lower() in ("1", "true", "yes")
+
+# Number of files remuxed at once by /batchremux (default: one per core, at most 4)
+BATCH_REMUX_JOBS = int(os.environ.get("BATCH_REMUX_JOBS", 0)) or None
+
+# Total aria2c connections shared by all direct-URL downloads
+ARIA2_CONNECTION_BUDGET = int(os.environ.get("ARIA2_CONNECTION_BUDGET", 16))
+
+# Use a persistent aria2c RPC daemon instead of one aria2c process per URL
+ARIA2_RPC = os.environ.get("ARIA2_RPC", "false").lower() in ("1", "true", "yes")
+ARIA2_RPC_PORT = int(os.environ.get("ARIA2_RPC_PORT", 6800))
+ARIA2_RPC_SECRET = os.environ.get("ARIA2_RPC_SECRET", "")
+ARIA2_SESSION_FILE = os.environ.get("ARIA2_SESSION_FILE", "aria2.session")
+
+# SQLite journal of submitted jobs, unfinished ones are resumed when the bot starts
+JOB_JOURNAL_FILE = os.environ.get("JOB_JOURNAL_FILE", "jobs.sqlite3")
+
+# Index of downloaded content, so repeated downloads of an unchanged URL or
+# remote path are served from disk and uploads the remote already has are skipped
+DEDUPE = os.environ.get("DEDUPE", "true").lower() in ("1", "true", "yes")
+CONTENT_INDEX_FILE = os.environ.get("CONTENT_INDEX_FILE", "content_index.sqlite3")
+CONTENT_INDEX_SIZE = int(os.environ.get("CONTENT_INDEX_SIZE", 1000))
+
+# Uploads to several remotes run concurrently, at most this many per remote
+# (across all jobs); each copy is checked with `rclone check` afterwards
+MAX_UPLOADS_PER_REMOTE = int(os.environ.get("MAX_UPLOADS_PER_REMOTE", 2))
+VERIFY_UPLOADS = os.environ.get("VERIFY_UPLOADS", "true").lower() in ("1", "true", "yes")
+
+# Remote listings (for the /download browser, sizes and fingerprints) are
+# cached in memory for this many seconds
+LISTING_CACHE_TTL = int(os.environ.get("LISTING_CACHE_TTL", 300))
+LISTING_CACHE_SIZE = int(os.environ.get("LISTING_CACHE_SIZE", 256))
+
+# Outputs sent to the chat (`/merge telegram`, ...) are split into parts of
+# this size; at most TELEGRAM_UPLOADS parts are sent at once, sharing
+# TELEGRAM_UPLOAD_RATE_MB MB/s (0 for no cap)
+TELEGRAM_PART_SIZE_MB = int(os.environ.get("TELEGRAM_PART_SIZE_MB", 2000))
+TELEGRAM_UPLOADS = int(os.environ.get("TELEGRAM_UPLOADS", 2))
+TELEGRAM_UPLOAD_RATE_MB = float(os.environ.get("TELEGRAM_UPLOAD_RATE_MB", 0))
+
+# Deployment role: "all" runs everything in this process; "bot" only talks to
+# Telegram and queues jobs in WORK_QUEUE_FILE; "worker" runs queued jobs and
+# reports back through the queue (start several, each with its own WORKER_NAME).
+# Requeued jobs resume from the journal's checkpoints, so the bot and its
+# workers must share JOB_JOURNAL_FILE (like WORK_QUEUE_FILE and DEFAULT_LOCAL_PATH)
+BOT_ROLE = os.environ.get("BOT_ROLE", "all").lower()
+WORK_QUEUE_FILE = os.environ.get("WORK_QUEUE_FILE", "work_queue.sqlite3")
+WORKER_NAME = os.environ.get("WORKER_NAME", f"{socket.gethostname()}-{os.getpid()}")
+WORKER_JOBS = int(os.environ.get("WORKER_JOBS", MAX_NETWORK_JOBS + MAX_DISK_JOBS + MAX_UPLOAD_JOBS))
+# A worker silent for this long is presumed dead and its jobs are requeued
+WORKER_TIMEOUT = int(os.environ.get("WORKER_TIMEOUT", 60))
+
+# Saved per-user command presets (title, audio map, ...)
+PRESETS_FILE = os.environ.get("PRESETS_FILE", "presets.json")
+
+# Local port serving /stats metrics in Prometheus text format (0 disables it)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+
 app = Client("my_bot", api_id=api_id, api_hash=api_hash, bot_token=bot_token)
 
-# Initialize start time
-BotTimes = type("BotTimes", (object,), {"task_start": datetime.now()})
+journal = JobJournal(JOB_JOURNAL_FILE)
+scheduler = JobScheduler(network_limit=MAX_NETWORK_JOBS, disk_limit=MAX_DISK_JOBS, upload_limit=MAX_UPLOAD_JOBS, journal=journal)
+connection_budget = ConnectionBudget(ARIA2_CONNECTION_BUDGET)
+remote_slots = RemoteSlots(MAX_UPLOADS_PER_REMOTE)
+
+async def list_remote(remote_path, remote_name, recursive):
+    return await rclone_lsjson(remote_path, remote_name, rclone_config_path=RCLONE_CONFIG_PATH, recursive=recursive)
+
+listings = ListingCache(list_remote, ttl=LISTING_CACHE_TTL, max_entries=LISTING_CACHE_SIZE)
+browser = RemoteBrowser(listings)
+sender = TelegramSender(app, part_size=TELEGRAM_PART_SIZE_MB * 1024 * 1024, concurrency=TELEGRAM_UPLOADS,
+                        rate=TELEGRAM_UPLOAD_RATE_MB * 1024 * 1024)
+presets = PresetStore(PRESETS_FILE)
+content_index = ContentIndex(CONTENT_INDEX_FILE, max_entries=CONTENT_INDEX_SIZE) if DEDUPE else None
+# The bot frontend doesn't download anything itself
+aria2_rpc = Aria2RPC(DEFAULT_LOCAL_PATH, ARIA2_SESSION_FILE, port=ARIA2_RPC_PORT, secret=ARIA2_RPC_SECRET) if ARIA2_RPC and BOT_ROLE != "bot" else None
+work_queue = WorkQueue(WORK_QUEUE_FILE) if BOT_ROLE in ("bot", "worker") else None
+# Processes sharing the disk keep their space reservations and used paths in the queue,
+# re-checking it more often since other processes don't wake our waiting jobs
+workspace = Workspace(DEFAULT_LOCAL_PATH, margin=DISK_SPACE_MARGIN_MB * 1024 * 1024,
+                      poll_interval=5 if work_queue is not None else 30, claims=work_queue,
+                      holder=WORKER_NAME if BOT_ROLE == "worker" else "bot")
+# Job runners message users through this: the client itself, or the queue on a worker
+messenger = QueueMessenger(work_queue) if BOT_ROLE == "worker" else app
 
 def extract_filename(url):
     parsed_url = urlparse(url)
@@ -36,21 +151,106 @@ def extract_filename(url):
     if 'file' in query_params:
         filename = os.path.basename(unquote(query_params['file'][0]))
     else:
-        filename = 'downloaded_file'  # Default if no filename is found
+        filename = None  # Let aria2c pick the name from the URL/headers
 
     print(f"Extracted filename: {filename}")
     return filename
 
-async def main():
-    await app.run()
+async def start_job(message, name, kind, params, status_text):
+    """
+    Submit a job that runs JOB_RUNNERS[name] and record it in the journal.
+
+    With BOT_ROLE "bot" the job is queued for a worker instead of run here.
+
+    Parameters:
+    - message (Message): The command message; its chat receives the status.
+    - name (str): The runner name, also the job name.
+    - kind (str): NETWORK_JOB, UPLOAD_JOB, DISK_JOB or PIPELINE_JOB.
+    - params (dict): JSON serialisable runner arguments.
+    - status_text (str): The initial text of the status message.
+
+    Returns:
+    - Job: The submitted job.
+    """
+    status = await message.reply_text(status_text)
+    if work_queue is not None:
+        job = Job(scheduler.new_id(), message.from_user.id, name, kind)
+        await asyncio.to_thread(journal.record, job, message.chat.id, params)
+        await asyncio.to_thread(work_queue.enqueue, job, message.chat.id, status.id, params)
+        return job
+    job = scheduler.submit(message.from_user.id, name, kind, JOB_RUNNERS[name], status, params)
+    await asyncio.to_thread(journal.record, job, message.chat.id, params)
+    return job
+
+async def resume_jobs():
+    """Resubmit the jobs that were queued or running when the bot last stopped."""
+    for entry in await asyncio.to_thread(journal.unfinished):
+        runner = JOB_RUNNERS.get(entry['name'])
+        if runner is None:
+            await asyncio.to_thread(journal.set_state, entry['id'], FAILED)
+            continue
+        try:
+            status = await app.send_message(entry['chat_id'], f"Resuming job `#{entry['id']}` ({entry['name']}) after a restart..")
+        except Exception as e:
+            logger.error(f"Error resuming job #{entry['id']}: {e}")
+            continue
+        scheduler.resubmit(entry['id'], entry['owner'], entry['name'], entry['kind'], runner, status, entry['params'])
+        logger.info(f"Resumed job #{entry['id']} ({entry['name']})")
 
-async def delete_all(dir):
-    try:
-        rmtree(dir)
-    except Exception as e:
-        logger.error(f"Error clearing files in {DEFAULT_LOCAL_PATH}: {e}")
-        pass
-    return
+async def main():
+    if METRICS_PORT:
+        await metrics.serve(METRICS_PORT)
+    if work_queue is not None:
+        # Claims a previous run of this process left behind
+        await asyncio.to_thread(work_queue.release_holder, workspace.holder)
+    if BOT_ROLE == "worker":
+        # No Telegram client here, the bot frontend relays our messages
+        worker = Worker(work_queue, scheduler, JOB_RUNNERS, WORKER_NAME, max_jobs=WORKER_JOBS, stale_after=WORKER_TIMEOUT)
+        await worker.run()
+        return
+    await app.start()
+    if BOT_ROLE == "bot":
+        # Unfinished jobs are requeued by the workers, the frontend only relays
+        relay = asyncio.create_task(relay_outbox(work_queue, app, send_document=send_to_chat))
+    else:
+        relay = None
+        await resume_jobs()
+    await idle()
+    if relay is not None:
+        relay.cancel()
+    await app.stop()
+
+async def active_job_ids(owner=None):
+    """Return the IDs of the active jobs, run here or by the workers."""
+    if work_queue is not None:
+        return [task['id'] for task in await asyncio.to_thread(work_queue.list, owner=owner, active_only=True)]
+    return [job.id for job in scheduler.list(owner=owner, active_only=True)]
+
+async def command_args(message):
+    """
+    Parse a command's arguments and fill in the user's preset.
+
+    ``preset=name`` selects a saved preset, otherwise the user's ``default``
+    preset (if any) is used. Arguments given on the command line win.
+
+    Returns:
+    - tuple: (positional arguments, dict of key=value arguments), or
+      (None, None) if the named preset doesn't exist (the user is told).
+    """
+    positional, args = parse_command_args(message.text)
+    name = args.pop('preset', None)
+    preset = presets.get(message.from_user.id, name or DEFAULT_PRESET)
+    if name is not None and preset is None:
+        await message.reply_text(f"No preset `{name}`. See `/preset list`.")
+        return None, None
+    return positional, {**(preset or {}), **args}
+
+async def ask(message, args, key, prompt):
+    """Return the ``key=`` argument of a command, or ask the user for it if it wasn't given."""
+    if args.get(key):
+        return args[key]
+    await message.reply_text(prompt)
+    return (await app.listen(message.chat.id)).text
 
 @app.on_message(filters.command("start"))
 async def start_command(client, message):
@@ -58,163 +258,707 @@ async def start_command(client, message):
 
 @app.on_message(filters.command("clear"))
 async def clear_command(client, message):
-    # Clear all files in the DEFAULT_LOCAL_PATH
-    await delete_all(DEFAULT_LOCAL_PATH)
-    await message.reply_text(f"All files in {DEFAULT_LOCAL_PATH} cleared successfully.")
+    # Clear all files in the DEFAULT_LOCAL_PATH, except those of running jobs
+    keep_job_ids = await active_job_ids()
+    try:
+        await workspace.clear(keep_job_ids=keep_job_ids)
+    except Exception as e:
+        logger.error(f"Error clearing files in {DEFAULT_LOCAL_PATH}: {e}")
+    await message.reply_text(f"All files in {DEFAULT_LOCAL_PATH} cleared successfully (kept {len(keep_job_ids)} running job(s)).")
 
 @app.on_message(filters.command("download"))
 async def download_command(client, message):
-    user_id = message.from_user.id
-    # Ask for the rclone remote name
-    await message.reply_text("Enter the rclone remote name:")
-    remote_name = (await app.listen(message.chat.id)).text
-
-    # Ask for the remote path to download from
-    await message.reply_text("Enter the remote path to download from (default: `Work/SSHEMW/Merge`):")
-    remote_path = (await app.listen(message.chat.id)).text
-
-    status = await message.reply_text("Downloading..")
-
-    # Download from rclone cloud
-    downloaded_path = await download(status, remote_path, DEFAULT_LOCAL_PATH, remote_name, rclone_config_path=RCLONE_CONFIG_PATH)
-    await app.send_message(user_id, text=f"Download Completed {downloaded_path}") 
-    
+    # e.g. /download remote=gdrive path=Work/SSHEMW/Merge, or /download bulk and answer the prompts
+    positional, args = await command_args(message)
+    if args is None:
+        return
+    # Optional transfer profile, e.g. /download bulk
+    requested_profile = args.get('profile') or (positional[0] if positional else None)
+    remote_name = await ask(message, args, 'remote', "Enter the rclone remote name:")
+    # Without path=, let the user pick it from the remote's folders
+    remote_path = args.get('path') or await browser.choose(message, remote_name)
+    if remote_path is None:
+        return
+
+    params = {'remote_name': remote_name, 'remote_path': remote_path, 'profile': requested_profile}
+    job = await start_job(message, "download", NETWORK_JOB, params, "Downloading..")
+    await message.reply_text(f"Queued as job `#{job.id}`. Use `/cancel {job.id}` to stop it.")
+
+async def download_job(status, params):
+    job = current_job.get()
+    job_path = workspace.job_path(job.id)
+    key = f"rclone:{params['remote_name']}:{params['remote_path']}"
+    # One (cached) listing gives the size for the profile and space checks and a fingerprint of the source
+    entries = await listings.get(params['remote_name'], params['remote_path'])
+    fingerprint = remote_fingerprint(entries) if content_index is not None else None
+    cached_path = content_index.lookup(key, fingerprint) if fingerprint else None
+    if cached_path is not None:
+        await status.edit_text("Unchanged since the last download, reusing the local copy.")
+        await messenger.send_message(job.owner, text=f"Download Completed `{cached_path}` (cached)")
+        return
+    count, size = listing_totals(entries)
+    profile = choose_rclone_profile(params['remote_name'], count, size, params['profile'])
+    # A resumed download only needs space for what isn't in the job folder yet
+    if size is not None:
+        size = max(0, size - path_size(job_path))
+    async with workspace.space(size, status):
+        # Download from rclone cloud; rclone copy skips files that are already complete
+        downloaded_path = await download(status, params['remote_path'], job_path, params['remote_name'], rclone_config_path=RCLONE_CONFIG_PATH, profile=profile)
+    if downloaded_path and fingerprint:
+        content_index.store(key, fingerprint, downloaded_path)
+    await messenger.send_message(job.owner, text=f"Download Completed `{downloaded_path}`")
+
+def wants_telegram(positional):
+    """Whether a command asked for its output in the chat (a positional `telegram` or `tg`)."""
+    return any(p.lower() in ("telegram", "tg") for p in positional)
+
+async def send_to_chat(chat_id, local_path, owner=None):
+    """
+    Send a finished output to a chat as its own UPLOAD_JOB.
+
+    The job that made the output doesn't wait for the send, so its DISK_JOB
+    slot is free for the next operation while the file goes out.
+
+    Parameters:
+    - chat_id (int): The chat to send to.
+    - local_path (str): The output file.
+    - owner (int): The user who may cancel the send, by default the chat.
+
+    Returns:
+    - Job: The send job, or None if the bot frontend sends it.
+    """
+    if BOT_ROLE == "worker":
+        # The bot frontend sends it from the shared storage
+        await messenger.send_document(chat_id, local_path)
+        return None
+    # The operation usually deleted its status message, so report on a new one
+    status = await app.send_message(chat_id, f"Sending `{os.path.basename(local_path)}` to the chat..")
+    params = {'chat_id': chat_id, 'local_path': local_path}
+    job = scheduler.submit(owner or chat_id, "send", UPLOAD_JOB, JOB_RUNNERS["send"], status, params)
+    await asyncio.to_thread(journal.record, job, chat_id, params)
+    return job
+
+async def send_job(status, params):
+    local_path = params['local_path']
+    size = path_size(local_path)
+    # Splitting writes a copy of the file in parts
+    async with workspace.using(local_path), workspace.space(size if size > sender.part_size else 0, status):
+        sent = await sender.send(status, params['chat_id'], local_path, caption=f"`{os.path.basename(local_path)}`")
+    if not sent:
+        # The status message already says what failed; this marks the job FAILED
+        raise RuntimeError(f"Sending {local_path} to chat {params['chat_id']} failed")
 
 @app.on_message(filters.command("merge"))
 async def merge_command(client, message):
-    user_id = message.from_user.id
-    # Ask for the local path containing video files to merge
-    await message.reply_text("Enter the local path containing video files to merge:")
-    merge_local_path = (await app.listen(message.chat.id)).text
-
-    # Ask for the name of the merged video file
-    await message.reply_text("Enter the name for the merged video file (e.g., merged_video`.mkv`):")
-    output_filename = (await app.listen(message.chat.id)).text
-
-    await message.reply_text("Enter the title for the merged video file (e.g., `REPACKED BY @thetgflix`):")
-    custom_title = (await app.listen(message.chat.id)).text
-
-    await message.reply_text("Enter the audio arg for the merged video file (e.g., `0:a` # Copy all audio streams, `0:a:1` # Copy the second audio stream (add more if needed)):")
-    audio_select = (await app.listen(message.chat.id)).text
-
-    status = await message.reply_text(f"Merging...")
-
-    # Merge videos using ffmpeg and get the merged file path
-    merge_path = await merge(status, merge_local_path, output_filename, custom_title, audio_select)
-
-    await app.send_message(user_id, text=f"Merge Completed `{merge_path}`") 
+    # e.g. /merge path=/downloads/job_3 out=merged.mkv title="REPACKED BY @thetgflix" map=0:a
+    positional, args = await command_args(message)
+    if args is None:
+        return
+    # `/merge smart` re-encodes the inputs that don't match the others,
+    # `/merge telegram` also sends the result to this chat
+    smart = SMART_MERGE or "smart" in (p.lower() for p in positional)
+    merge_local_path = await ask(message, args, 'path', "Enter the local path containing video files to merge:")
+    output_filename = await ask(message, args, 'out', "Enter the name for the merged video file (e.g., merged_video`.mkv`):")
+    custom_title = await ask(message, args, 'title', "Enter the title for the merged video file (e.g., `REPACKED BY @thetgflix`):")
+    audio_select = await ask(message, args, 'map', "Enter the audio arg for the merged video file (e.g., `0:a` # Copy all audio streams, `0:a:1` # Copy the second audio stream (add more if needed)):")
+
+    params = {'local_path': merge_local_path, 'output_filename': output_filename, 'custom_title': custom_title,
+              'audio_select': audio_select, 'smart': smart, 'telegram': wants_telegram(positional)}
+    job = await start_job(message, "merge", DISK_JOB, params, "Merging...")
+    await message.reply_text(f"Queued as job `#{job.id}`. Use `/cancel {job.id}` to stop it.")
+
+async def merge_job(status, params):
+    # The folder usually belongs to the download job, keep /clear and uploads off it.
+    # The merged file is about as large as its inputs together.
+    async with workspace.using(params['local_path']), workspace.space(path_size(params['local_path']), status):
+        # Merge videos using ffmpeg and get the merged file path
+        merge_path = await merge(status, params['local_path'], params['output_filename'], params['custom_title'], params['audio_select'],
+                                 smart=params.get('smart', SMART_MERGE))
+    if merge_path:
+        # Uploading the merged file makes the parts redundant
+        inputs = [os.path.join(params['local_path'], name) for name in os.listdir(params['local_path'])
+                  if name.lower().endswith(VIDEO_EXTENSIONS) and name != os.path.basename(merge_path)]
+        workspace.record_output(merge_path, inputs)
+    await messenger.send_message(current_job.get().owner, text=f"Merge Completed `{merge_path}`")
+    if merge_path and params.get('telegram'):
+        await send_to_chat(status.chat.id, merge_path, owner=current_job.get().owner)
 
 @app.on_message(filters.command("changeindex"))
 async def changeindex_command(client, message):
-    user_id = message.from_user.id
-    await message.reply_text("Enter the file_name of the video (e.g., encode.mp4)")
-    input_file_name = (await app.listen(message.chat.id)).text
-
-    await message.reply_text("Enter the file_name of the video (e.g., merged_output.mp4)")
-    output_file_name = (await app.listen(message.chat.id)).text
-
-    await message.reply_text("Enter the title for the merged video file (e.g., `REPACKED BY @thetgflix`):")
-    custom_title = (await app.listen(message.chat.id)).text
-
-    await message.reply_text("Enter the audio arg for the merged video file (e.g., `0:a` # Copy all audio streams, `0:a:1` # Copy the second audio stream (add more if needed)):")
-    audio_select = (await app.listen(message.chat.id)).text
-
-    status = await message.reply_text(f"changing...")
-
-    change_index_path = await changeindex(status, DEFAULT_LOCAL_PATH, input_file_name, output_file_name, custom_title, audio_select)
-    await app.send_message(user_id, text=f"Index Change Completed `{change_index_path}`") 
+    # e.g. /changeindex in=encode.mp4 out=merged_output.mp4 map=0:a:1 (add `telegram` to get the result in this chat)
+    positional, args = await command_args(message)
+    if args is None:
+        return
+    input_file_name = await ask(message, args, 'in', "Enter the video: the path from \"Download Completed\" or just its file name (e.g., `/downloads/job_3/encode.mp4` or `encode.mp4`)")
+    output_file_name = await ask(message, args, 'out', "Enter the file name of the output, written next to the input (e.g., merged_output.mp4)")
+    custom_title = await ask(message, args, 'title', "Enter the title for the merged video file (e.g., `REPACKED BY @thetgflix`):")
+    audio_select = await ask(message, args, 'map', "Enter the audio arg for the merged video file (e.g., `0:a` # Copy all audio streams, `0:a:1` # Copy the second audio stream (add more if needed)):")
+
+    params = {'input_file_name': input_file_name, 'output_file_name': output_file_name, 'custom_title': custom_title, 'audio_select': audio_select,
+              'telegram': wants_telegram(positional)}
+    job = await start_job(message, "changeindex", DISK_JOB, params, "changing...")
+    await message.reply_text(f"Queued as job `#{job.id}`. Use `/cancel {job.id}` to stop it.")
+
+async def changeindex_job(status, params):
+    # Downloads land in job folders; the output is written next to its input
+    input_path = workspace.find(params['input_file_name'])
+    if input_path is None:
+        await status.edit_text(f"`{params['input_file_name']}` not found in `{DEFAULT_LOCAL_PATH}`.")
+        return
+    output_path = os.path.join(os.path.dirname(input_path), params['output_file_name'])
+    async with workspace.using(input_path, output_path), workspace.space(path_size(input_path), status):
+        change_index_path = await changeindex(status, os.path.dirname(input_path), os.path.basename(input_path), params['output_file_name'],
+                                              params['custom_title'], params['audio_select'])
+    if change_index_path:
+        workspace.record_output(change_index_path, [input_path])
+    await messenger.send_message(current_job.get().owner, text=f"Index Change Completed `{change_index_path}`")
+    if change_index_path and params.get('telegram'):
+        await send_to_chat(status.chat.id, change_index_path, owner=current_job.get().owner)
 
 @app.on_message(filters.command("softmux"))
 async def softmux_command(client, message):
-    user_id = message.from_user.id
-    await message.reply_text("Enter the file_name of the video (e.g., encode.mp4)")
-    input_file_name = (await app.listen(message.chat.id)).text
+    # e.g. /softmux in=a.mp4 out=b.mp4 sub=2_English.srt map=0:a:1 (add `telegram` to get the result in this chat)
+    positional, args = await command_args(message)
+    if args is None:
+        return
+    input_file_name = await ask(message, args, 'in', "Enter the video: the path from \"Download Completed\" or just its file name (e.g., `/downloads/job_3/encode.mp4` or `encode.mp4`)")
+    output_file_name = await ask(message, args, 'out', "Enter the file name of the output, written next to the input (e.g., merged_output.mp4)")
+    subtitle_file_name = await ask(message, args, 'sub', "Enter the subtitle: a path, or a file name next to the video or in the download folders (e.g., `2_English.srt`)")
+    custom_title = await ask(message, args, 'title', "Enter the title for the merged video file (e.g., `REPACKED BY @thetgflix`):")
+    audio_select = await ask(message, args, 'map', "Enter the audio arg for the merged video file (e.g., `0:a` # Copy all audio streams, `0:a:1` # Copy the second audio stream (add more if needed)):")
+
+    params = {'input_file_name': input_file_name, 'output_file_name': output_file_name, 'custom_title': custom_title,
+              'audio_select': audio_select, 'subtitle_file_name': subtitle_file_name, 'telegram': wants_telegram(positional)}
+    job = await start_job(message, "softmux", DISK_JOB, params, "changing...")
+    await message.reply_text(f"Queued as job `#{job.id}`. Use `/cancel {job.id}` to stop it.")
+
+async def softmux_job(status, params):
+    # Downloads land in job folders; the output is written next to its input
+    input_path = workspace.find(params['input_file_name'])
+    subtitle_path = workspace.find(params['subtitle_file_name'], near=os.path.dirname(input_path)) if input_path else None
+    if input_path is None or subtitle_path is None:
+        missing = params['input_file_name'] if input_path is None else params['subtitle_file_name']
+        await status.edit_text(f"`{missing}` not found in `{DEFAULT_LOCAL_PATH}`.")
+        return
+    local_path = os.path.dirname(input_path)
+    output_path = os.path.join(local_path, params['output_file_name'])
+    async with workspace.using(input_path, subtitle_path, output_path), workspace.space(path_size(input_path), status):
+        softmux_path = await softmux(status, local_path, os.path.basename(input_path), params['output_file_name'],
+                                     params['custom_title'], params['audio_select'], os.path.relpath(subtitle_path, local_path))
+    if softmux_path:
+        workspace.record_output(softmux_path, [input_path, subtitle_path])
+    await messenger.send_message(current_job.get().owner, text=f"Softmux Completed `{softmux_path}`")
+    if softmux_path and params.get('telegram'):
+        await send_to_chat(status.chat.id, softmux_path, owner=current_job.get().owner)
+
+@app.on_message(filters.command("batchremux"))
+async def batchremux_command(client, message):
+    chat_id = message.chat.id
+
+    await message.reply_text(f"Enter the folder or glob of the videos, relative to `{DEFAULT_LOCAL_PATH}` (e.g., `Season 1/*.mkv`):")
+    pattern = os.path.join(DEFAULT_LOCAL_PATH, (await app.listen(chat_id)).text.strip())
+
+    await message.reply_text("Enter the operation: `changeindex` or `softmux`")
+    operation = (await app.listen(chat_id)).text.strip().lower()
+    if operation not in ("changeindex", "softmux"):
+        await message.reply_text(f"Unknown operation `{operation}`.")
+        return
+
+    subtitle_pattern = None
+    if operation == "softmux":
+        await message.reply_text("Enter a regex whose first group pairs subtitles with videos, or `auto` to match by episode number:")
+        subtitle_pattern = (await app.listen(chat_id)).text.strip()
+        if subtitle_pattern.lower() == "auto":
+            subtitle_pattern = None
+
+    await message.reply_text("Enter the output file name, `{name}` is replaced by the input name (e.g., `{name}.mkv`):")
+    output_template = (await app.listen(chat_id)).text
+
+    await message.reply_text("Enter the title for the output video files (e.g., `REPACKED BY @thetgflix`):")
+    custom_title = (await app.listen(chat_id)).text
+
+    await message.reply_text("Enter the audio arg for the output video files (e.g., `0:a` # Copy all audio streams, `0:a:1` # Copy the second audio stream):")
+    audio_select = (await app.listen(chat_id)).text
+
+    params = {'pattern': pattern, 'operation': operation, 'output_template': output_template, 'custom_title': custom_title,
+              'audio_select': audio_select, 'subtitle_pattern': subtitle_pattern}
+    job = await start_job(message, "batchremux", DISK_JOB, params, f"Batch {operation}...")
+    await message.reply_text(f"Queued as job `#{job.id}`. Use `/cancel {job.id}` to stop it.")
+
+async def batchremux_job(status, params):
+    operation = params['operation']
+    output_path = workspace.job_path(current_job.get().id)
+    videos = find_media(params['pattern'])
+    inputs = list(videos)
+    if operation == "softmux":
+        # Subtitles are paired from the videos' folders
+        inputs += [s for folder in {os.path.dirname(video) for video in videos} for s in find_media(folder, SUBTITLE_EXTENSIONS)]
+    async with workspace.using(*inputs, output_path), workspace.space(sum(path_size(video) for video in videos), status):
+        results = await batch_remux(status, params['pattern'], operation, output_path, params['output_template'], params['custom_title'],
+                                    params['audio_select'], subtitle_pattern=params['subtitle_pattern'], concurrency=BATCH_REMUX_JOBS)
+    lines = [f"{'✅' if output else '❌'} `{os.path.basename(video)}`" for video, output in results.items()]
+    await messenger.send_message(current_job.get().owner, text=f"Batch {operation} Completed in `{output_path}`\n" + "\n".join(lines))
+
+async def cleanup_uploaded(local_path):
+    """
+    Remove what an upload made redundant: a whole job folder if that was uploaded,
+    otherwise only the uploaded output and the files it was made from. Files
+    other running jobs use are kept (see Workspace.using).
+    """
+    job_id = workspace.job_id_of(local_path)
+    if not AUTO_CLEANUP or job_id is None:
+        return
+    if job_id in await active_job_ids():
+        return
+    job_path = os.path.join(DEFAULT_LOCAL_PATH, f"job_{job_id}")
+    if os.path.abspath(local_path.rstrip(os.sep)) == os.path.abspath(job_path):
+        await workspace.cleanup(job_path)
+    else:
+        await workspace.remove_output(local_path)
+
+def upload_destinations(remote_names, remote_path=None):
+    """
+    Parse upload destinations: comma separated remote names sharing ``remote_path``,
+    or ``remote:path`` entries with their own path, e.g. "gdrive, onedrive:Backup".
+
+    Returns:
+    - list: [remote name, remote path] pairs.
+    """
+    destinations = []
+    for entry in remote_names.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        remote_name, sep, path = entry.partition(':')
+        destinations.append([remote_name, path if sep else remote_path])
+    return destinations
+
+async def upload_to(status, local_path, destinations, requested_profile=None):
+    """
+    Upload a local file or folder to one destination, or fan it out to several.
+
+    Parameters:
+    - destinations (list): [remote name, remote path] pairs, see upload_destinations.
+
+    Returns:
+    - bool: True if every destination has the upload.
+    """
+    count, size = path_count(local_path), path_size(local_path)
+    try:
+        if len(destinations) == 1:
+            remote_name, remote_path = destinations[0]
+            profile = choose_rclone_profile(remote_name, count, size, requested_profile)
+            async with remote_slots.slot(remote_name):
+                return await upload(status, local_path, remote_path, remote_name, rclone_config_path=RCLONE_CONFIG_PATH,
+                                    profile=profile, index=content_index)
+        profiles = {remote_name: choose_rclone_profile(remote_name, count, size, requested_profile) for remote_name, _ in destinations}
+        results = await upload_fanout(status, local_path, destinations, rclone_config_path=RCLONE_CONFIG_PATH, profiles=profiles,
+                                      index=content_index, slots=remote_slots, verify=VERIFY_UPLOADS)
+        return all(result == 'ok' for result in results.values())
+    finally:
+        # Whatever the upload did, cached listings of the destinations are out of date
+        for remote_name, remote_path in destinations:
+            listings.invalidate(remote_name, remote_path)
 
-    await message.reply_text("Enter the file_name of the video (e.g., merged_output.mp4)")
-    output_file_name = (await app.listen(message.chat.id)).text
+@app.on_message(filters.command("upload"))
+async def upload_command(client, message):
+    # e.g. /upload file=/downloads/job_3/merged.mkv remote=gdrive to=Uploads
+    # or, to several remotes at once: remote=gdrive,onedrive:Backup to=Uploads
+    positional, args = await command_args(message)
+    if args is None:
+        return
+    # Optional transfer profile, e.g. /upload single-large-file
+    requested_profile = args.get('profile') or (positional[0] if positional else None)
+    local_merged_video = await ask(message, args, 'file', "Enter the local path of the merged video file:")
+    remote_upload_name = await ask(message, args, 'remote', "Enter the rclone remote name(s) for upload, comma separated:")
+    destinations = upload_destinations(remote_upload_name)
+    if any(remote_path is None for _, remote_path in destinations):
+        remote_upload_path = await ask(message, args, 'to', "Enter the remote path to upload to:")
+        destinations = upload_destinations(remote_upload_name, remote_upload_path)
+
+    params = {'local_path': local_merged_video, 'destinations': destinations, 'profile': requested_profile}
+    job = await start_job(message, "upload", UPLOAD_JOB, params, "Uploading...")
+    await message.reply_text(f"Queued as job `#{job.id}`. Use `/cancel {job.id}` to stop it.")
+
+async def upload_job(status, params):
+    local_path = params['local_path']
+    # Jobs journaled before fan-out uploads have a single remote_name/remote_path
+    destinations = params.get('destinations') or [[params['remote_name'], params['remote_path']]]
+    # Upload merged video to rclone cloud; rclone copy skips files already on the remote
+    async with workspace.using(local_path):
+        uploaded = await upload_to(status, local_path, destinations, params['profile'])
+    if not uploaded:
+        return
+    await messenger.send_message(current_job.get().owner, text="Upload Completed.")
+    await cleanup_uploaded(local_path)
+
+def find_file(directory, extensions):
+    """Return the name of the first file in directory with one of the given extensions."""
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(extensions):
+            return name
+    return None
+
+def item_name(remote_path):
+    """Return the name of a pipeline item: the folder name, or the file name without video extension."""
+    name = os.path.basename(remote_path.rstrip('/')) or remote_path
+    if name.lower().endswith(VIDEO_EXTENSIONS):
+        name = os.path.splitext(name)[0]
+    return name
+
+@app.on_message(filters.command("pipeline"))
+async def pipeline_command(client, message):
+    chat_id = message.chat.id
+    # Optional transfer profile for both transfers, e.g. /pipeline bulk
+    requested_profile = message.command[1] if len(message.command) > 1 else None
 
-    await message.reply_text("Enter the file_name of the subtitle (e.g., `2_English.srt`)")
-    subtitle_file_name = (await app.listen(message.chat.id)).text
+    await message.reply_text("Enter the rclone remote name:")
+    remote_name = (await app.listen(chat_id)).text
 
-    await message.reply_text("Enter the title for the merged video file (e.g., `REPACKED BY @thetgflix`):")
-    custom_title = (await app.listen(message.chat.id)).text
+    await message.reply_text("Enter the remote paths to download, one per line (each line is processed as one item):")
+    remote_paths = [path.strip() for path in (await app.listen(chat_id)).text.splitlines() if path.strip()]
 
-    await message.reply_text("Enter the audio arg for the merged video file (e.g., `0:a` # Copy all audio streams, `0:a:1` # Copy the second audio stream (add more if needed)):")
-    audio_select = (await app.listen(message.chat.id)).text
+    await message.reply_text("Enter the operation to run on each item: `merge`, `changeindex`, `softmux` or `none`")
+    operation = (await app.listen(chat_id)).text.strip().lower()
+    if operation not in ("merge", "changeindex", "softmux", "none"):
+        await message.reply_text(f"Unknown operation `{operation}`.")
+        return
 
-    status = await message.reply_text(f"changing...")
+    output_template = custom_title = audio_select = None
+    if operation != "none":
+        await message.reply_text("Enter the output file name, `{name}` is replaced by the item name (e.g., `{name}.mkv`):")
+        output_template = (await app.listen(chat_id)).text
 
-    softmux_path = await softmux(status, DEFAULT_LOCAL_PATH, input_file_name, output_file_name, custom_title, audio_select, subtitle_file_name)
-    await app.send_message(user_id, text=f"Softmux Completed `{softmux_path}`") 
+        await message.reply_text("Enter the title for the output video files (e.g., `REPACKED BY @thetgflix`):")
+        custom_title = (await app.listen(chat_id)).text
 
-@app.on_message(filters.command("upload"))
-async def upload_command(client, message):
-    user_id = message.from_user.id
-    # Ask for the local path of the merged video file
-    await message.reply_text("Enter the local path of the merged video file:")
-    local_merged_video = (await app.listen(message.chat.id)).text
+        await message.reply_text("Enter the audio arg for the output video files (e.g., `0:a` # Copy all audio streams, `0:a:1` # Copy the second audio stream):")
+        audio_select = (await app.listen(chat_id)).text
 
-    # Ask for the rclone remote name for upload
-    await message.reply_text("Enter the rclone remote name for upload:")
-    remote_upload_name = (await app.listen(message.chat.id)).text
+    await message.reply_text("Enter the rclone remote name(s) for upload, comma separated:")
+    remote_upload_name = (await app.listen(chat_id)).text
 
-    # Ask for the remote path to upload to
     await message.reply_text("Enter the remote path to upload to:")
-    remote_upload_path = (await app.listen(message.chat.id)).text
-
-    status = await message.reply_text("Uploading...")
+    remote_upload_path = (await app.listen(chat_id)).text
+
+    params = {
+        'remote_name': remote_name, 'remote_paths': remote_paths, 'operation': operation,
+        'output_template': output_template, 'custom_title': custom_title, 'audio_select': audio_select,
+        'remote_upload_name': remote_upload_name, 'remote_upload_path': remote_upload_path, 'profile': requested_profile,
+    }
+    job = await start_job(message, "pipeline", PIPELINE_JOB, params, f"Pipeline of {len(remote_paths)} item(s)..")
+    await message.reply_text(f"Queued {len(remote_paths)} item(s) as job `#{job.id}`. Use `/cancel {job.id}` to stop it.")
+
+async def pipeline_job(status, params):
+    job = current_job.get()
+    chat_id = status.chat.id
+    remote_name = params['remote_name']
+    remote_paths = params['remote_paths']
+    operation = params['operation']
+    output_template = params['output_template']
+    custom_title = params['custom_title']
+    audio_select = params['audio_select']
+    remote_upload_name = params['remote_upload_name']
+    remote_upload_path = params['remote_upload_path']
+    requested_profile = params['profile']
+    destinations = upload_destinations(remote_upload_name, remote_upload_path)
+
+    async def download_stage(item):
+        status = await messenger.send_message(chat_id, f"`{item['name']}`: Downloading..")
+        count, size = listing_totals(await listings.get(remote_name, item['remote_path']))
+        profile = choose_rclone_profile(remote_name, count, size, requested_profile)
+        if size is not None:
+            size = max(0, size - path_size(item['local_path']))
+        # Only bytes not yet on disk need reserving; later stages reserve their own output
+        async with workspace.space(size, status), scheduler.slot(NETWORK_JOB):
+            downloaded_path = await download(status, item['remote_path'], item['local_path'], remote_name, rclone_config_path=RCLONE_CONFIG_PATH, profile=profile)
+        if downloaded_path is None:
+            return None
+        item['output'] = item['local_path']
+        return item
+
+    async def process_stage(item):
+        local_path = item['local_path']
+        output_filename = output_template.replace("{name}", item['name'])
+        status = await messenger.send_message(chat_id, f"`{item['name']}`: Running {operation}..")
+        async with workspace.space(path_size(local_path), status), scheduler.slot(DISK_JOB):
+            if operation == "merge":
+                output_path = await merge(status, local_path, output_filename, custom_title, audio_select, smart=SMART_MERGE)
+            else:
+                input_file_name = find_file(local_path, VIDEO_EXTENSIONS)
+                if input_file_name is None:
+                    await status.edit_text(f"`{item['name']}`: No video file found.")
+                    return None
+                if operation == "changeindex":
+                    output_path = await changeindex(status, local_path, input_file_name, output_filename, custom_title, audio_select)
+                else:
+                    subtitle_file_name = find_file(local_path, SUBTITLE_EXTENSIONS)
+                    if subtitle_file_name is None:
+                        await status.edit_text(f"`{item['name']}`: No subtitle file found.")
+                        return None
+                    output_path = await softmux(status, local_path, input_file_name, output_filename, custom_title, audio_select, subtitle_file_name)
+        if output_path is None:
+            return None
+        item['output'] = output_path
+        return item
+
+    async def stream_stage(item):
+        output_filename = output_template.replace("{name}", item['name'])
+        upload_name, upload_path = destinations[0]
+        destination = f"{upload_name}:{upload_path.rstrip('/')}/{output_filename}"
+        status = await messenger.send_message(chat_id, f"`{item['name']}`: Streaming {operation}..")
+        async with scheduler.slot(NETWORK_JOB):
+            output_path = await changeindex(status, None, os.path.basename(item['remote_path']), output_filename, custom_title, audio_select,
+                                            source=f"{remote_name}:{item['remote_path']}", destination=destination,
+                                            rclone_config_path=RCLONE_CONFIG_PATH)
+        listings.invalidate(upload_name, upload_path)
+        return item if output_path else None
+
+    async def upload_stage(item):
+        status = await messenger.send_message(chat_id, f"`{item['name']}`: Uploading..")
+        async with scheduler.slot(UPLOAD_JOB):
+            uploaded = await upload_to(status, item['output'], destinations, requested_profile)
+        if not uploaded:
+            return None
+        if AUTO_CLEANUP:
+            # The download and intermediate files of this item are no longer needed
+            await workspace.cleanup(item['local_path'])
+        return item
+
+    # Stages an earlier run of this job completed, keyed "<item index>:<stage>"
+    completed = await asyncio.to_thread(journal.artefacts, job.id)
+
+    def resumable(name, func):
+        """Skip a stage the item already completed before a restart, and checkpoint it when it completes now."""
+        async def stage(item):
+            key = f"{item['index']}:{name}"
+            if key in completed:
+                item['output'] = completed[key]
+                return item
+            item = await func(item)
+            if item is not None:
+                await asyncio.to_thread(journal.checkpoint, job.id, key, item.get('output'))
+            return item
+        return stage
+
+    # Single files that can be remuxed on pipes skip the local copy entirely;
+    # anything else (folders, MP4 in/out) goes through the disk stages.
+    streaming = STREAM_REMUX and operation == "changeindex" and len(destinations) == 1 and all(
+        path.lower().endswith(VIDEO_EXTENSIONS)
+        and can_stream(path, output_template.replace("{name}", item_name(path)))
+        for path in remote_paths
+    )
+    if streaming:
+        stages = [("stream", stream_stage)]
+    else:
+        stages = [("download", download_stage)]
+        if operation != "none":
+            stages.append((operation, process_stage))
+        stages.append(("upload", upload_stage))
+    stages = [(name, resumable(name, func)) for name, func in stages]
+
+    job_path = workspace.job_path(job.id)
+    items = [
+        {
+            'index': index,
+            'name': item_name(remote_path),
+            'remote_path': remote_path,
+            'local_path': os.path.join(job_path, f"item_{index}"),
+        }
+        for index, remote_path in enumerate(remote_paths)
+    ]
+    results = await run_pipeline(items, stages)
+    lines = [f"{'✅' if result else '❌'} `{item['name']}`" for item, result in zip(items, results)]
+    await messenger.send_message(job.owner, text="Pipeline Completed\n" + "\n".join(lines))
+
+@app.on_message(filters.command("preset"))
+async def preset_command(client, message):
+    # /preset save <name> title=".." map=0:a:1 | /preset delete <name> | /preset list
+    user_id = message.from_user.id
+    positional, args = parse_command_args(message.text)
+    action = positional[0].lower() if positional else "list"
+    name = positional[1] if len(positional) > 1 else DEFAULT_PRESET
+
+    if action == "save":
+        values = presets.save(user_id, name, args)
+        if not values:
+            await message.reply_text(f"Nothing to save. Preset keys: {', '.join(f'`{key}=`' for key in PRESET_KEYS)}")
+            return
+        await message.reply_text(f"Saved preset `{name}`: " + ", ".join(f"`{k}={v}`" for k, v in values.items()))
+    elif action == "delete":
+        deleted = presets.delete(user_id, name)
+        await message.reply_text(f"Deleted preset `{name}`." if deleted else f"No preset `{name}`.")
+    else:
+        saved = presets.list(user_id)
+        if not saved:
+            await message.reply_text("No presets. Save one with `/preset save <name> title=\"..\" map=0:a`; "
+                                     f"`{DEFAULT_PRESET}` is used when a command names none.")
+            return
+        await message.reply_text("\n".join(
+            f"**{name}**: " + ", ".join(f"`{k}={v}`" for k, v in values.items()) for name, values in saved.items()
+        ))
+
+@app.on_message(filters.command("profiles"))
+async def profiles_command(client, message):
+    lines = [f"**{name}**: `{' '.join(flags) or 'rclone defaults'}`" for name, flags in RCLONE_PROFILES.items()]
+    if REMOTE_PROFILES:
+        lines.append("")
+        lines += [f"`{remote}` → **{profile}**" for remote, profile in REMOTE_PROFILES.items()]
+    await message.reply_text("\n".join(lines))
 
-    # Upload merged video to rclone cloud
-    await upload(status, local_merged_video, remote_upload_path, remote_upload_name, rclone_config_path=RCLONE_CONFIG_PATH)
-    await app.send_message(user_id, text="Upload Completed.") 
-    
 @app.on_message(filters.command("log"))
 async def log_command(client, message):
+    # /log [N]: the last N lines (default 50) from memory; /log full: the whole log, gzipped
     user_id = message.from_user.id
-
-    # Send the log file
+    argument = message.command[1].lower() if len(message.command) > 1 else "50"
+
+    if argument != "full":
+        if not argument.isdigit():
+            await message.reply_text("Usage: `/log [lines]` or `/log full`")
+            return
+        # Telegram messages are limited to 4096 characters, keep the newest lines that fit
+        text = ""
+        for line in reversed(log_buffer.tail(int(argument))):
+            if len(text) + len(line) + 1 > 4000:
+                break
+            text = line + "\n" + text
+        await message.reply_text(f"<pre>{html.escape(text)}</pre>" if text else "The log is empty.", parse_mode=ParseMode.HTML)
+        return
+
+    # Send the current log file, compressed
+    archive_path = None
     try:
-        await app.send_document(user_id, document=LOG_FILE_NAME, caption="Bot Log File")
+        archive_path = await asyncio.to_thread(compress_log, LOG_FILE_NAME)
+        await app.send_document(user_id, document=archive_path, file_name=f"{LOG_FILE_NAME}.gz", caption="Bot Log File")
     except Exception as e:
         await app.send_message(user_id, f"Failed to send log file. Error: {str(e)}")
+    finally:
+        if archive_path is not None:
+            os.remove(archive_path)
 
-@app.on_message(filters.text)
-async def handle_download(client, message):
-    if message.text.startswith("http://") or message.text.startswith("https://"):
-        download_url = message.text
-        filename = extract_filename(download_url)
-
-        command = [
-            "aria2c",
-            "--continue=true",
-            "--max-connection-per-server=4",
-            "--split=4",
-            "--summary-interval=1",
-            "--console-log-level=notice",
-            "--dir=" + DEFAULT_LOCAL_PATH,  
-            "--out=" + filename,
-            download_url
-        ]
-
-        BotTimes.task_start = datetime.now()
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+@app.on_callback_query(filters.regex(f"^{CALLBACK_PREFIX}"))
+async def browse_callback(client, callback_query):
+    await browser.handle(callback_query)
 
-        process.communicate()  # Wait for the process to complete
+@app.on_message(filters.command("stats"))
+async def stats_command(client, message):
+    await message.reply_text(metrics.summary())
 
-        await message.reply_text(f'Downloaded ✅ `{filename}` at {datetime.now().strftime("%H:%M:%S")}')
+@app.on_message(filters.command("jobs"))
+async def jobs_command(client, message):
+    user_id = message.from_user.id
+    if work_queue is not None:
+        tasks = await asyncio.to_thread(work_queue.list, owner=user_id)
+        await message.reply_text("\n".join(describe_task(task) for task in tasks) if tasks else "No jobs.")
+        return
+    jobs = scheduler.list(owner=user_id)
+    if not jobs:
+        await message.reply_text("No jobs.")
+        return
+    await message.reply_text("\n".join(job.describe() for job in jobs))
 
 @app.on_message(filters.command("cancel"))
 async def cancel_command(client, message):
-  msg = cancel_download()
-  await message.reply_text(msg)
-       
+    user_id = message.from_user.id
+    if len(message.command) > 1:
+        try:
+            job_id = int(message.command[1].lstrip('#'))
+        except ValueError:
+            await message.reply_text("Usage: `/cancel <job id>`")
+            return
+    else:
+        # Without an ID, cancel the user's most recent active job
+        active = await active_job_ids(owner=user_id)
+        if not active:
+            await message.reply_text("No active job to cancel.")
+            return
+        job_id = active[-1]
+    if work_queue is not None:
+        await message.reply_text(await asyncio.to_thread(work_queue.cancel, job_id, owner=user_id))
+        return
+    await message.reply_text(scheduler.cancel(job_id, owner=user_id))
+
+@app.on_message(filters.text)
+async def handle_download(client, message):
+    if message.text.startswith("http://") or message.text.startswith("https://"):
+        urls, split, max_connections = parse_download_args(message.text)
+
+        job_ids = []
+        for download_url in urls:
+            filename = extract_filename(download_url)
+            params = {'url': download_url, 'filename': filename, 'split': split, 'max_connections': max_connections}
+            job = await start_job(message, "aria2c", NETWORK_JOB, params, f"Downloading `{filename or download_url}`..")
+            job_ids.append(f"`#{job.id}`")
+
+        await message.reply_text(f"Queued {len(job_ids)} download(s) as job(s) {', '.join(job_ids)}.")
+
+async def aria2c_job(status, params):
+    job_path = workspace.job_path(current_job.get().id)
+    size, fingerprint = await url_info(params['url'])
+    key = f"url:{params['url']}"
+    # Without a size, ETag or Last-Modified there is no telling whether the content changed
+    if content_index is not None and fingerprint is not None:
+        cached_path = content_index.lookup(key, fingerprint)
+        if cached_path is not None:
+            await status.edit_text(f"Already downloaded, reusing `{cached_path}`.")
+            await messenger.send_message(status.chat.id, f'Downloaded ✅ `{cached_path}` (cached)')
+            return
+    # aria2c continues partial files, so a resumed job picks up where it stopped
+    if size is not None:
+        size = max(0, size - path_size(job_path))
+    async with workspace.space(size, status):
+        if aria2_rpc is not None:
+            # A resumed job re-attaches to the download the daemon restored from its session
+            job_id = current_job.get().id
+            artefacts = await asyncio.to_thread(journal.artefacts, job_id)
+
+            async def save_gid(gid):
+                await asyncio.to_thread(journal.checkpoint, job_id, 'aria2_gid', gid)
+
+            downloaded_path = await aria2_rpc_download(status, aria2_rpc, params['url'], job_path, params['filename'],
+                                                       split=params['split'], max_connections=params['max_connections'],
+                                                       budget=connection_budget, gid=artefacts.get('aria2_gid'), on_submit=save_gid)
+        else:
+            downloaded_path = await aria2_download(status, params['url'], job_path, params['filename'],
+                                                   split=params['split'], max_connections=params['max_connections'],
+                                                   budget=connection_budget)
+    if downloaded_path and content_index is not None and fingerprint is not None:
+        content_index.store(key, fingerprint, downloaded_path)
+    if downloaded_path:
+        await messenger.send_message(status.chat.id, f'Downloaded ✅ `{downloaded_path}` at {datetime.now().strftime("%H:%M:%S")}')
+
+# Job name -> coroutine function(status, params), used for new and resumed jobs
+JOB_RUNNERS = {
+    "download": download_job,
+    "merge": merge_job,
+    "changeindex": changeindex_job,
+    "softmux": softmux_job,
+    "batchremux": batchremux_job,
+    "upload": upload_job,
+    "pipeline": pipeline_job,
+    "aria2c": aria2c_job,
+    "send": send_job,
+}
+
 if __name__ == "__main__":
-    
+
+    if aria2_rpc is not None:
+        # Start early so downloads saved in the session resume right away
+        aria2_rpc.start()
+
     try:
-        app.run()
+        app.run(main())
     except FloodWait as e:
         # Handle FloodWait exception
         logger.error(f"FloodWait exception. Waiting for {e.value} seconds.")
         time.sleep(e.value)
         # Retry running the app after waiting
-        app.run()
+        app.run(main())
+    finally:
+        if aria2_rpc is not None:
+            aria2_rpc.stop()
+        journal.close()
+        if work_queue is not None:
+            work_queue.close()
+        if content_index is not None:
+            content_index.close()
@@ -0,0 +1,188 @@
+import time
+import asyncio
+import logging
+from collections import Counter, deque
+from contextlib import contextmanager
+from progress_module import format_bytes, format_eta
+
+logger = logging.getLogger(__name__)
+
+# Number of recent runs per operation/remote that averages and peaks are taken over
+WINDOW = 100
+
+# Throughput samples closer together than this are merged, so a burst of
+# progress lines doesn't produce absurd peaks
+MIN_SAMPLE_INTERVAL = 1.0
+
+class Measurement:
+    """
+    One run of an operation, filled in while it runs.
+
+    Attributes:
+    - bytes (int): Bytes moved (downloaded, written or uploaded) so far.
+    - exit_code (int): The exit code of the process, None if none ran.
+    - peak_rate (float): The highest throughput seen, in bytes per second.
+    """
+
+    def __init__(self, operation, remote=None):
+        self.operation = operation
+        self.remote = remote
+        self.started = time.monotonic()
+        self.finished = None
+        self.bytes = 0
+        self.exit_code = None
+        self.peak_rate = 0.0
+        self._last = (self.started, 0)
+
+    def observe(self, total_bytes):
+        """Record the cumulative number of bytes moved, updating the peak throughput."""
+        if total_bytes is None:
+            return
+        self.bytes = max(self.bytes, total_bytes)
+        now = time.monotonic()
+        last_time, last_bytes = self._last
+        if now - last_time >= MIN_SAMPLE_INTERVAL:
+            self.peak_rate = max(self.peak_rate, (total_bytes - last_bytes) / (now - last_time))
+            self._last = (now, total_bytes)
+
+    @property
+    def ok(self):
+        return self.exit_code == 0
+
+    @property
+    def seconds(self):
+        return (self.finished or time.monotonic()) - self.started
+
+class StageStats:
+    """Aggregates of every run of one operation against one remote."""
+
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.exit_codes = Counter()
+        self.recent = deque(maxlen=WINDOW)  # (seconds, bytes, peak rate)
+
+    def add(self, measurement):
+        self.runs += 1
+        if not measurement.ok:
+            self.failures += 1
+        self.seconds += measurement.seconds
+        self.bytes += measurement.bytes
+        if measurement.exit_code is not None:
+            self.exit_codes[measurement.exit_code] += 1
+        self.recent.append((measurement.seconds, measurement.bytes, measurement.peak_rate))
+
+    @property
+    def average_rate(self):
+        """Average throughput over the recent runs, in bytes per second."""
+        seconds = sum(s for s, _, _ in self.recent)
+        return sum(b for _, b, _ in self.recent) / seconds if seconds else 0.0
+
+    @property
+    def peak_rate(self):
+        return max((p for _, _, p in self.recent), default=0.0)
+
+class Metrics:
+    """
+    In-memory registry of per-operation timings, throughput, queue waits and exit codes.
+
+    Operations are measured with ``with metrics.measure('download', remote) as m:``
+    and queue waits are added by the JobScheduler. The aggregates are shown by
+    /stats and can be exported in Prometheus text format with serve().
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.queue_waits = {}  # operation -> (count, total seconds)
+
+    @contextmanager
+    def measure(self, operation, remote=None):
+        measurement = Measurement(operation, remote)
+        try:
+            yield measurement
+        finally:
+            measurement.finished = time.monotonic()
+            key = (operation, remote or 'local')
+            self.stages.setdefault(key, StageStats()).add(measurement)
+
+    def record_queue_wait(self, operation, seconds):
+        count, total = self.queue_waits.get(operation, (0, 0.0))
+        self.queue_waits[operation] = (count + 1, total + seconds)
+
+    def summary(self):
+        """Render the aggregates per operation and remote as a status message."""
+        if not self.stages:
+            return "No operations measured yet."
+        lines = []
+        for (operation, remote), stats in sorted(self.stages.items()):
+            line = (f"**{operation}** `{remote}`: {stats.runs} run(s)"
+                    + (f", {stats.failures} failed" if stats.failures else "")
+                    + f" | {format_bytes(stats.bytes)} in {format_eta(stats.seconds)}"
+                    + f" | avg {format_bytes(stats.average_rate)}/s, peak {format_bytes(stats.peak_rate)}/s")
+            failed_codes = [f"{code}×{count}" for code, count in sorted(stats.exit_codes.items()) if code != 0]
+            if failed_codes:
+                line += f" | exit {', '.join(failed_codes)}"
+            lines.append(line)
+        if self.queue_waits:
+            lines.append("")
+            for operation, (count, total) in sorted(self.queue_waits.items()):
+                lines.append(f"**{operation}** queue wait: avg {format_eta(total / count)} over {count} job(s)")
+        return "\n".join(lines)
+
+    def prometheus(self):
+        """Render the aggregates in the Prometheus text exposition format."""
+        families = [
+            ('rclmerge_stage_runs_total', 'counter', lambda stats: stats.runs),
+            ('rclmerge_stage_failures_total', 'counter', lambda stats: stats.failures),
+            ('rclmerge_stage_seconds_total', 'counter', lambda stats: round(stats.seconds, 3)),
+            ('rclmerge_stage_bytes_total', 'counter', lambda stats: stats.bytes),
+            ('rclmerge_stage_average_bytes_per_second', 'gauge', lambda stats: round(stats.average_rate, 1)),
+            ('rclmerge_stage_peak_bytes_per_second', 'gauge', lambda stats: round(stats.peak_rate, 1)),
+        ]
+        stages = sorted(self.stages.items())
+        lines = []
+        for name, metric_type, value in families:
+            lines.append(f"# TYPE {name} {metric_type}")
+            for (operation, remote), stats in stages:
+                lines.append(f'{name}{{operation="{_escape(operation)}",remote="{_escape(remote)}"}} {value(stats)}')
+
+        lines.append("# TYPE rclmerge_stage_exit_codes_total counter")
+        for (operation, remote), stats in stages:
+            for code, count in sorted(stats.exit_codes.items()):
+                lines.append(f'rclmerge_stage_exit_codes_total{{operation="{_escape(operation)}",'
+                             f'remote="{_escape(remote)}",code="{code}"}} {count}')
+
+        lines.append("# TYPE rclmerge_queue_wait_seconds summary")
+        for operation, (count, total) in sorted(self.queue_waits.items()):
+            lines.append(f'rclmerge_queue_wait_seconds_count{{operation="{_escape(operation)}"}} {count}')
+            lines.append(f'rclmerge_queue_wait_seconds_sum{{operation="{_escape(operation)}"}} {total:.3f}')
+        return "\n".join(lines) + "\n"
+
+    async def _handle(self, reader, writer):
+        try:
+            # Every request gets the metrics; read (and ignore) the request head first
+            while (await reader.readline()).strip():
+                pass
+            body = self.prometheus().encode()
+            writer.write(b"HTTP/1.1 200 OK\r\n"
+                         b"Content-Type: text/plain; version=0.0.4\r\n"
+                         + f"Content-Length: {len(body)}\r\n".encode()
+                         + b"Connection: close\r\n\r\n" + body)
+            await writer.drain()
+        except (OSError, asyncio.IncompleteReadError) as e:
+            logger.error(f"Error serving metrics: {e}")
+        finally:
+            writer.close()
+
+    async def serve(self, port, host='127.0.0.1'):
+        """Start serving the Prometheus export over HTTP; returns the asyncio server."""
+        server = await asyncio.start_server(self._handle, host, port)
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+        return server
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+metrics = Metrics()
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+from job_module import current_job
+
+logger = logging.getLogger(__name__)
+
+async def run_pipeline(items, stages, queue_size=1):
+    """
+    Pass every item through a chain of stages, overlapping stages across items.
+
+    Each stage runs in its own worker and takes the next item as soon as it has
+    handed the previous one on, so while item N is uploading item N+1 can
+    already be downloading. The queues between stages are bounded so an early
+    stage never runs far ahead of a slower one (e.g. filling the disk).
+
+    Parameters:
+    - items (list): The inputs of the first stage.
+    - stages (list): (name, coroutine function) pairs. Each function receives
+      the previous stage's result and returns the next one, or None to drop
+      the item.
+    - queue_size (int): The number of finished items buffered between stages.
+
+    Returns:
+    - list: The final result for every item, in input order (None if dropped).
+    """
+    results = [None] * len(items)
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in stages]
+    job = current_job.get()
+
+    async def worker(position, name, func):
+        inbox = queues[position]
+        outbox = queues[position + 1] if position + 1 < len(stages) else None
+        while True:
+            entry = await inbox.get()
+            if entry is None:
+                if outbox is not None:
+                    await outbox.put(None)
+                return
+            index, value = entry
+            if job is not None and not job.active:
+                continue
+            try:
+                value = await func(value)
+            except Exception as e:
+                logger.error(f"Pipeline stage '{name}' failed for item {index}: {e}")
+                value = None
+            if value is None:
+                continue
+            if outbox is None:
+                results[index] = value
+            else:
+                await outbox.put((index, value))
+
+    workers = [
+        asyncio.create_task(worker(position, name, func))
+        for position, (name, func) in enumerate(stages)
+    ]
+    try:
+        for entry in enumerate(items):
+            await queues[0].put(entry)
+        await queues[0].put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+    return results
@@ -0,0 +1,155 @@
+import os
+import json
+import asyncio
+import logging
+from collections import Counter, OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Probe results keyed by (path, size, mtime), so a file that changes is re-probed
+CACHE_SIZE = 1024
+_cache = OrderedDict()
+
+# Stream fields that must match for the concat demuxer to stream-copy the inputs
+CONCAT_FIELDS = {
+    'video': ('codec_name', 'profile', 'width', 'height', 'pix_fmt', 'time_base'),
+    'audio': ('codec_name', 'sample_rate', 'channels'),
+    'subtitle': ('codec_name',),
+}
+
+def _cache_key(file_path):
+    stat = os.stat(file_path)
+    return (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+
+async def probe(file_path):
+    """
+    Return ffprobe's format and stream information for a media file.
+
+    Results are cached by path, size and modification time, so probing the
+    same unchanged file again (from any command) costs nothing.
+
+    Returns:
+    - dict: ffprobe's JSON output ('format' and 'streams'), or None on failure.
+    """
+    try:
+        key = _cache_key(file_path)
+    except OSError as e:
+        logger.error(f"Error probing {file_path}: {e}")
+        return None
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+
+    try:
+        process = await asyncio.create_subprocess_exec(
+            'ffprobe', '-v', 'quiet',
+            '-print_format', 'json',
+            '-show_format', '-show_streams',
+            file_path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        output, _ = await process.communicate()
+        if process.returncode != 0:
+            logger.error(f"ffprobe failed for {file_path} with return code {process.returncode}")
+            return None
+        info = json.loads(output)
+    except (OSError, ValueError) as e:
+        logger.error(f"Error probing {file_path}: {e}")
+        return None
+
+    info.setdefault('streams', [])
+    info.setdefault('format', {})
+    _cache[key] = info
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return info
+
+async def probe_duration(file_path):
+    """Return the duration of a media file in seconds, or None if unknown."""
+    info = await probe(file_path)
+    try:
+        return float(info['format']['duration'])
+    except (TypeError, KeyError, ValueError):
+        return None
+
+def streams(info, codec_type):
+    """Return the streams of one type ('video', 'audio', 'subtitle') from probe info."""
+    return [s for s in info['streams'] if s.get('codec_type') == codec_type]
+
+def stream_layout(info):
+    """Describe the stream layout that matters for concatenation."""
+    return [
+        (s['codec_type'],) + tuple(s.get(field) for field in CONCAT_FIELDS[s['codec_type']])
+        for s in info['streams'] if s.get('codec_type') in CONCAT_FIELDS
+    ]
+
+def concat_problems(infos):
+    """
+    Check whether media files can be joined with the concat demuxer and stream copy.
+
+    Parameters:
+    - infos (dict): File name -> probe info, in concat order.
+
+    Returns:
+    - list: Human readable problems; empty if the files are compatible.
+    """
+    problems = []
+    names = list(infos)
+    for name in names:
+        if infos[name] is None:
+            problems.append(f"`{name}` could not be probed")
+    if problems:
+        return problems
+
+    reference_name = names[0]
+    reference = stream_layout(infos[reference_name])
+    for name in names[1:]:
+        layout = stream_layout(infos[name])
+        if len(layout) != len(reference):
+            problems.append(f"`{name}` has {len(layout)} streams, `{reference_name}` has {len(reference)}")
+            continue
+        for index, (expected, actual) in enumerate(zip(reference, layout)):
+            if expected != actual:
+                fields = ('codec_type',) + CONCAT_FIELDS.get(expected[0], ())
+                diffs = [
+                    f"{field} {a} != {b}"
+                    for field, a, b in zip(fields, actual, expected) if a != b
+                ]
+                problems.append(f"`{name}` stream {index}: " + ", ".join(diffs))
+    return problems
+
+def majority_reference(infos):
+    """
+    Pick the input whose stream layout most of the inputs share.
+
+    Parameters:
+    - infos (dict): File name -> probe info, in concat order.
+
+    Returns:
+    - str: The first input with the most common layout (ties go to the earlier
+      input), or None if any input could not be probed.
+    """
+    if not infos or any(info is None for info in infos.values()):
+        return None
+    layouts = {name: tuple(stream_layout(info)) for name, info in infos.items()}
+    majority = Counter(layouts.values()).most_common(1)[0][0]
+    return next(name for name, layout in layouts.items() if layout == majority)
+
+def map_is_available(info, stream_map):
+    """
+    Check that a ``-map`` specifier like ``0:a`` or ``0:a:1`` selects a stream in the first input.
+
+    Specifiers this doesn't understand are assumed valid and left to ffmpeg.
+    """
+    parts = stream_map.rstrip('?').split(':')
+    types = {'v': 'video', 'a': 'audio', 's': 'subtitle'}
+    if len(parts) < 2 or parts[0] != '0' or parts[1] not in types:
+        return True
+    available = streams(info, types[parts[1]])
+    if len(parts) == 2:
+        return bool(available)
+    try:
+        return int(parts[2]) < len(available)
+    except ValueError:
+        return True
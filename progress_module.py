@@ -0,0 +1,392 @@
+import re
+import json
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import timedelta
+from pyrogram.errors import FloodWait
+
+logger = logging.getLogger(__name__)
+
+# ffmpeg's input header, e.g. "  Duration: 00:23:40.01, start: 0.000000, bitrate: 5012 kb/s"
+DURATION = re.compile(r'Duration:\s*(\d+):(\d{2}):(\d{2}(?:\.\d+)?)')
+
+# Arguments that make ffmpeg print machine-readable key=value progress blocks
+# to stderr (stdout may be carrying the output file when streaming).
+FFMPEG_PROGRESS_ARGS = ['-hide_banner', '-nostats', '-progress', 'pipe:2']
+
+def format_eta(seconds):
+    """Format a number of seconds as H:MM:SS, or '-' if unknown."""
+    if seconds is None:
+        return '-'
+    return str(timedelta(seconds=int(seconds)))
+
+def format_bytes(size):
+    """Format a byte count as a human readable string (e.g., 1.50 GiB)."""
+    size = float(size or 0)
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024:
+            return f"{size:.2f} {unit}"
+        size /= 1024
+    return f"{size:.2f} TiB"
+
+@dataclass
+class FFmpegProgress:
+    """A snapshot of ffmpeg progress. Fields ffmpeg reports as N/A are None."""
+    frame: int = None
+    fps: float = None
+    size: int = None          # bytes written so far
+    out_time: float = None    # seconds of output written
+    bitrate: str = None
+    speed: float = None       # multiple of realtime
+    duration: float = None    # seconds of input, if known
+    finished: bool = False
+
+    @property
+    def percent(self):
+        if self.finished:
+            return 100.0
+        if not self.duration or self.out_time is None:
+            return None
+        return min(100.0, self.out_time * 100 / self.duration)
+
+    @property
+    def eta(self):
+        """Remaining time in seconds, estimated from the processing speed."""
+        if not self.duration or self.out_time is None or not self.speed:
+            return None
+        return max(0.0, (self.duration - self.out_time) / self.speed)
+
+    def text(self, label):
+        """Render the progress as a status message."""
+        percent = self.percent
+        size = f'{self.size / 1048576:.2f} MB' if self.size is not None else '-'
+        speed = f'{self.speed}x' if self.speed is not None else '-'
+        lines = [f'**{label}**: {percent:.1f}%' if percent is not None else f'**{label}**:']
+        lines.append(f'**Time**: {format_eta(self.out_time)} / {format_eta(self.duration)} | **Size**: {size}')
+        lines.append(f'**Speed**: {speed} | **FPS**: {self.fps or "-"} | '
+                     f'**Bitrate**: {self.bitrate or "-"} | **ETA**: {format_eta(self.eta)}')
+        return '\n'.join(lines)
+
+def _int(value):
+    return int(value)
+
+def _float(value):
+    return float(value.rstrip('x'))
+
+def _str(value):
+    return value
+
+def _time_us(value):
+    value = int(value)
+    # ffmpeg reports a huge negative number before the first packet is written
+    return value / 1000000 if value >= 0 else None
+
+# key -> (record field, converter)
+_FIELDS = {
+    'frame': ('frame', _int),
+    'fps': ('fps', _float),
+    'total_size': ('size', _int),
+    'out_time_us': ('out_time', _time_us),
+    'out_time_ms': ('out_time', _time_us),  # also microseconds, kept for old ffmpeg
+    'bitrate': ('bitrate', _str),
+    'speed': ('speed', _float),
+}
+
+class FFmpegProgressParser:
+    """
+    Incremental parser for ``ffmpeg -progress`` output.
+
+    Feed it every stderr line. Each key=value line is handled with one
+    partition and a dict lookup, and a complete FFmpegProgress is returned
+    when a block ends (``progress=continue`` / ``progress=end``). If no
+    duration is given it is taken from ffmpeg's first ``Duration:`` line.
+    """
+
+    def __init__(self, duration=None):
+        self.duration = duration
+        self._current = FFmpegProgress(duration=duration)
+
+    def feed(self, line):
+        key, sep, value = line.partition('=')
+        if not sep:
+            if self.duration is None and line.startswith('Duration:'):
+                match = DURATION.match(line)
+                if match:
+                    hours, minutes, seconds = match.groups()
+                    self.duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+                    self._current.duration = self.duration
+            return None
+
+        key = key.strip()
+        value = value.strip()
+        if key == 'progress':
+            progress = self._current
+            progress.finished = value == 'end'
+            self._current = FFmpegProgress(duration=self.duration)
+            return progress
+
+        field = _FIELDS.get(key)
+        if field is not None and value != 'N/A':
+            name, convert = field
+            try:
+                setattr(self._current, name, convert(value))
+            except ValueError:
+                pass
+        return None
+
+# Arguments that make rclone log its stats as one JSON object per line
+RCLONE_PROGRESS_ARGS = ['--use-json-log', '--stats', '2s', '--stats-one-line', '--stats-log-level', 'NOTICE']
+
+@dataclass
+class RcloneFileProgress:
+    """Progress of one file rclone is transferring."""
+    name: str
+    size: int = None
+    bytes: int = 0
+    percent: float = None
+    speed: float = None       # bytes per second
+    eta: float = None         # seconds
+
+@dataclass
+class RcloneProgress:
+    """A snapshot of the ``stats`` rclone logs with --use-json-log."""
+    bytes: int = 0
+    total_bytes: int = None
+    speed: float = None       # bytes per second
+    eta: float = None         # seconds
+    transfers: int = 0
+    total_transfers: int = None
+    checks: int = 0
+    errors: int = 0
+    elapsed: float = None
+    transferring: list = field(default_factory=list)
+
+    @property
+    def percent(self):
+        if not self.total_bytes:
+            return None
+        return min(100.0, self.bytes * 100 / self.total_bytes)
+
+    def text(self, label, max_files=3):
+        """Render the progress as a status message."""
+        percent = self.percent
+        lines = [f'**{label}**: {percent:.1f}%' if percent is not None else f'**{label}**:']
+        lines.append(f' {format_bytes(self.bytes)} of {format_bytes(self.total_bytes)}')
+        speed = f'{format_bytes(self.speed)}/s' if self.speed is not None else '-'
+        lines.append(f'**Speed**: {speed} | **ETA**: {format_eta(self.eta)}')
+        files = f'{self.transfers}/{self.total_transfers}' if self.total_transfers is not None else str(self.transfers)
+        lines.append(f'**Files**: {files} | **Errors**: {self.errors}')
+        for transfer in self.transferring[:max_files]:
+            file_percent = f'{transfer.percent:.0f}%' if transfer.percent is not None else '-'
+            lines.append(f'`{transfer.name}`: {file_percent}')
+        return '\n'.join(lines)
+
+def parse_rclone_log(line):
+    """
+    Parse one line of ``rclone --use-json-log`` output.
+
+    Returns:
+    - tuple: (RcloneProgress or None, error message or None). Lines that are
+      not JSON, or JSON without stats or an error, give (None, None).
+    """
+    if not line.startswith('{'):
+        return None, None
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        return None, None
+
+    error = entry.get('msg') if entry.get('level') in ('error', 'critical') else None
+    stats = entry.get('stats')
+    if not isinstance(stats, dict):
+        return None, error
+
+    transferring = [
+        RcloneFileProgress(
+            name=transfer.get('name', ''),
+            size=transfer.get('size'),
+            bytes=transfer.get('bytes', 0),
+            percent=transfer.get('percentage'),
+            speed=transfer.get('speed'),
+            eta=transfer.get('eta'),
+        )
+        for transfer in stats.get('transferring') or []
+    ]
+    progress = RcloneProgress(
+        bytes=stats.get('bytes', 0),
+        total_bytes=stats.get('totalBytes'),
+        speed=stats.get('speed'),
+        eta=stats.get('eta'),
+        transfers=stats.get('transfers', 0),
+        total_transfers=stats.get('totalTransfers'),
+        checks=stats.get('checks', 0),
+        errors=stats.get('errors', 0),
+        elapsed=stats.get('elapsedTime'),
+        transferring=transferring,
+    )
+    return progress, error
+
+class ChatEditBudget:
+    """
+    Spaces out message edits per chat across every ProgressReporter.
+
+    Each edit reserves the next free slot for its chat, at least ``gap``
+    seconds after the previous one. A FloodWait pushes the chat's next slot
+    back by the time Telegram asked for.
+    """
+
+    def __init__(self, gap=1.0):
+        self.gap = gap
+        self._next_slot = {}
+
+    async def wait(self, chat_id):
+        if chat_id is None:
+            # Not a Telegram message (e.g. a BatchProgress item), nothing to limit
+            return
+        now = time.monotonic()
+        slot = max(now, self._next_slot.get(chat_id, now))
+        self._next_slot[chat_id] = slot + self.gap
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def block(self, chat_id, seconds):
+        until = time.monotonic() + seconds
+        self._next_slot[chat_id] = max(self._next_slot.get(chat_id, until), until)
+
+edit_budget = ChatEditBudget()
+
+class ProgressReporter:
+    """
+    Coalescing, rate-limited status message updater.
+
+    update() only stores the latest text and returns immediately, so process
+    output is never slowed down by Telegram. A background task edits the
+    status message at most every ``interval`` seconds, skipping unchanged
+    text and waiting out FloodWait. Use as ``async with ProgressReporter(status)``
+    so pending edits stop before the caller deletes or rewrites the message.
+    """
+
+    def __init__(self, status, interval=3, budget=None):
+        self.status = status
+        self.interval = interval
+        self.budget = budget or edit_budget
+        self.chat_id = getattr(getattr(status, 'chat', None), 'id', None)
+        self._latest = None
+        self._sent = None
+        self._changed = asyncio.Event()
+        self._task = None
+
+    def update(self, text):
+        self._latest = text
+        self._changed.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            if self._latest == self._sent:
+                continue
+            await self.budget.wait(self.chat_id)
+            text = self._latest
+            try:
+                await self.status.edit_text(text)
+                self._sent = text
+            except FloodWait as e:
+                logger.warning(f"FloodWait while editing status, backing off {e.value}s")
+                self.budget.block(self.chat_id, e.value)
+                self._changed.set()
+                continue
+            except Exception as e:
+                # e.g. MessageNotModified or a deleted message; keep going
+                logger.error(f"Error editing status: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def close(self, flush=False):
+        """
+        Stop the background edits.
+
+        Parameters:
+        - flush (bool): Then also edit in the latest text if it wasn't shown
+          yet, for callers that leave the message as it is (e.g. BatchProgress).
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if flush and self._latest is not None and self._latest != self._sent:
+            await self.budget.wait(self.chat_id)
+            try:
+                await self.status.edit_text(self._latest)
+                self._sent = self._latest
+            except Exception as e:
+                logger.error(f"Error editing status: {e}")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+class BatchProgress:
+    """
+    Aggregates the progress of several concurrent operations into one status message.
+
+    Each operation gets a stand-in status from item(); whatever it would edit
+    into its own message is summarised as one line of the shared message.
+    """
+
+    def __init__(self, status, total, label):
+        self.reporter = ProgressReporter(status)
+        self.total = total
+        self.label = label
+        self.done = 0
+        self.failed = 0
+        self.lines = {}
+
+    def item(self, name):
+        return BatchItemStatus(self, name)
+
+    def finish(self, name, ok):
+        self.lines.pop(name, None)
+        if ok:
+            self.done += 1
+        else:
+            self.failed += 1
+        self.render()
+
+    def render(self):
+        header = f"**{self.label}**: {self.done}/{self.total} done"
+        if self.failed:
+            header += f", {self.failed} failed"
+        self.reporter.update("\n".join([header] + [f"`{name}`: {line}" for name, line in self.lines.items()]))
+
+    async def __aenter__(self):
+        self.render()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        # The final "N/N done" stays in the message
+        await self.reporter.close(flush=exc_info[0] is None)
+
+class BatchItemStatus:
+    """A status message stand-in that forwards to a BatchProgress."""
+    chat = None
+
+    def __init__(self, batch, name):
+        self.batch = batch
+        self.name = name
+
+    async def edit_text(self, text):
+        # Keep the first line, e.g. "**Changing Index**: 45.0%"
+        self.batch.lines[self.name] = text.split("\n", 1)[0]
+        self.batch.render()
+
+    async def delete(self):
+        pass
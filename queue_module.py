@@ -0,0 +1,373 @@
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from types import SimpleNamespace
+from pyrogram.errors import FloodWait
+from job_module import QUEUED, RUNNING, CANCELLED, ACTIVE_STATES
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    owner INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    status_id INTEGER,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    state TEXT NOT NULL,
+    worker TEXT,
+    heartbeat REAL,
+    cancel INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    text TEXT,
+    message_id INTEGER,
+    ref INTEGER,
+    done INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS claims (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    holder TEXT NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    path TEXT
+);
+"""
+
+# Outbox actions
+SEND = 'send'
+EDIT = 'edit'
+DELETE = 'delete'
+DOCUMENT = 'document'
+
+class WorkQueue:
+    """
+    Durable job queue shared by the bot frontend and its workers.
+
+    The frontend enqueues jobs; workers claim them one at a time, keep a
+    heartbeat on the jobs they run and mark them finished. A job whose
+    worker stopped heartbeating is put back in the queue for another worker,
+    which resumes it from the job journal like a restart would.
+
+    Workers never talk to Telegram: their status edits and messages go into
+    an outbox that the frontend relays (see relay_outbox).
+
+    It also holds the Workspace claims of every process sharing the download
+    disk: disk space reservations and the paths running jobs use.
+
+    Everything lives in one SQLite file, so the frontend and the workers must
+    see the same file: one host, or storage with working file locks. A
+    requeued job resumes from the checkpoints of the job journal, so the
+    frontend and the workers must share JOB_JOURNAL_FILE the same way.
+
+    The methods block on SQLite (up to its 30s lock timeout); async code calls
+    them through asyncio.to_thread. The connection is shared by those threads
+    and serialised by a lock.
+
+    Parameters:
+    - path (str): The SQLite database file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Autocommit; claim() takes the write lock itself
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def enqueue(self, job, chat_id, status_id, params):
+        """
+        Queue a job for the workers.
+
+        Parameters:
+        - job (Job): The job, its ID is kept.
+        - chat_id (int): The chat of its status message.
+        - status_id (int): The status message the worker edits.
+        - params (dict): JSON serialisable runner arguments.
+        """
+        with self._lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO tasks (id, owner, chat_id, status_id, name, kind, params, state, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.owner, chat_id, status_id, job.name, job.kind, json.dumps(params), QUEUED, time.time())
+            )
+
+    def claim(self, worker):
+        """
+        Take the oldest queued job for ``worker``.
+
+        Returns:
+        - dict: The task row with its params decoded, or None if the queue is empty.
+        """
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute("SELECT * FROM tasks WHERE state = ? ORDER BY id LIMIT 1", (QUEUED,)).fetchone()
+                if row is not None:
+                    now = time.time()
+                    self.db.execute(
+                        "UPDATE tasks SET state = ?, worker = ?, heartbeat = ?, updated = ? WHERE id = ?",
+                        (RUNNING, worker, now, now, row['id'])
+                    )
+                self.db.execute("COMMIT")
+            except sqlite3.Error:
+                self.db.execute("ROLLBACK")
+                raise
+        return dict(row, params=json.loads(row['params'])) if row is not None else None
+
+    def heartbeat(self, worker):
+        """Mark the jobs ``worker`` runs as still alive."""
+        with self._lock:
+            self.db.execute("UPDATE tasks SET heartbeat = ? WHERE worker = ? AND state = ?", (time.time(), worker, RUNNING))
+
+    def requeue_stale(self, timeout):
+        """
+        Put jobs whose worker hasn't heartbeated for ``timeout`` seconds back in the queue.
+
+        Returns:
+        - int: The number of jobs requeued.
+        """
+        cutoff = time.time() - timeout
+        with self._lock:
+            # The space and paths an unresponsive worker claimed are free again
+            self.db.execute(
+                "DELETE FROM claims WHERE holder IN (SELECT worker FROM tasks WHERE state = ? AND heartbeat < ?)",
+                (RUNNING, cutoff)
+            )
+            # A job cancelled while its worker was gone stays cancelled
+            self.db.execute(
+                "UPDATE tasks SET state = ?, updated = ? WHERE state = ? AND heartbeat < ? AND cancel = 1",
+                (CANCELLED, time.time(), RUNNING, cutoff)
+            )
+            cursor = self.db.execute(
+                "UPDATE tasks SET state = ?, worker = NULL, updated = ? WHERE state = ? AND heartbeat < ?",
+                (QUEUED, time.time(), RUNNING, cutoff)
+            )
+        if cursor.rowcount:
+            logger.warning(f"Requeued {cursor.rowcount} job(s) of unresponsive workers")
+        return cursor.rowcount
+
+    def finish(self, task_id, state):
+        with self._lock:
+            self.db.execute("UPDATE tasks SET state = ?, updated = ? WHERE id = ?", (state, time.time(), task_id))
+
+    def cancel(self, task_id, owner=None):
+        """
+        Cancel a job: a queued one right away, a running one by asking its worker.
+
+        Returns:
+        - str: A message describing the result.
+        """
+        with self._lock:
+            row = self.db.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        if row is None or (owner is not None and row['owner'] != owner):
+            return f"No job #{task_id} found."
+        if row['state'] not in ACTIVE_STATES:
+            return f"Job #{task_id} is already {row['state']}."
+        if row['state'] == QUEUED:
+            self.finish(task_id, CANCELLED)
+        else:
+            with self._lock:
+                self.db.execute("UPDATE tasks SET cancel = 1, updated = ? WHERE id = ?", (time.time(), task_id))
+        return f"Job #{task_id} ({row['name']}) cancelled."
+
+    def cancel_requests(self, worker):
+        """Return the IDs of ``worker``'s running jobs that users asked to cancel."""
+        with self._lock:
+            rows = self.db.execute("SELECT id FROM tasks WHERE worker = ? AND state = ? AND cancel = 1", (worker, RUNNING)).fetchall()
+        return [row['id'] for row in rows]
+
+    def list(self, owner=None, active_only=False, limit=50):
+        """Return the most recent jobs as dicts, oldest first."""
+        query = "SELECT * FROM tasks WHERE 1 = 1"
+        params = []
+        if owner is not None:
+            query += " AND owner = ?"
+            params.append(owner)
+        if active_only:
+            query += f" AND state IN ({', '.join('?' for _ in ACTIVE_STATES)})"
+            params.extend(ACTIVE_STATES)
+        with self._lock:
+            rows = self.db.execute(query + " ORDER BY id DESC LIMIT ?", (*params, limit)).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def post(self, chat_id, action, text=None, message_id=None, ref=None):
+        """
+        Add a message action for the frontend to relay.
+
+        Parameters:
+        - action (str): SEND, EDIT, DELETE or DOCUMENT (``text`` is then a local path).
+        - message_id (int): The message to edit or delete, if the frontend sent it.
+        - ref (int): Otherwise the outbox ID of the SEND that created it.
+
+        Returns:
+        - int: The outbox ID.
+        """
+        with self._lock:
+            cursor = self.db.execute(
+                "INSERT INTO outbox (chat_id, action, text, message_id, ref) VALUES (?, ?, ?, ?, ?)",
+                (chat_id, action, text, message_id, ref)
+            )
+        return cursor.lastrowid
+
+    def pending(self, limit=100):
+        with self._lock:
+            rows = self.db.execute("SELECT * FROM outbox WHERE done = 0 ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def delivered(self, outbox_id, message_id=None):
+        """Mark an outbox entry relayed, remembering the message a SEND created."""
+        with self._lock:
+            self.db.execute("UPDATE outbox SET done = 1, message_id = COALESCE(?, message_id) WHERE id = ?", (message_id, outbox_id))
+
+    def message_id_of(self, ref):
+        with self._lock:
+            row = self.db.execute("SELECT message_id FROM outbox WHERE id = ?", (ref,)).fetchone()
+        return row['message_id'] if row is not None else None
+
+    def prune_outbox(self, keep=10000):
+        """Drop relayed entries beyond the newest ``keep``."""
+        with self._lock:
+            self.db.execute(
+                "DELETE FROM outbox WHERE done = 1 AND id < (SELECT COALESCE(MAX(id), 0) FROM outbox) - ?", (keep,)
+            )
+
+    def reserve(self, holder, size, budget):
+        """
+        Reserve disk space if the reservations of all processes leave room for it.
+
+        Parameters:
+        - holder (str): The process reserving, see release_holder.
+        - size (int): The bytes to reserve.
+        - budget (int): The bytes all reservations may add up to (free space minus the margin).
+
+        Returns:
+        - int: The claim ID, or None if ``size`` doesn't fit.
+        """
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                reserved = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM claims").fetchone()[0]
+                claim_id = None
+                if reserved + size <= budget:
+                    claim_id = self.db.execute("INSERT INTO claims (holder, size) VALUES (?, ?)", (holder, size)).lastrowid
+                self.db.execute("COMMIT")
+            except sqlite3.Error:
+                self.db.execute("ROLLBACK")
+                raise
+        return claim_id
+
+    def claim_paths(self, holder, paths):
+        """Mark paths as used by a running job; returns the claim IDs."""
+        with self._lock:
+            return [self.db.execute("INSERT INTO claims (holder, path) VALUES (?, ?)", (holder, path)).lastrowid for path in paths]
+
+    def release(self, claim_ids):
+        with self._lock:
+            self.db.executemany("DELETE FROM claims WHERE id = ?", [(claim_id,) for claim_id in claim_ids])
+
+    def paths_in_use(self):
+        with self._lock:
+            rows = self.db.execute("SELECT DISTINCT path FROM claims WHERE path IS NOT NULL").fetchall()
+        return {row['path'] for row in rows}
+
+    def release_holder(self, holder):
+        """Drop every claim of ``holder``, e.g. left behind when it was killed."""
+        with self._lock:
+            self.db.execute("DELETE FROM claims WHERE holder = ?", (holder,))
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+def describe_task(task):
+    """Render a queued job like Job.describe, with the worker running it."""
+    worker = f" on `{task['worker']}`" if task['worker'] and task['state'] == RUNNING else ""
+    return f"`#{task['id']}` **{task['name']}** - {task['state']}{worker}"
+
+class QueueMessage:
+    """A status message stand-in for workers; edits and deletes go through the outbox."""
+
+    def __init__(self, queue, chat_id, message_id=None, ref=None):
+        self.queue = queue
+        self.chat = SimpleNamespace(id=chat_id)
+        self.id = message_id
+        self.ref = ref
+
+    async def edit_text(self, text, **kwargs):
+        await asyncio.to_thread(self.queue.post, self.chat.id, EDIT, text, self.id, self.ref)
+
+    async def delete(self):
+        await asyncio.to_thread(self.queue.post, self.chat.id, DELETE, None, self.id, self.ref)
+
+    async def reply_text(self, text, **kwargs):
+        return QueueMessage(self.queue, self.chat.id, ref=await asyncio.to_thread(self.queue.post, self.chat.id, SEND, text))
+
+class QueueMessenger:
+    """Stands in for the Pyrogram client in job runners executed by a worker."""
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return QueueMessage(self.queue, chat_id, ref=await asyncio.to_thread(self.queue.post, chat_id, SEND, text))
+
+    async def send_document(self, chat_id, document, **kwargs):
+        await asyncio.to_thread(self.queue.post, chat_id, DOCUMENT, document)
+
+async def relay_outbox(queue, client, send_document, interval=1):
+    """
+    Relay the workers' messages and status edits to Telegram, forever.
+
+    Of several pending edits to one message only the last is sent.
+
+    Parameters:
+    - queue (WorkQueue): The shared queue.
+    - client (Client): The bot's Pyrogram client.
+    - send_document (callable): async (chat_id, path) sending a worker's output file.
+    """
+    # Document sends run in the background; keep them referenced until done
+    sending = set()
+    while True:
+        entries = await asyncio.to_thread(queue.pending)
+        last_edit = {}
+        for entry in entries:
+            if entry['action'] == EDIT:
+                last_edit[(entry['message_id'], entry['ref'])] = entry['id']
+        for entry in entries:
+            message_id = entry['message_id'] or (await asyncio.to_thread(queue.message_id_of, entry['ref']) if entry['ref'] else None)
+            try:
+                if entry['action'] == SEND:
+                    message = await client.send_message(entry['chat_id'], entry['text'])
+                    await asyncio.to_thread(queue.delivered, entry['id'], message.id)
+                    continue
+                if entry['action'] == EDIT and last_edit[(entry['message_id'], entry['ref'])] == entry['id'] and message_id:
+                    await client.edit_message_text(entry['chat_id'], message_id, entry['text'])
+                elif entry['action'] == DELETE and message_id:
+                    await client.delete_messages(entry['chat_id'], message_id)
+                elif entry['action'] == DOCUMENT:
+                    task = asyncio.create_task(send_document(entry['chat_id'], entry['text']))
+                    sending.add(task)
+                    task.add_done_callback(sending.discard)
+            except FloodWait as e:
+                logger.warning(f"FloodWait while relaying worker messages, backing off {e.value}s")
+                await asyncio.sleep(e.value)
+                break
+            except Exception as e:
+                # e.g. MessageNotModified or a deleted message
+                logger.error(f"Error relaying {entry['action']} to chat {entry['chat_id']}: {e}")
+            await asyncio.to_thread(queue.delivered, entry['id'])
+        else:
+            if entries:
+                await asyncio.to_thread(queue.prune_outbox)
+            await asyncio.sleep(interval)
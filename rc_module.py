@@ -1,32 +1,112 @@
 import re
-from re import findall as refindall
 import os
+import glob
+import shutil
+import json
 import asyncio
 import logging
-import subprocess
-from logging.handlers import RotatingFileHandler
+import tempfile
+from log_module import setup_logging
+from job_module import current_job
+from progress_module import FFmpegProgressParser, FFMPEG_PROGRESS_ARGS, ProgressReporter, BatchProgress
+from progress_module import RCLONE_PROGRESS_ARGS, parse_rclone_log, format_bytes
+from probe_module import probe, probe_duration, concat_problems, map_is_available, streams
+from probe_module import CONCAT_FIELDS, stream_layout, majority_reference
+from metrics_module import metrics
+from cache_module import local_files
 
 # Configure the logging module
 LOG_FILE_NAME = "mergebot.txt"
+LOG_BACKUP_COUNT = 10
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="[%(asctime)s - %(levelname)s] - %(name)s - %(message)s",
-    datefmt='%d-%b-%y %H:%M:%S',
-    handlers=[
-        RotatingFileHandler(
-            LOG_FILE_NAME,
-            maxBytes=50000000,
-            backupCount=10
-        ),
-        logging.StreamHandler()
-    ]
-)
+# Records are written by a background thread; the last lines stay in memory for /log N
+log_buffer = setup_logging(LOG_FILE_NAME, max_bytes=50000000, backup_count=LOG_BACKUP_COUNT, buffer_lines=5000)
 logging.getLogger("pyrogram").setLevel(logging.WARNING)
 
 logger = logging.getLogger(__name__)
 
-async def download(status, remote_path, local_path, remote_name='remote', rclone_config_path=None):
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.avi', '.mov')
+SUBTITLE_EXTENSIONS = ('.srt', '.ass', '.ssa', '.vtt')
+
+# Split on both \r and \n: rclone --progress and ffmpeg -stats redraw their
+# status line with carriage returns only.
+LINE_SPLIT = re.compile(rb'[\r\n]+')
+
+async def read_lines(stream, chunk_size=65536):
+    """
+    Asynchronously yield decoded lines from a subprocess stream.
+
+    Parameters:
+    - stream (asyncio.StreamReader): The stdout/stderr stream of the process.
+    - chunk_size (int): The number of bytes to read at a time.
+    """
+    buffer = b''
+    while True:
+        chunk = await stream.read(chunk_size)
+        if not chunk:
+            break
+        buffer += chunk
+        *lines, buffer = LINE_SPLIT.split(buffer)
+        for line in lines:
+            line = line.decode('utf-8', 'replace').strip()
+            if line:
+                yield line
+    line = buffer.decode('utf-8', 'replace').strip()
+    if line:
+        yield line
+
+async def run_process(command, on_line=None, stdin=None, stdout=None):
+    """
+    Run a command without blocking the event loop, streaming its output.
+
+    stdout and stderr are merged and every non-empty line is passed to
+    ``on_line`` as soon as it is read. When called from inside a scheduled
+    job, the process is attached to that job so it can be cancelled.
+
+    Parameters:
+    - command (list): The command and its arguments.
+    - on_line (coroutine function): Called with each output line (optional).
+    - stdin (int): A file descriptor to use as the process stdin (optional).
+    - stdout (int): A file descriptor to use as the process stdout (optional).
+      Only stderr is passed to ``on_line`` then.
+
+    Descriptors passed as stdin/stdout are closed in this process once the
+    child has started, so pipes between processes see EOF correctly.
+
+    Returns:
+    - int: The return code of the process.
+    """
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=stdin,
+            stdout=asyncio.subprocess.PIPE if stdout is None else stdout,
+            stderr=asyncio.subprocess.STDOUT if stdout is None else asyncio.subprocess.PIPE
+        )
+    finally:
+        for fd in (stdin, stdout):
+            if fd is not None:
+                os.close(fd)
+    output = proc.stdout if stdout is None else proc.stderr
+    job = current_job.get()
+    if job is not None:
+        job.processes.add(proc)
+        if not job.active:
+            proc.terminate()
+    try:
+        async for line in read_lines(output):
+            if on_line is not None:
+                await on_line(line)
+        return await proc.wait()
+    except asyncio.CancelledError:
+        if proc.returncode is None:
+            proc.kill()
+        raise
+    finally:
+        if job is not None:
+            job.processes.discard(proc)
+
+async def download(status, remote_path, local_path, remote_name='remote', rclone_config_path=None, profile=None):
     """
     Download files from a cloud path to a local path using rclone.
 
@@ -35,12 +115,11 @@ async def download(status, remote_path, local_path, remote_name='remote', rclone
     - local_path (str): The local directory where files will be downloaded.
     - remote_name (str): The name of the rclone remote (default is 'remote').
     - rclone_config_path (str): The path to the rclone configuration file.
+    - profile (str): The transfer profile to use (see choose_rclone_profile).
 
     Returns:
-    - None
+    - str: The downloaded path, or None on failure.
     """
-    global process
-
     # Build the rclone command
     rclone_download_command = [
         'rclone',
@@ -49,91 +128,408 @@ async def download(status, remote_path, local_path, remote_name='remote', rclone
         'copy',
         f'{remote_name}:{remote_path}',
         local_path,
-        '--progress'
+        *RCLONE_PROGRESS_ARGS,
+        *rclone_profile_flags(profile)
     ]
 
-    last_text = None
     downloaded_path = None
+    reporter = ProgressReporter(status)
+
+    async def on_line(line):
+        progress, error = parse_rclone_log(line)
+        if error is not None:
+            logger.error(f"rclone: {error}")
+        if progress is not None:
+            measurement.observe(progress.bytes)
+            reporter.update(progress.text('Downloading'))
+
     try:
-        # Run the rclone command
-        process = subprocess.Popen(rclone_download_command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-        # Log output in real time
-        for line in process.stdout:
-            line = line.strip()
-            datam = refindall("Transferred:.*ETA.*", line)
-            if datam is not None:
-                if len(datam) > 0:
-                    progress = datam[0].replace("Transferred:", "").strip().split(",")
-                    dwdata = progress[0].strip().split('/')
-                    eta = progress[3].strip().replace('ETA', '').strip()
-                    text = f'**Downloading**:\n {dwdata[0].strip()} of {dwdata[1].strip()}\n**Speed**: {progress[2]} | **ETA**: {eta}'
-
-                    if text != last_text:
-                        await status.edit_text(text)
-                        await asyncio.sleep(3)
-                        last_text = text
-                        
-        if process is not None:
-          process.wait()
-
-          if process.returncode == 0:
-              # Determine the downloaded path
-              if os.path.isdir(local_path):
-                  downloaded_path = local_path
-              else:
-                  downloaded_files = os.listdir(local_path)
-                  if len(downloaded_files) == 1:
-                      downloaded_path = os.path.join(local_path, downloaded_files[0])
-                  else:
-                      downloaded_path = local_path  
-              await status.delete()
-          else:
-            await status.edit_text(f"rclone command failed with return code {process.returncode}")
+        # Run the rclone command, logging output in real time
+        with metrics.measure('download', remote_name) as measurement:
+            async with reporter:
+                returncode = await run_process(rclone_download_command, on_line)
+            measurement.exit_code = returncode
+
+        if returncode == 0:
+            # Determine the downloaded path
+            if os.path.isdir(local_path):
+                downloaded_path = local_path
+            else:
+                downloaded_files = os.listdir(local_path)
+                if len(downloaded_files) == 1:
+                    downloaded_path = os.path.join(local_path, downloaded_files[0])
+                else:
+                    downloaded_path = local_path
+            await status.delete()
         else:
-          await status.delete()
-    except subprocess.CalledProcessError as e:
+            await status.edit_text(f"rclone command failed with return code {returncode}")
+    except OSError as e:
         logger.error(f"Error: {e}")
-    finally:
-      process = None
     return downloaded_path
 
-async def merge(status, local_path, output_filename, custom_title, audio_select):
+# Named sets of rclone tuning flags. Backend flags such as --drive-chunk-size
+# are global in rclone and ignored by other backends.
+RCLONE_PROFILES = {
+    'default': [],
+    'bulk': [
+        '--transfers', '16', '--checkers', '32',
+        '--buffer-size', '32M',
+        '--drive-chunk-size', '64M', '--s3-chunk-size', '16M',
+    ],
+    'single-large-file': [
+        '--transfers', '1', '--checkers', '4',
+        '--multi-thread-streams', '8', '--multi-thread-cutoff', '64M',
+        '--buffer-size', '128M',
+        '--drive-chunk-size', '256M', '--s3-chunk-size', '64M', '--s3-upload-concurrency', '8',
+    ],
+    'low-memory': [
+        '--transfers', '2', '--checkers', '4',
+        '--buffer-size', '4M', '--use-mmap',
+        '--drive-chunk-size', '8M', '--s3-chunk-size', '5M',
+        '--multi-thread-streams', '2',
+    ],
+}
+# Remote name -> profile always used for that remote
+REMOTE_PROFILES = {}
+
+# Thresholds for choosing a profile from the source listing
+LARGE_FILE_SIZE = 1024 ** 3
+BULK_FILE_COUNT = 10
+
+def load_rclone_profiles(config_path):
+    """
+    Load extra transfer profiles and per-remote defaults from a JSON file.
+
+    The file looks like ``{"profiles": {"name": ["--flag", "value"]}, "remotes": {"gdrive": "bulk"}}``;
+    profiles with the same name replace the built-in ones. A missing file is ignored.
+    """
+    if not config_path or not os.path.exists(config_path):
+        return
+    try:
+        with open(config_path) as config_file:
+            config = json.load(config_file)
+        RCLONE_PROFILES.update({name: [str(flag) for flag in flags] for name, flags in config.get('profiles', {}).items()})
+        REMOTE_PROFILES.update(config.get('remotes', {}))
+    except (OSError, ValueError, AttributeError) as e:
+        logger.error(f"Error loading rclone profiles from {config_path}: {e}")
+
+def choose_rclone_profile(remote_name, count=None, size=None, requested=None):
+    """
+    Pick the transfer profile for a transfer.
+
+    An explicitly requested profile wins, then the remote's configured profile.
+    Otherwise a single large file gets 'single-large-file', many files get
+    'bulk', and anything else (or an unknown listing) 'default'.
+    """
+    if requested in RCLONE_PROFILES:
+        return requested
+    if requested:
+        logger.error(f"Unknown rclone profile '{requested}', choosing automatically")
+    if REMOTE_PROFILES.get(remote_name) in RCLONE_PROFILES:
+        return REMOTE_PROFILES[remote_name]
+    if count == 1 and size is not None and size >= LARGE_FILE_SIZE:
+        return 'single-large-file'
+    if count is not None and count >= BULK_FILE_COUNT:
+        return 'bulk'
+    return 'default'
+
+def rclone_profile_flags(profile):
+    """Return the rclone flags of a profile (none for None or an unknown name)."""
+    return RCLONE_PROFILES.get(profile or 'default', [])
+
+async def rclone_lsjson(remote_path, remote_name='remote', rclone_config_path=None, hashes=False, recursive=True, files=None):
+    """
+    List the files below a remote path (or the file itself) using ``rclone lsjson -R``.
+
+    Parameters:
+    - hashes (bool): Also fetch the hashes the backend supports (may be slow on some backends).
+    - recursive (bool): False lists only the folder's direct children, folders included (IsDir).
+    - files (list): Only list these paths, relative to ``remote_path`` (``--files-from``).
+
+    Returns:
+    - list: One dict per file (Path, Size, ModTime, ...), or None on failure.
+    """
+    entries = []
+
+    async def on_line(line):
+        # One entry per line, e.g. {"Path":"a.mkv","Size":1,...}, and log lines are skipped
+        if line.startswith('{'):
+            entries.append(json.loads(line.rstrip(',')))
+
+    command = ['rclone', '--config', rclone_config_path, 'lsjson']
+    if recursive:
+        command += ['-R', '--files-only']
+    if hashes:
+        command.append('--hash')
+    files_from = None
+    if files is not None:
+        # Hashing only what we ask about, not the whole destination
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+            f.write(''.join(f"{path}\n" for path in files))
+            files_from = f.name
+        command += ['--files-from', files_from]
+    command.append(f'{remote_name}:{remote_path}')
+    try:
+        if await run_process(command, on_line) == 0:
+            return entries
+    except (OSError, ValueError) as e:
+        logger.error(f"Error listing {remote_name}:{remote_path}: {e}")
+    finally:
+        if files_from is not None:
+            os.remove(files_from)
+    return None
+
+# ffprobe codec_name -> the ffmpeg encoder used to conform a merge input to it
+ENCODERS = {
+    'h264': 'libx264',
+    'hevc': 'libx265',
+    'mpeg4': 'mpeg4',
+    'vp9': 'libvpx-vp9',
+    'av1': 'libaom-av1',
+    'aac': 'aac',
+    'ac3': 'ac3',
+    'eac3': 'eac3',
+    'mp3': 'libmp3lame',
+    'opus': 'libopus',
+    'vorbis': 'libvorbis',
+    'flac': 'flac',
+    'subrip': 'srt',
+    'ass': 'ass',
+    'webvtt': 'webvtt',
+    'mov_text': 'mov_text',
+}
+# Encoders that take ffprobe's profile name (lowercased, e.g. "main10") and -crf
+X26X_ENCODERS = ('libx264', 'libx265')
+STREAM_TYPES = {'video': 'v', 'audio': 'a', 'subtitle': 's'}
+# Directory inside the merge folder that conformed copies are written to
+CONFORM_DIR = '.conformed'
+
+def conform_args(info, reference, container):
+    """
+    Build ffmpeg output arguments that give a merge input the stream layout of the reference.
+
+    Streams are mapped in the reference's order. Streams that already match
+    are copied, the others are re-encoded with the reference's codec,
+    resolution, pixel format, sample rate and channels.
+
+    Parameters:
+    - info (dict): Probe info of the input to conform.
+    - reference (dict): Probe info of the input it must match.
+    - container (str): The output extension, e.g. '.mp4'.
+
+    Returns:
+    - list: The arguments, or None if the input lacks a stream or a codec has no encoder.
+    """
+    args = []
+    reference_streams = [s for s in reference['streams'] if s.get('codec_type') in CONCAT_FIELDS]
+    seen = {}
+    for index, target in enumerate(reference_streams):
+        codec_type = target['codec_type']
+        position = seen[codec_type] = seen.get(codec_type, -1) + 1
+        candidates = streams(info, codec_type)
+        if position >= len(candidates):
+            return None
+        source = candidates[position]
+        args += ['-map', f'0:{STREAM_TYPES[codec_type]}:{position}']
+
+        if all(source.get(field) == target.get(field) for field in CONCAT_FIELDS[codec_type]):
+            args += [f'-c:{index}', 'copy']
+            continue
+        encoder = ENCODERS.get(target.get('codec_name'))
+        if encoder is None:
+            return None
+        args += [f'-c:{index}', encoder]
+
+        if codec_type == 'video':
+            if (source.get('width'), source.get('height')) != (target.get('width'), target.get('height')):
+                args += [f'-filter:{index}', f"scale={target['width']}:{target['height']}"]
+            if target.get('pix_fmt'):
+                args += [f'-pix_fmt:{index}', target['pix_fmt']]
+            if encoder in X26X_ENCODERS:
+                args += [f'-crf:{index}', '18']
+                if target.get('profile'):
+                    args += [f'-profile:{index}', target['profile'].lower().replace('constrained ', '').replace(' ', '')]
+            # MP4 keeps the time base as the track timescale; Matroska always uses 1/1000
+            time_base = target.get('time_base', '')
+            if container in SEEKABLE_INPUTS and '/' in time_base:
+                args += ['-video_track_timescale', time_base.split('/')[1]]
+        elif codec_type == 'audio':
+            if target.get('sample_rate'):
+                args += [f'-ar:{index}', str(target['sample_rate'])]
+            if target.get('channels'):
+                args += [f'-ac:{index}', str(target['channels'])]
+    return args
+
+async def conform(status, input_path, output_path, args, threads=0):
+    """
+    Re-encode one merge input with arguments from conform_args().
+
+    Parameters:
+    - input_path (str): The input file.
+    - output_path (str): The conformed copy to write.
+    - args (list): The output arguments from conform_args().
+    - threads (int): ffmpeg -threads (0 lets ffmpeg decide).
+
+    Returns:
+    - bool: True if ffmpeg succeeded.
+    """
+    duration = await probe_duration(input_path)
+    ffmpeg_command = [
+        'ffmpeg',
+        *FFMPEG_PROGRESS_ARGS,
+        '-y',
+        '-i', input_path,
+        *args,
+        '-threads', str(threads),
+        output_path
+    ]
+
+    parser = FFmpegProgressParser(duration)
+    reporter = ProgressReporter(status)
+
+    async def on_line(line):
+        progress = parser.feed(line)
+        if progress is not None:
+            measurement.observe(progress.size)
+            reporter.update(progress.text('Conforming'))
+
+    try:
+        with metrics.measure('conform') as measurement:
+            async with reporter:
+                returncode = await run_process(ffmpeg_command, on_line)
+            measurement.exit_code = returncode
+    except OSError as e:
+        logger.error(f"Error: {e}")
+        return False
+    if returncode != 0:
+        logger.error(f"Conforming {input_path} failed with return code {returncode}")
+    return returncode == 0
+
+async def conform_inputs(status, infos, paths, output_dir, concurrency=None):
+    """
+    Re-encode the merge inputs whose streams differ from the majority, so all can be stream-copied.
+
+    Only the odd inputs are encoded, in parallel; the conforming ones are left alone.
+
+    Parameters:
+    - infos (dict): File name -> probe info, in concat order.
+    - paths (dict): File name -> path of the input.
+    - output_dir (str): The directory conformed copies are written to.
+    - concurrency (int): Max parallel encodes (default: one per core).
+
+    Returns:
+    - tuple: (dict of file name -> conformed path, list of problems). On any
+      problem nothing usable is returned.
+    """
+    reference_name = majority_reference(infos)
+    if reference_name is None:
+        return {}, concat_problems(infos)
+    reference = infos[reference_name]
+    layout = stream_layout(reference)
+    container = os.path.splitext(reference_name)[1].lower()
+
+    plans = {}
+    problems = []
+    for name, info in infos.items():
+        if stream_layout(info) == layout:
+            continue
+        args = conform_args(info, reference, container)
+        if args is None:
+            problems.append(f"`{name}` can't be converted to the streams of `{reference_name}`")
+        else:
+            plans[name] = args
+    if problems:
+        return {}, problems
+    logger.info(f"Conforming {len(plans)} of {len(infos)} inputs to {reference_name}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    cpus = os.cpu_count() or 1
+    concurrency = concurrency or min(len(plans), cpus)
+    # Share the cores between the parallel encodes
+    threads = max(1, cpus // concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    conformed = {name: os.path.join(output_dir, os.path.splitext(name)[0] + container) for name in plans}
+
+    async with BatchProgress(status, len(plans), 'Conforming') as batch:
+        async def run(name):
+            async with semaphore:
+                ok = await conform(batch.item(name), paths[name], conformed[name], plans[name], threads)
+            batch.finish(name, ok)
+            return ok
+
+        results = await asyncio.gather(*(run(name) for name in plans))
+    failed = [f"`{name}` could not be re-encoded" for name, ok in zip(plans, results) if not ok]
+    if failed:
+        return {}, failed
+    return conformed, []
+
+async def merge(status, local_path, output_filename, custom_title, audio_select, smart=False):
     """
     Merge video files in a local directory using ffmpeg. 
     Parameters:
     - local_path (str): The local directory containing video files.
     - output_filename (str): The name of the merged output file (default is 'merged_video.mp4').
+    - smart (bool): Re-encode inputs whose streams differ from the majority
+      instead of refusing to merge them (see conform_inputs).
 
     Returns:
     - str: The path of the merged video file.
     """
-    global process
-
     # Ensure the local path exists
     if not os.path.exists(local_path):
         logger.error(f"The local path '{local_path}' does not exist.")
         return
 
-    # Get a list of video files in the local directory
-    video_files = [f for f in os.listdir(local_path) if f.lower().endswith(('.mp4', '.mkv', '.avi', '.mov'))]
+    # Get a list of video files in the local directory, skipping a previous output
+    video_files = [f for f in os.listdir(local_path) if f.lower().endswith(VIDEO_EXTENSIONS) and f != output_filename]
     
     if not video_files:
         logger.error("No video files found in the specified local path.")
         return
     video_files.sort()
 
+    # Check the inputs can be stream-copied together before writing anything
+    paths = {f: os.path.join(local_path, f) for f in video_files}
+    infos = dict(zip(video_files, await asyncio.gather(*(probe(paths[f]) for f in video_files))))
+    problems = concat_problems(infos)
+    conform_path = os.path.join(local_path, CONFORM_DIR)
+    if problems and smart:
+        # Encode just the odd inputs to the layout most of them share
+        conformed, problems = await conform_inputs(status, infos, paths, conform_path)
+        if not problems:
+            paths.update(conformed)
+            infos.update(zip(conformed, await asyncio.gather(*(probe(path) for path in conformed.values()))))
+            problems = concat_problems(infos)
+    first = infos[video_files[0]]
+    if not problems and not map_is_available(first, audio_select):
+        problems.append(f"`{audio_select}` selects no audio stream in `{video_files[0]}`")
+    if problems:
+        logger.error(f"Merge of {local_path} rejected: {problems}")
+        shutil.rmtree(conform_path, ignore_errors=True)
+        await status.edit_text("**Cannot merge these files**:\n" + "\n".join(problems[:20]))
+        return None
+
     # Create the input.txt file
     input_txt_path = os.path.join(local_path, 'input.txt')
     with open(input_txt_path, 'w') as input_txt:
-        input_txt.writelines([f"file '{os.path.join(local_path, file)}'\n" for file in video_files])
+        input_txt.writelines([f"file '{paths[file]}'\n" for file in video_files])
+
+    # The concat demuxer doesn't know the total length, so add up the inputs
+    durations = [await probe_duration(paths[file]) for file in video_files]
+    duration = sum(durations) if None not in durations else None
 
+    # Only map subtitles when the inputs have them; a bare 0:s fails otherwise
+    stream_maps = ['-map', '0:v', '-map', f'{audio_select}']
+    if streams(first, 'subtitle'):
+        stream_maps += ['-map', '0:s']
 
     # Build the ffmpeg command
     output_file_path = os.path.join(local_path, output_filename)
     file_title = await remove_unwanted(output_filename)
     ffmpeg_command = [
         'ffmpeg',
-        '-loglevel','error','-stats',
+        *FFMPEG_PROGRESS_ARGS,
+        '-y',  # a resumed job overwrites its partial output
         '-f', 'concat',
         '-safe', '0',
         '-i', input_txt_path,
@@ -141,75 +537,169 @@ async def merge(status, local_path, output_filename, custom_title, audio_select)
         '-metadata:s:v:0', f'title={custom_title}',
         '-metadata:s:a:0', f'title={custom_title}',
         '-c', 'copy',
-        '-map', '0:v',  # Copy video stream
-        '-map', f'{audio_select}',
-        '-map', '0:s',
+        *stream_maps,
+        *output_args(output_filename, subtitle_codecs=[s.get('codec_name') for s in streams(first, 'subtitle')]),
         output_file_path
     ]
 
-    last_text = None
+    parser = FFmpegProgressParser(duration)
+    reporter = ProgressReporter(status)
+
+    async def on_line(line):
+        progress = parser.feed(line)
+        if progress is not None:
+            measurement.observe(progress.size)
+            reporter.update(progress.text('Merging'))
 
     try:
-        # Run the ffmpeg command and capture the output
-        process = subprocess.Popen(ffmpeg_command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-        
-        # Log output in real time
-        for line in process.stdout:
-            if process is None: # Check if the process has been cancelled
-              break
-            line = line.strip()
-
-            # Parse the ffmpeg progress output
-            frame_match = re.search(r'frame=\s*(\d+)', line)
-            fps_match = re.search(r'fps=\s*(\d+\.?\d*)', line)
-            size_match = re.search(r'size=\s*([\d\.]+(?:kB|MB|GB))', line)
-            time_match = re.search(r'time=(\d{2}:\d{2}:\d{2}\.\d{2})', line)
-            bitrate_match = re.search(r'bitrate=\s*([\d\.]+kbits/s)', line)
-            speed_match = re.search(r'speed=\s*([\d\.]+x)', line)
-
-            if frame_match and fps_match and size_match and time_match and bitrate_match and speed_match:
-                frame = int(frame_match.group(1))
-                fps = float(fps_match.group(1))
-                size = convert_size_to_mb(size_match.group(1))
-                time_str = time_match.group(1)
-                bitrate = bitrate_match.group(1)
-                speed_str = speed_match.group(1)
-
-                text = (f'**Merging**:\n**Frame**: {frame} | **FPS**: {fps} | **Size**: {size:.2f} MB | '
-                        f'**Time**: {time_str} | **Bitrate**: {bitrate} | **Speed**: {speed_str}')
-
-                if text != last_text:
-                    await status.edit_text(text)
-                    await asyncio.sleep(3)
-                    last_text = text
-                    
-        if process is not None:  # Ensure process is still running before waiting
-            process.wait()
-
-            if process.returncode == 0:
-              await status.delete()
-            else:
-              await status.edit_text(f"ffmpeg command failed with return code {process.returncode}")
+        # Run the ffmpeg command, logging output in real time
+        with metrics.measure('merge') as measurement:
+            async with reporter:
+                returncode = await run_process(ffmpeg_command, on_line)
+            measurement.exit_code = returncode
+
+        if returncode == 0:
+            await status.delete()
         else:
-           await status.delete
-        
-    except subprocess.CalledProcessError as e:
+            await status.edit_text(f"ffmpeg command failed with return code {returncode}")
+            return None
+    except OSError as e:
         logger.error(f"Error: {e}")
         return None
     finally:
-        # Remove the input.txt file after merging
+        # Remove the input.txt file and any conformed copies after merging
         os.remove(input_txt_path)
-        process = None  # Clear the process reference in the end
-        return output_file_path
+        shutil.rmtree(conform_path, ignore_errors=True)
+    return output_file_path
         
-async def changeindex(status, local_path, input_file_name, output_file_name, custom_title, audio_select):
-   
-    input_file_path = os.path.join(local_path, input_file_name)
-    output_file_path = os.path.join(local_path, output_file_name)
+# Output containers ffmpeg can write to a pipe, and the muxer to use for each.
+# MP4/MOV only as fragmented MP4 (see output_args); anything else needs seekable output.
+STREAM_FORMATS = {
+    '.mkv': 'matroska',
+    '.mka': 'matroska',
+    '.webm': 'webm',
+    '.ts': 'mpegts',
+    '.mp4': 'mp4',
+    '.m4v': 'mp4',
+    '.mov': 'mov',
+}
+# Inputs that may keep their index at the end of the file and so need seeking
+SEEKABLE_INPUTS = ('.mp4', '.m4v', '.mov')
+
+# Subtitle codec each output container takes; Matroska keeps SRT/ASS as they are
+SUBTITLE_CODECS = {
+    '.mp4': 'mov_text',
+    '.m4v': 'mov_text',
+    '.mov': 'mov_text',
+    '.webm': 'webvtt',
+    '.mkv': 'copy',
+    '.mka': 'copy',
+}
+
+# A fragmented MP4 needs no seeking back to write its index, so it can go to a pipe
+FRAGMENTED_MP4_FLAGS = '+frag_keyframe+empty_moov+default_base_moof'
+
+def output_args(output_file_name, streaming=False, subtitle_codecs=()):
+    """
+    Pick the muxer options for a remux output from its extension.
+
+    MP4/MOV files get ``+faststart``, which moves the index (moov atom) to the
+    front so players and Telegram previews can start before the whole file is
+    downloaded. Streamed MP4/MOV output is fragmented instead. Subtitles are
+    converted to what the container supports (mov_text, WebVTT) or copied.
+
+    Parameters:
+    - output_file_name (str): The output file name.
+    - streaming (bool): The output goes to a pipe (see stream_remux).
+    - subtitle_codecs (list): The codec names of the source's subtitles, if known.
+
+    Returns:
+    - list: ffmpeg output arguments, to add after the codec options.
+    """
+    container = os.path.splitext(output_file_name)[1].lower()
+    args = []
+    if container in SUBTITLE_CODECS:
+        codec = SUBTITLE_CODECS[container]
+        if codec == 'copy' and 'mov_text' in subtitle_codecs:
+            # Matroska can't hold MP4's mov_text, convert it to SRT
+            codec = 'srt'
+        args += ['-c:s', codec]
+    if container in SEEKABLE_INPUTS:
+        args += ['-movflags', FRAGMENTED_MP4_FLAGS if streaming else '+faststart']
+    if streaming:
+        # A pipe has no extension to guess the muxer from
+        args += ['-f', STREAM_FORMATS[container]]
+    return args
+
+def can_stream(input_file_name, output_file_name):
+    """Return True if a remux from input to output can run on pipes without seeking."""
+    return (os.path.splitext(output_file_name)[1].lower() in STREAM_FORMATS
+            and not input_file_name.lower().endswith(SEEKABLE_INPUTS))
+
+async def stream_remux(ffmpeg_command, source, destination, on_line=None, rclone_config_path=None):
+    """
+    Run an ffmpeg command between ``rclone cat`` and ``rclone rcat``.
+
+    ffmpeg must read from pipe:0 and write to pipe:1. Nothing touches the local
+    disk, so a remux costs about one transfer time. If any of the three
+    processes fails the partial destination file is deleted.
+
+    Parameters:
+    - ffmpeg_command (list): The ffmpeg command.
+    - source (str): The rclone path to read (remote:path/file).
+    - destination (str): The rclone path to write (remote:path/file).
+    - on_line (coroutine function): Called with each ffmpeg stderr line.
+    - rclone_config_path (str): The path to the rclone configuration file.
+
+    Returns:
+    - int: 0 on success, otherwise the first non-zero return code.
+    """
+    rclone = ['rclone', '--config', rclone_config_path]
+    cat_read, cat_write = os.pipe()
+    rcat_read, rcat_write = os.pipe()
+    returncodes = await asyncio.gather(
+        run_process(rclone + ['cat', source], stdout=cat_write),
+        run_process(ffmpeg_command, on_line, stdin=cat_read, stdout=rcat_write),
+        run_process(rclone + ['rcat', destination], stdin=rcat_read),
+        return_exceptions=True
+    )
+    # Report ffmpeg's own failure first; rclone cat usually just dies of SIGPIPE
+    failed = [code for code in (returncodes[1], returncodes[0], returncodes[2]) if code != 0]
+    if failed:
+        logger.error(f"Streaming remux {source} -> {destination} failed: {returncodes}")
+        await run_process(rclone + ['deletefile', destination])
+        return failed[0] if isinstance(failed[0], int) else -1
+    return 0
+
+async def changeindex(status, local_path, input_file_name, output_file_name, custom_title, audio_select,
+                      source=None, destination=None, rclone_config_path=None):
+    """
+    Remux a video, re-selecting the audio streams and retitling all streams.
+
+    When ``source`` and ``destination`` rclone paths are given, the input is
+    streamed from the remote and the output straight back to it (see
+    stream_remux), without a local copy. Check can_stream() first.
+
+    Returns:
+    - str: The path of the output file (or ``destination``), None on failure.
+    """
+    streaming = source is not None and destination is not None
+    if streaming:
+        input_file_path = 'pipe:0'
+        output_file_path = 'pipe:1'
+    else:
+        input_file_path = os.path.join(local_path, input_file_name)
+        output_file_path = os.path.join(local_path, output_file_name)
     file_title = await remove_unwanted(output_file_name)
+    # A piped input is never probed; ffmpeg's Duration line is used instead
+    duration = None if streaming else await probe_duration(input_file_path)
+    info = None if streaming else await probe(input_file_path)
+    subtitle_codecs = [s.get('codec_name') for s in streams(info, 'subtitle')] if info else []
 
     ffmpeg_command = [
         'ffmpeg',
+        *FFMPEG_PROGRESS_ARGS,
+        '-y',
         '-i', input_file_path,
         '-metadata', f'title={file_title}',
         '-metadata:s:v:0', f'title={custom_title}',
@@ -219,63 +709,40 @@ async def changeindex(status, local_path, input_file_name, output_file_name, cus
         '-map', '0:v',  # Copy video stream
         '-map', f'{audio_select}', # Copy audio stream
         '-map', '0:s', # Copy sub stream
+        *output_args(output_file_name, streaming, subtitle_codecs),
         output_file_path
     ]
 
-    last_text = None
+    parser = FFmpegProgressParser(duration)
+    reporter = ProgressReporter(status)
+
+    async def on_line(line):
+        progress = parser.feed(line)
+        if progress is not None:
+            measurement.observe(progress.size)
+            reporter.update(progress.text('Changing Index'))
 
     try:
-        # Run the ffmpeg command and capture the output
-        process = subprocess.Popen(ffmpeg_command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-        
-        # Log output in real time
-        for line in process.stdout:
-            if process is None: # Check if the process has been cancelled
-              break
-            line = line.strip()
-
-            # Parse the ffmpeg progress output
-            frame_match = re.search(r'frame=\s*(\d+)', line)
-            fps_match = re.search(r'fps=\s*(\d+\.?\d*)', line)
-            size_match = re.search(r'size=\s*([\d\.]+(?:kB|MB|GB))', line)
-            time_match = re.search(r'time=(\d{2}:\d{2}:\d{2}\.\d{2})', line)
-            bitrate_match = re.search(r'bitrate=\s*([\d\.]+kbits/s)', line)
-            speed_match = re.search(r'speed=\s*([\d\.]+x)', line)
-
-            if frame_match and fps_match and size_match and time_match and bitrate_match and speed_match:
-                frame = int(frame_match.group(1))
-                fps = float(fps_match.group(1))
-                size = convert_size_to_mb(size_match.group(1))
-                time_str = time_match.group(1)
-                bitrate = bitrate_match.group(1)
-                speed_str = speed_match.group(1)
-
-                text = (f'**Frame**: {frame} | **FPS**: {fps} | **Size**: {size:.2f} MB | '
-                        f'**Time**: {time_str} | **Bitrate**: {bitrate} | **Speed**: {speed_str}')
-
-                if text != last_text:
-                    await status.edit_text(text)
-                    last_text = text
-
-                await asyncio.sleep(3)
-
-
-        if process is not None:  # Ensure process is still running before waiting
-            process.wait()
-
-            if process.returncode == 0:
-              await status.delete()
-            else:
-              await status.edit_text(f"ffmpeg command failed with return code {process.returncode}")
+        # Run the ffmpeg command, logging output in real time
+        remote = source.split(':', 1)[0] if streaming else None
+        with metrics.measure('changeindex', remote) as measurement:
+            async with reporter:
+                if streaming:
+                    returncode = await stream_remux(ffmpeg_command, source, destination, on_line, rclone_config_path)
+                    output_file_path = destination
+                else:
+                    returncode = await run_process(ffmpeg_command, on_line)
+            measurement.exit_code = returncode
+
+        if returncode == 0:
+            await status.delete()
         else:
-           await status.delete
-        
-    except subprocess.CalledProcessError as e:
+            await status.edit_text(f"ffmpeg command failed with return code {returncode}")
+            return None
+    except OSError as e:
         logger.error(f"Error: {e}")
         return None
-    finally:
-        process = None  # Clear the process reference in the end
-        return output_file_path
+    return output_file_path
 
 async def softmux(status, local_path, input_file_name, output_file_name, custom_title, audio_select, subtitle_file_name):
    
@@ -283,9 +750,12 @@ async def softmux(status, local_path, input_file_name, output_file_name, custom_
     subtitle_file_path = os.path.join(local_path, subtitle_file_name)
     output_file_path = os.path.join(local_path, output_file_name)
     file_title = await remove_unwanted(output_file_name)
+    duration = await probe_duration(input_file_path)
 
     ffmpeg_command = [
     'ffmpeg',
+    *FFMPEG_PROGRESS_ARGS,
+    '-y',
     '-i', input_file_path,
     '-i', subtitle_file_path,  # Include the SRT subtitle file
     '-metadata', f'title={file_title}',
@@ -294,69 +764,168 @@ async def softmux(status, local_path, input_file_name, output_file_name, custom_
     '-metadata:s:s:0', f'title={custom_title}',
     '-c:v', 'copy',  # Copy video stream
     '-c:a', 'copy',  # Copy audio stream
-    '-c:s', 'mov_text',  # Use mov_text codec for the subtitle
     '-map', '0:v',  # Map the video stream
     '-map', f'{audio_select}',  # Map the selected audio stream
     '-map', '1',  # Map the new subtitle file
+    *output_args(output_file_name),  # Subtitle codec and muxer options for the container
     output_file_path
     ]
 
-    last_text = None
+    parser = FFmpegProgressParser(duration)
+    reporter = ProgressReporter(status)
+
+    async def on_line(line):
+        progress = parser.feed(line)
+        if progress is not None:
+            measurement.observe(progress.size)
+            reporter.update(progress.text('Softmuxing'))
 
     try:
-        # Run the ffmpeg command and capture the output
-        process = subprocess.Popen(ffmpeg_command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-        
-        # Log output in real time
-        for line in process.stdout:
-            if process is None: # Check if the process has been cancelled
-              break
-            line = line.strip()
-
-            # Parse the ffmpeg progress output
-            frame_match = re.search(r'frame=\s*(\d+)', line)
-            fps_match = re.search(r'fps=\s*(\d+\.?\d*)', line)
-            size_match = re.search(r'size=\s*([\d\.]+(?:kB|MB|GB))', line)
-            time_match = re.search(r'time=(\d{2}:\d{2}:\d{2}\.\d{2})', line)
-            bitrate_match = re.search(r'bitrate=\s*([\d\.]+kbits/s)', line)
-            speed_match = re.search(r'speed=\s*([\d\.]+x)', line)
-
-            if frame_match and fps_match and size_match and time_match and bitrate_match and speed_match:
-                frame = int(frame_match.group(1))
-                fps = float(fps_match.group(1))
-                size = convert_size_to_mb(size_match.group(1))
-                time_str = time_match.group(1)
-                bitrate = bitrate_match.group(1)
-                speed_str = speed_match.group(1)
-
-                text = (f'**Frame**: {frame} | **FPS**: {fps} | **Size**: {size:.2f} MB | '
-                        f'**Time**: {time_str} | **Bitrate**: {bitrate} | **Speed**: {speed_str}')
-
-                if text != last_text:
-                    await status.edit_text(text)
-                    last_text = text
-
-                await asyncio.sleep(3)
-
-
-        if process is not None:  # Ensure process is still running before waiting
-            process.wait()
-
-            if process.returncode == 0:
-              await status.delete()
-            else:
-              await status.edit_text(f"ffmpeg command failed with return code {process.returncode}")
+        # Run the ffmpeg command, logging output in real time
+        with metrics.measure('softmux') as measurement:
+            async with reporter:
+                returncode = await run_process(ffmpeg_command, on_line)
+            measurement.exit_code = returncode
+
+        if returncode == 0:
+            await status.delete()
         else:
-           await status.delete
-        
-    except subprocess.CalledProcessError as e:
+            await status.edit_text(f"ffmpeg command failed with return code {returncode}")
+            return None
+    except OSError as e:
         logger.error(f"Error: {e}")
         return None
-    finally:
-        process = None  # Clear the process reference in the end
-        return output_file_path
+    return output_file_path
+
+# Episode tags used to pair subtitles with videos, e.g. S01E02 or "- 02"
+SEASON_EPISODE_TAG = re.compile(r'(?i)S(\d+)\s*E(\d+)')
+# "E05", "Ep05", "Episode 5" or "Show - 05"
+EPISODE_TAG = re.compile(r'(?i)(?:\b(?:Episode|Ep|E)\s*|\s-\s*)(\d{1,3})(?:v\d)?(?=[\s._\[\(-]|$)')
+# Otherwise the last bare number; an earlier one may be part of the title ("Show 2 05")
+BARE_NUMBER = re.compile(r'(?:^|[\s._-])(\d{1,3})(?:v\d)?(?=[\s._\[\(-]|$)')
+
+def find_media(pattern, extensions=VIDEO_EXTENSIONS):
+    """
+    Return the sorted media files matching a directory or glob pattern.
+
+    Parameters:
+    - pattern (str): A directory (all matching files in it) or a glob.
+    - extensions (tuple): The file extensions to keep.
+    """
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*')
+    return sorted(os.path.abspath(f) for f in glob.glob(pattern) if f.lower().endswith(extensions) and os.path.isfile(f))
+
+def episode_key(file_name, pattern=None):
+    """Return the key used to match a video with its subtitle, or None."""
+    stem = os.path.splitext(os.path.basename(file_name))[0]
+    if pattern is not None:
+        match = re.search(pattern, stem)
+        return match.group(1) if match else None
+    match = SEASON_EPISODE_TAG.search(stem)
+    if match is not None:
+        return (int(match.group(1)), int(match.group(2)))
+    match = EPISODE_TAG.search(stem)
+    if match is not None:
+        return (None, int(match.group(1)))
+    numbers = BARE_NUMBER.findall(stem)
+    return (None, int(numbers[-1])) if numbers else None
 
-async def upload(status, local_file, remote_path, remote_name='remote', rclone_config_path=None):
+def pair_subtitles(video_files, subtitle_files, pattern=None):
+    """
+    Pair each video with a subtitle file.
+
+    A subtitle whose name starts with the video's name wins (e.g. ``ep1.mkv`` and
+    ``ep1.en.srt``). Otherwise both are matched on ``pattern`` (a regex whose
+    first group is the key) or, by default, on their episode number.
+
+    Returns:
+    - dict: Video path -> subtitle path, or None if no subtitle matched.
+    """
+    by_key = {}
+    for subtitle in subtitle_files:
+        key = episode_key(subtitle, pattern)
+        if key is not None:
+            by_key.setdefault(key, subtitle)
+            if isinstance(key, tuple):
+                # Also match on the episode number alone ("S01E02" vs "- 02")
+                by_key.setdefault((None, key[1]), subtitle)
+
+    pairs = {}
+    for video in video_files:
+        stem = os.path.splitext(os.path.basename(video))[0]
+        # The stem must end at a dot, so "E1" doesn't take "E10.srt"
+        prefixed = [s for s in subtitle_files if re.match(re.escape(stem) + r'(\.|$)', os.path.basename(s))]
+        if prefixed:
+            pairs[video] = prefixed[0]
+        else:
+            key = episode_key(video, pattern)
+            if key is None:
+                pairs[video] = None
+            elif isinstance(key, tuple):
+                pairs[video] = by_key.get(key) or by_key.get((None, key[1]))
+            else:
+                pairs[video] = by_key.get(key)
+    return pairs
+
+async def batch_remux(status, pattern, operation, output_path, output_template, custom_title, audio_select,
+                      subtitle_pattern=None, concurrency=None):
+    """
+    Run changeindex or softmux over many files concurrently.
+
+    Stream copies are I/O-bound, so several run at once (by default one per
+    core, at most 4). Progress of all files is shown in the single status message.
+
+    Parameters:
+    - pattern (str): A directory or glob selecting the input videos.
+    - operation (str): 'changeindex' or 'softmux'.
+    - output_path (str): The directory the outputs are written to.
+    - output_template (str): The output file name; ``{name}`` is replaced by the input name.
+    - subtitle_pattern (str): Regex pairing subtitles to videos (softmux, optional).
+    - concurrency (int): The number of files remuxed at once.
+
+    Returns:
+    - dict: Input path -> output path, or None for the inputs that failed.
+    """
+    video_files = find_media(pattern)
+    if not video_files:
+        await status.edit_text(f"No video files match `{pattern}`.")
+        return {}
+
+    pairs = {}
+    if operation == 'softmux':
+        subtitle_dirs = {os.path.dirname(video) for video in video_files}
+        subtitle_files = sorted(s for d in subtitle_dirs for s in find_media(d, SUBTITLE_EXTENSIONS))
+        pairs = pair_subtitles(video_files, subtitle_files, subtitle_pattern)
+
+    os.makedirs(output_path, exist_ok=True)
+    concurrency = concurrency or min(os.cpu_count() or 1, 4)
+    semaphore = asyncio.Semaphore(concurrency)
+    results = dict.fromkeys(video_files)
+
+    async def remux(batch, video):
+        name = os.path.splitext(os.path.basename(video))[0]
+        output_file_name = output_template.replace('{name}', name)
+        async with semaphore:
+            item_status = batch.item(name)
+            if operation == 'softmux':
+                if pairs.get(video) is None:
+                    logger.error(f"No subtitle found for {video}")
+                    output = None
+                else:
+                    output = await softmux(item_status, output_path, video, output_file_name,
+                                           custom_title, audio_select, pairs[video])
+            else:
+                output = await changeindex(item_status, output_path, video, output_file_name,
+                                           custom_title, audio_select)
+        results[video] = output
+        batch.finish(name, output is not None)
+
+    async with BatchProgress(status, len(video_files), f'Batch {operation}') as batch:
+        await asyncio.gather(*(remux(batch, video) for video in video_files))
+    return results
+
+async def upload(status, local_file, remote_path, remote_name='remote', rclone_config_path=None, profile=None, index=None):
     """
     Upload a local file to a specified path on a cloud storage using rclone.
 
@@ -365,11 +934,21 @@ async def upload(status, local_file, remote_path, remote_name='remote', rclone_c
     - remote_path (str): The path on the cloud storage.
     - remote_name (str): The name of the rclone remote (default is 'remote').
     - rclone_config_path (str): The path to the rclone configuration file.
+    - profile (str): The transfer profile to use (see choose_rclone_profile).
+    - index (ContentIndex): If given, the upload is skipped when the remote
+      already has every file with a matching hash.
 
     Returns:
-    - None
+    - bool: True if the upload succeeded.
     """
-    global process
+    if index is not None:
+        # Only the paths this upload would write, a destination can hold far more
+        remote_entries = await rclone_lsjson(remote_path, remote_name, rclone_config_path, hashes=True,
+                                             files=[relative for relative, _ in local_files(local_file)])
+        if await index.already_uploaded(local_file, remote_entries):
+            logger.info(f"Skipping upload of {local_file}, {remote_name}:{remote_path} already has it")
+            await status.edit_text("Already on the remote (matching hashes), nothing to upload.")
+            return True
 
     # Build the rclone command for uploading
     rclone_upload_command = [
@@ -379,41 +958,118 @@ async def upload(status, local_file, remote_path, remote_name='remote', rclone_c
         'copy',
         local_file,
         f'{remote_name}:{remote_path}',
-        '--progress'
+        *RCLONE_PROGRESS_ARGS,
+        *rclone_profile_flags(profile)
     ]
-    last_text = None
+    reporter = ProgressReporter(status)
+
+    async def on_line(line):
+        progress, error = parse_rclone_log(line)
+        if error is not None:
+            logger.error(f"rclone: {error}")
+        if progress is not None:
+            measurement.observe(progress.bytes)
+            reporter.update(progress.text('Uploading'))
+
     try:
-        # Run the rclone command
-        process = subprocess.Popen(rclone_upload_command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-        # Log output in real time
-        for line in process.stdout:
-          line = line.strip()
-          datam = refindall("Transferred:.*ETA.*", line)
-          if datam is not None:
-            if len(datam) > 0:
-              progress = datam[0].replace("Transferred:", "").strip().split(",")
-              dwdata = progress[0].strip().split('/')
-              eta = progress[3].strip().replace('ETA', '').strip()
-              text =f'**Uploaded**:\n {dwdata[0].strip()} of {dwdata[1].strip()}\n**Speed**: {progress[2]} | **ETA**: {eta}"'
-
-              if text != last_text:
-                await status.edit_text(text)
-                await asyncio.sleep(3)
-                last_text = text
-                
-        if process is not None:
-          process.wait()
-
-          if process.returncode == 0:
+        # Run the rclone command, logging output in real time
+        with metrics.measure('upload', remote_name) as measurement:
+            async with reporter:
+                returncode = await run_process(rclone_upload_command, on_line)
+            measurement.exit_code = returncode
+
+        if returncode == 0:
             await status.delete()
-          else:
-            await status.edit_text(f"rclone command failed with return code {process.returncode}")
-        else:
-          await status.delete()
-    except subprocess.CalledProcessError as e:
+            return True
+        await status.edit_text(f"rclone command failed with return code {returncode}")
+    except OSError as e:
         logger.error(f"Error: {e}")
-    finally:
-      process = None
+    return False
+
+async def rclone_check(local_file, remote_path, remote_name='remote', rclone_config_path=None):
+    """
+    Verify an upload with ``rclone check --one-way``: every local file must be on
+    the remote with a matching hash (or size, if the backend has no common hash).
+
+    Returns:
+    - bool: True if the remote has everything.
+    """
+    output = []
+
+    async def on_line(line):
+        output.append(line)
+
+    try:
+        returncode = await run_process([
+            'rclone', '--config', rclone_config_path,
+            'check', local_file, f'{remote_name}:{remote_path}', '--one-way'
+        ], on_line)
+    except OSError as e:
+        logger.error(f"Error checking {remote_name}:{remote_path}: {e}")
+        return False
+    if returncode != 0:
+        logger.error(f"rclone check of {local_file} against {remote_name}:{remote_path} failed: {output[-5:]}")
+    return returncode == 0
+
+async def upload_fanout(status, local_file, destinations, rclone_config_path=None, profiles=None, index=None,
+                        slots=None, verify=True):
+    """
+    Upload a local file (or folder) to several remotes at once and verify each copy.
+
+    All uploads run concurrently, so the file is read from disk once and
+    served from the page cache to the other rclone processes. Each remote is
+    limited by ``slots``, across every job using the same RemoteSlots.
+
+    Parameters:
+    - local_file (str): The local file or folder to upload.
+    - destinations (list): (remote name, remote path) pairs.
+    - profiles (dict): Remote name -> transfer profile (default profile if missing).
+    - index (ContentIndex): Skips remotes that already have the files (see upload).
+    - slots (RemoteSlots): Per-remote concurrency limits (optional).
+    - verify (bool): Run rclone_check after each upload.
+
+    Returns:
+    - dict: "remote:path" -> 'ok', 'upload failed' or 'verify failed', in destination order.
+    """
+    profiles = profiles or {}
+    labels = [f"{remote_name}:{remote_path}" for remote_name, remote_path in destinations]
+    results = dict.fromkeys(labels)
+
+    async with BatchProgress(status, len(destinations), 'Uploading') as batch:
+        async def run(label, remote_name, remote_path):
+            item_status = batch.item(label)
+            try:
+                if slots is not None:
+                    async with slots.slot(remote_name):
+                        uploaded = await upload(item_status, local_file, remote_path, remote_name, rclone_config_path,
+                                                profiles.get(remote_name), index)
+                else:
+                    uploaded = await upload(item_status, local_file, remote_path, remote_name, rclone_config_path,
+                                            profiles.get(remote_name), index)
+                if not uploaded:
+                    results[label] = 'upload failed'
+                elif verify:
+                    await item_status.edit_text("**Verifying**")
+                    ok = await rclone_check(local_file, remote_path, remote_name, rclone_config_path)
+                    results[label] = 'ok' if ok else 'verify failed'
+                else:
+                    results[label] = 'ok'
+            except Exception as e:
+                logger.error(f"Upload of {local_file} to {label} failed: {e}")
+                results[label] = 'upload failed'
+            batch.finish(label, results[label] == 'ok')
+
+        await asyncio.gather(*(
+            run(label, remote_name, remote_path)
+            for label, (remote_name, remote_path) in zip(labels, destinations)
+        ))
+    summary = "\n".join(f"{'✅' if result == 'ok' else '❌'} `{label}`" + ("" if result == 'ok' else f": {result}")
+                        for label, result in results.items())
+    try:
+        await status.edit_text("**Upload**\n" + summary)
+    except Exception as e:
+        logger.error(f"Error editing upload status: {e}")
+    return results
 
 async def remove_unwanted(caption):
     try:
@@ -423,24 +1079,3 @@ async def remove_unwanted(caption):
     except Exception as e:
         logger.error(e)
         return None
-
-def cancel_download():
-    global process
-    if process is not None:
-        process.terminate()
-        process = None
-        return "Download cancelled."
-    else:
-        return "No active download to cancel."
-
-def convert_size_to_mb(size_str):
-    """Convert size string (e.g., 63488kB) to MB."""
-    if 'kB' in size_str:
-        size_in_kb = float(size_str.replace('kB', ''))
-        return size_in_kb / 1024
-    elif 'MB' in size_str:
-        return float(size_str.replace('MB', ''))
-    elif 'GB' in size_str:
-        size_in_gb = float(size_str.replace('GB', ''))
-        return size_in_gb * 1024
-    return 0.0
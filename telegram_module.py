@@ -0,0 +1,167 @@
+import os
+import time
+import asyncio
+import logging
+from progress_module import BatchProgress, format_bytes, format_eta
+from metrics_module import metrics
+
+logger = logging.getLogger(__name__)
+
+# Largest file a bot can send
+TELEGRAM_MAX_FILE_SIZE = 2000 * 1024 * 1024
+
+# Chunk size used when splitting a file into parts
+SPLIT_CHUNK_SIZE = 4 * 1024 * 1024
+
+def split_file(path, part_size):
+    """
+    Split a file into ``<path>.001``, ``<path>.002``, ... of at most ``part_size`` bytes.
+
+    The parts are joined back with ``cat name.* > name`` (or ``copy /b`` on Windows).
+
+    Returns:
+    - list: The part paths, in order.
+    """
+    parts = []
+    with open(path, 'rb') as source:
+        while True:
+            part_path = f"{path}.{len(parts) + 1:03d}"
+            written = 0
+            with open(part_path, 'wb') as part:
+                while written < part_size:
+                    chunk = source.read(min(SPLIT_CHUNK_SIZE, part_size - written))
+                    if not chunk:
+                        break
+                    part.write(chunk)
+                    written += len(chunk)
+            if written == 0:
+                os.remove(part_path)
+                break
+            parts.append(part_path)
+            if written < part_size:
+                break
+    return parts
+
+class BandwidthLimit:
+    """
+    Token bucket shared by concurrent uploads.
+
+    Parameters:
+    - rate (float): Bytes per second for all uploads together, 0 for no limit.
+    """
+
+    def __init__(self, rate=0):
+        self.rate = rate
+        self._available = rate
+        self._last = time.monotonic()
+        self._lock = None
+
+    async def consume(self, size):
+        """Account for ``size`` bytes sent, sleeping while the uploads are over the limit."""
+        if not self.rate or size <= 0:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            now = time.monotonic()
+            self._available = min(self.rate, self._available + (now - self._last) * self.rate)
+            self._last = now
+            self._available -= size
+            if self._available < 0:
+                await asyncio.sleep(-self._available / self.rate)
+
+class TelegramSender:
+    """
+    Sends local files to a chat as documents.
+
+    Files over ``part_size`` are split into numbered parts first. Parts are
+    sent concurrently, at most ``concurrency`` at a time across all jobs, and
+    every upload draws from one BandwidthLimit. Pyrogram waits for the
+    progress callback after each chunk, which is where the limit is applied.
+
+    Parameters:
+    - client (Client): The Pyrogram client.
+    - part_size (int): The largest file sent as is, in bytes.
+    - concurrency (int): Max concurrent uploads.
+    - rate (float): Bandwidth cap in bytes per second, 0 for none.
+    """
+
+    def __init__(self, client, part_size=TELEGRAM_MAX_FILE_SIZE, concurrency=2, rate=0):
+        self.client = client
+        self.part_size = min(part_size, TELEGRAM_MAX_FILE_SIZE)
+        self.concurrency = concurrency
+        self.limit = BandwidthLimit(rate)
+        self._slots = None
+
+    async def _send_part(self, item_status, chat_id, path, caption):
+        sent = 0
+        started = time.monotonic()
+        with metrics.measure('telegram') as measurement:
+            async def progress(current, total):
+                nonlocal sent
+                await self.limit.consume(current - sent)
+                sent = current
+                measurement.observe(current)
+                elapsed = time.monotonic() - started
+                speed = current / elapsed if elapsed else 0
+                eta = format_eta((total - current) / speed) if speed else "-"
+                await item_status.edit_text(f"**Sending**: {current * 100 / total:.1f}% | {format_bytes(current)} of {format_bytes(total)}"
+                                            f" | {format_bytes(speed)}/s | ETA {eta}")
+
+            async with self._slots:
+                await self.client.send_document(chat_id, path, caption=caption, file_name=os.path.basename(path),
+                                                force_document=True, progress=progress)
+            measurement.exit_code = 0
+
+    async def send(self, status, chat_id, path, caption=None):
+        """
+        Send a file to a chat, in parts if it's too large.
+
+        Parameters:
+        - status (Message): The status message, shows the progress of every part.
+        - chat_id (int): The chat to send to.
+        - path (str): The local file.
+        - caption (str): Caption of the document (or of each part).
+
+        Returns:
+        - bool: True if everything was sent.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        parts = [path]
+        if os.path.getsize(path) > self.part_size:
+            await status.edit_text(f"Splitting `{os.path.basename(path)}` into {format_bytes(self.part_size)} parts..")
+            parts = await asyncio.to_thread(split_file, path, self.part_size)
+        results = {}
+        try:
+            async with BatchProgress(status, len(parts), 'Sending') as batch:
+                async def run(part_path, index):
+                    name = os.path.basename(part_path)
+                    part_caption = caption if len(parts) == 1 else f"{caption or ''}\nPart {index}/{len(parts)}".strip()
+                    try:
+                        await self._send_part(batch.item(name), chat_id, part_path, part_caption)
+                        results[name] = True
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        logger.error(f"Error sending {part_path}: {e}")
+                        results[name] = False
+                    batch.finish(name, results[name])
+
+                await asyncio.gather(*(run(part_path, index) for index, part_path in enumerate(parts, 1)))
+        finally:
+            if len(parts) > 1:
+                for part_path in parts:
+                    if os.path.exists(part_path):
+                        os.remove(part_path)
+        ok = all(results.values()) and len(results) == len(parts)
+        try:
+            if len(parts) > 1:
+                await status.edit_text(f"Sent `{os.path.basename(path)}` in {len(parts)} parts"
+                                       + ("" if ok else f", {sum(not r for r in results.values())} failed")
+                                       + f". Join them with `cat {os.path.basename(path)}.* > {os.path.basename(path)}`")
+            else:
+                await status.edit_text("Sent." if ok else f"Sending `{os.path.basename(path)}` failed.")
+        except Exception as e:
+            logger.error(f"Error editing send status: {e}")
+        return ok
@@ -0,0 +1,115 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+from aria_module import poll_rpc_download, reattach_rpc_download, Aria2RPCError
+
+class StubRPC:
+    """Answers aria2.tellStatus from a list of statuses per GID and records every call."""
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.calls = []
+
+    async def call(self, method, *params):
+        self.calls.append((method, *params))
+        if method == 'aria2.tellStatus':
+            gid = params[0]
+            if gid not in self.statuses:
+                raise Aria2RPCError(f"GID {gid} is not found")
+            return self.statuses[gid].pop(0)
+        return 'OK'
+
+class StubReporter:
+    def __init__(self):
+        self.texts = []
+
+    def update(self, text):
+        self.texts.append(text)
+
+def active(total='100', done='50', speed='10'):
+    return {'status': 'active', 'totalLength': total, 'completedLength': done,
+            'downloadSpeed': speed, 'connections': '4'}
+
+class PollRPCDownloadTest(unittest.IsolatedAsyncioTestCase):
+
+    async def poll(self, rpc, job=None, gid='a'):
+        self.reporter = StubReporter()
+        return await poll_rpc_download(rpc, gid, job, self.reporter, 'file.mkv', interval=0)
+
+    async def test_complete(self):
+        rpc = StubRPC({'a': [active(), {'status': 'complete', 'files': [{'path': '/downloads/file.mkv'}]}]})
+        info = await self.poll(rpc)
+        self.assertEqual(info['status'], 'complete')
+        self.assertEqual(len(self.reporter.texts), 1)
+        self.assertIn('50%', self.reporter.texts[0])
+
+    async def test_error(self):
+        rpc = StubRPC({'a': [active(), {'status': 'error', 'errorMessage': 'Not Found'}]})
+        info = await self.poll(rpc)
+        self.assertEqual(info['status'], 'error')
+        self.assertEqual(info['errorMessage'], 'Not Found')
+
+    async def test_followed_by(self):
+        rpc = StubRPC({
+            'a': [{'status': 'complete', 'followedBy': ['b']}],
+            'b': [active(), {'status': 'complete', 'files': []}],
+        })
+        info = await self.poll(rpc)
+        self.assertEqual(info['status'], 'complete')
+        self.assertEqual([call[1] for call in rpc.calls], ['a', 'b', 'b'])
+
+    async def test_cancel_removes_download(self):
+        job = SimpleNamespace(active=True)
+        rpc = StubRPC({'a': [active(), active()]})
+        original = rpc.call
+
+        async def call(method, *params):
+            # Cancel the job after its first status poll
+            result = await original(method, *params)
+            job.active = False
+            return result
+
+        rpc.call = call
+        self.assertIsNone(await self.poll(rpc, job))
+        self.assertEqual(rpc.calls[-1], ('aria2.remove', 'a'))
+        self.assertEqual(sum(call[0] == 'aria2.tellStatus' for call in rpc.calls), 1)
+
+    async def test_cancelled_before_start(self):
+        rpc = StubRPC({'a': [active()]})
+        self.assertIsNone(await self.poll(rpc, SimpleNamespace(active=False)))
+        self.assertEqual(rpc.calls, [('aria2.remove', 'a')])
+
+    async def test_cancelled_task_removes_download(self):
+        job = SimpleNamespace(active=True)
+        rpc = StubRPC({'a': [active()]})
+        task = asyncio.create_task(poll_rpc_download(rpc, 'a', job, StubReporter(), 'file.mkv', interval=60))
+        await asyncio.sleep(0)
+        # Job.cancel marks the job inactive, then cancels its task
+        job.active = False
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual(rpc.calls[-1], ('aria2.remove', 'a'))
+
+    async def test_shutdown_keeps_download(self):
+        rpc = StubRPC({'a': [active()]})
+        task = asyncio.create_task(poll_rpc_download(rpc, 'a', SimpleNamespace(active=True), StubReporter(), 'file.mkv', interval=60))
+        await asyncio.sleep(0)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertNotIn('aria2.remove', [call[0] for call in rpc.calls])
+
+class ReattachRPCDownloadTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_unpauses_known_download(self):
+        rpc = StubRPC({'a': [{'status': 'paused'}]})
+        self.assertEqual(await reattach_rpc_download(rpc, 'a'), 'a')
+        self.assertEqual(rpc.calls[-1], ('aria2.unpause', 'a'))
+
+    async def test_unknown_or_failed_download_is_added_again(self):
+        self.assertIsNone(await reattach_rpc_download(StubRPC({}), 'a'))
+        self.assertIsNone(await reattach_rpc_download(StubRPC({'a': [{'status': 'error'}]}), 'a'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import asyncio
+import unittest
+from job_module import JobScheduler, DISK_JOB, CANCELLED
+
+class JobCancelTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_cancel_running_job_stops_runner(self):
+        scheduler = JobScheduler()
+        started = asyncio.Event()
+        reported = []
+
+        async def runner():
+            started.set()
+            await asyncio.sleep(60)
+            reported.append("Completed")
+
+        job = scheduler.submit(1, 'merge', DISK_JOB, runner)
+        await started.wait()
+        self.assertEqual(scheduler.cancel(job.id), f"Job #{job.id} (merge) cancelled.")
+        with self.assertRaises(asyncio.CancelledError):
+            await job.task
+        self.assertEqual(job.state, CANCELLED)
+        self.assertEqual(reported, [])
+
+    async def test_cancel_queued_job(self):
+        scheduler = JobScheduler(disk_limit=1)
+        blocker = scheduler.submit(1, 'merge', DISK_JOB, asyncio.sleep, 60)
+        queued = scheduler.submit(1, 'merge', DISK_JOB, asyncio.sleep, 0)
+        await asyncio.sleep(0)
+        scheduler.cancel(queued.id)
+        scheduler.cancel(blocker.id)
+        results = await asyncio.gather(blocker.task, queued.task, return_exceptions=True)
+        self.assertTrue(all(isinstance(result, asyncio.CancelledError) for result in results))
+        self.assertEqual((blocker.state, queued.state), (CANCELLED, CANCELLED))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+from job_module import FAILED
+from queue_module import QueueMessage
+
+logger = logging.getLogger(__name__)
+
+class Worker:
+    """
+    Runs jobs claimed from a WorkQueue until cancelled.
+
+    Claimed jobs run through the worker's own JobScheduler, so the per-kind
+    slot limits and the journal apply as in a single-process bot. Status
+    messages are QueueMessage stand-ins relayed by the bot frontend.
+
+    Parameters:
+    - queue (WorkQueue): The shared queue.
+    - scheduler (JobScheduler): Runs the claimed jobs.
+    - runners (dict): Job name -> async runner(status, params).
+    - name (str): The worker name, unique among the workers.
+    - max_jobs (int): Max jobs claimed at once.
+    - poll_interval (float): Seconds between queue polls.
+    - stale_after (float): Seconds without a heartbeat after which another
+      worker's job is taken over.
+    """
+
+    def __init__(self, queue, scheduler, runners, name, max_jobs=4, poll_interval=1, stale_after=60):
+        self.queue = queue
+        self.scheduler = scheduler
+        self.runners = runners
+        self.name = name
+        self.max_jobs = max_jobs
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.running = {}
+
+    async def _start(self, task):
+        runner = self.runners.get(task['name'])
+        if runner is None:
+            logger.error(f"Worker {self.name}: no runner for job #{task['id']} ({task['name']})")
+            await asyncio.to_thread(self.queue.finish, task['id'], FAILED)
+            return
+        status = QueueMessage(self.queue, task['chat_id'], message_id=task['status_id'])
+        job = self.scheduler.resubmit(task['id'], task['owner'], task['name'], task['kind'], runner, status, task['params'])
+        self.running[job.id] = job
+        logger.info(f"Worker {self.name}: running job #{job.id} ({job.name})")
+
+    async def poll(self):
+        """
+        Heartbeat, apply cancellations, report finished jobs and claim new ones.
+
+        The queue calls block on SQLite, so they run in a thread; jobs are
+        started and cancelled on the event loop.
+        """
+        await asyncio.to_thread(self.queue.heartbeat, self.name)
+        await asyncio.to_thread(self.queue.requeue_stale, self.stale_after)
+        for job_id in await asyncio.to_thread(self.queue.cancel_requests, self.name):
+            if job_id in self.running and self.running[job_id].active:
+                self.scheduler.cancel(job_id)
+        for job_id, job in list(self.running.items()):
+            if job.task.done():
+                await asyncio.to_thread(self.queue.finish, job_id, job.state)
+                del self.running[job_id]
+        while len(self.running) < self.max_jobs:
+            task = await asyncio.to_thread(self.queue.claim, self.name)
+            if task is None:
+                break
+            await self._start(task)
+
+    async def run(self):
+        logger.info(f"Worker {self.name} started (up to {self.max_jobs} job(s))")
+        while True:
+            try:
+                await self.poll()
+            except Exception as e:
+                # e.g. the queue database is locked for longer than its timeout
+                logger.error(f"Worker {self.name}: error polling the queue: {e}")
+            await asyncio.sleep(self.poll_interval)
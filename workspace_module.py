@@ -0,0 +1,270 @@
+import os
+import shutil
+import asyncio
+import logging
+import itertools
+from contextlib import asynccontextmanager
+from rc_module import format_bytes
+
+logger = logging.getLogger(__name__)
+
+def path_size(path):
+    """Return the size in bytes of a file, or of all files below a directory."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def path_count(path):
+    """Return the number of files at path (1 for a file)."""
+    if os.path.isfile(path):
+        return 1
+    return sum(len(files) for _, _, files in os.walk(path))
+
+class LocalClaims:
+    """
+    In-process claims, when a single process uses the download disk.
+
+    Same interface as the claim methods of WorkQueue, which shares them
+    between the bot and its workers.
+    """
+
+    def __init__(self):
+        self.claims = {}  # claim ID -> (size, path)
+        self._ids = itertools.count(1)
+
+    def reserve(self, holder, size, budget):
+        if sum(claimed for claimed, _ in self.claims.values()) + size > budget:
+            return None
+        claim_id = next(self._ids)
+        self.claims[claim_id] = (size, None)
+        return claim_id
+
+    def claim_paths(self, holder, paths):
+        claim_ids = [next(self._ids) for _ in paths]
+        self.claims.update((claim_id, (0, path)) for claim_id, path in zip(claim_ids, paths))
+        return claim_ids
+
+    def release(self, claim_ids):
+        for claim_id in claim_ids:
+            self.claims.pop(claim_id, None)
+
+    def paths_in_use(self):
+        return {path for _, path in self.claims.values() if path is not None}
+
+    def release_holder(self, holder):
+        self.claims.clear()
+
+class Workspace:
+    """
+    Per-job working directories under one root, with disk space admission control.
+
+    Jobs reserve the space they expect to write before starting. A job whose
+    reservation doesn't fit waits until other jobs release theirs (or files
+    are removed), instead of failing halfway with ENOSPC.
+
+    Jobs also mark the files and folders they read and write outside their
+    own directory (see using), which clear() and cleanup() leave alone.
+
+    Reservations and used paths are claims kept in ``claims``. When several
+    processes share the disk (the bot and its workers), that is the shared
+    WorkQueue, so each admits jobs against what all of them reserved.
+
+    Parameters:
+    - root (str): The directory all job directories are created in.
+    - margin (int): Bytes always kept free on the disk.
+    - poll_interval (int): Seconds between free space re-checks while waiting.
+    - claims (WorkQueue): The shared claims, or None if this process is alone on the disk.
+    - holder (str): The name this process claims under.
+    """
+
+    def __init__(self, root, margin=512 * 1024 * 1024, poll_interval=30, claims=None, holder='local'):
+        self.root = root
+        self.margin = margin
+        self.poll_interval = poll_interval
+        self.shared = claims is not None
+        self.claims = claims if self.shared else LocalClaims()
+        self.holder = holder
+        self.inputs = {}  # output path -> the files it was made from
+        self._condition = None
+
+    async def _call(self, method, *args):
+        # The shared claims block on SQLite
+        if self.shared:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    def _cond(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def job_path(self, job_id):
+        """Create and return the working directory of a job."""
+        path = os.path.join(self.root, f"job_{job_id}")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def find(self, name, near=None):
+        """
+        Resolve a file given by path or by bare name.
+
+        A path (absolute, or relative to the root) is used as is. A bare name
+        is looked up next to ``near`` first, then in the job directories,
+        newest job first, and finally in the root itself.
+
+        Returns:
+        - str: The path of the file, or None if there is none.
+        """
+        for path in (name, os.path.join(self.root, name)):
+            if os.path.sep in name and os.path.isfile(path):
+                return os.path.abspath(path)
+        if near is not None and os.path.isfile(os.path.join(near, name)):
+            return os.path.join(near, name)
+        if os.path.isdir(self.root):
+            jobs = sorted((entry for entry in os.listdir(self.root) if self.job_id_of(os.path.join(self.root, entry)) is not None),
+                          key=lambda entry: int(entry[4:]), reverse=True)
+            for entry in jobs:
+                for directory, _, files in os.walk(os.path.join(self.root, entry)):
+                    if name in files:
+                        return os.path.join(directory, name)
+        path = os.path.join(self.root, name)
+        return path if os.path.isfile(path) else None
+
+    def job_id_of(self, path):
+        """Return the job ID whose working directory contains path, or None."""
+        relative = os.path.relpath(os.path.abspath(path), os.path.abspath(self.root))
+        top = relative.split(os.sep, 1)[0]
+        if top.startswith("job_") and top[4:].isdigit():
+            return int(top[4:])
+        return None
+
+    @asynccontextmanager
+    async def using(self, *paths):
+        """Mark paths as used by a running job for the duration of the block."""
+        paths = [os.path.abspath(path) for path in paths if path]
+        claim_ids = await self._call(self.claims.claim_paths, self.holder, paths)
+        try:
+            yield
+        finally:
+            await self._call(self.claims.release, claim_ids)
+
+    @staticmethod
+    def in_use(path, busy):
+        """Whether one of the ``busy`` paths is path, inside it or a folder containing it."""
+        path = os.path.abspath(path)
+        return any(used == path or used.startswith(path + os.sep) or path.startswith(used + os.sep) for used in busy)
+
+    async def _remove_unused(self, path, busy):
+        """Remove path, except the ``busy`` paths running jobs use (and the folders leading to them)."""
+        if not self.in_use(path, busy):
+            if os.path.isdir(path) and not os.path.islink(path):
+                await asyncio.to_thread(shutil.rmtree, path, True)
+            elif os.path.lexists(path):
+                os.remove(path)
+            return
+        if any(used == path or path.startswith(used + os.sep) for used in busy):
+            return
+        # A folder holding used files: remove the rest of its contents
+        if os.path.isdir(path) and not os.path.islink(path):
+            for name in os.listdir(path):
+                await self._remove_unused(os.path.join(path, name), busy)
+
+    def record_output(self, output_path, inputs):
+        """Remember which files an output was made from, so they are removed with it."""
+        self.inputs[os.path.abspath(output_path)] = [os.path.abspath(path) for path in inputs]
+
+    async def remove_output(self, output_path):
+        """
+        Remove an output and the files it was made from, and its job directory once that is empty.
+
+        Outputs made before a restart (or by another worker) have no recorded
+        inputs, then only the output itself is removed.
+        """
+        output_path = os.path.abspath(output_path)
+        busy = await self._call(self.claims.paths_in_use)
+        for path in [output_path] + self.inputs.pop(output_path, []):
+            if os.path.exists(path):
+                await self._remove_unused(path, busy)
+        job_id = self.job_id_of(output_path)
+        if job_id is not None:
+            job_path = os.path.join(self.root, f"job_{job_id}")
+            if os.path.isdir(job_path) and not any(files for _, _, files in os.walk(job_path)):
+                await self.cleanup(job_path)
+        async with self._cond():
+            self._cond().notify_all()
+
+    async def _reserve(self, size):
+        """Reserve size bytes if they fit; returns the claim ID or None."""
+        budget = shutil.disk_usage(self.root).free - self.margin
+        return await self._call(self.claims.reserve, self.holder, size, budget)
+
+    @asynccontextmanager
+    async def space(self, size, status=None):
+        """
+        Reserve ``size`` bytes for the duration of the block, waiting until they are free.
+
+        Raises:
+        - OSError: If the disk could never hold ``size`` bytes.
+        """
+        size = size or 0
+        os.makedirs(self.root, exist_ok=True)
+        capacity = shutil.disk_usage(self.root).total - self.margin
+        if size > capacity:
+            message = f"Needs {format_bytes(size)} but the disk only holds {format_bytes(capacity)}"
+            if status is not None:
+                await status.edit_text(message)
+            raise OSError(message)
+
+        async with self._cond():
+            claim_id = await self._reserve(size)
+            if claim_id is None and status is not None:
+                await status.edit_text(f"Waiting for {format_bytes(size)} of free disk space..")
+            while claim_id is None:
+                try:
+                    # Also wake up periodically, files may be deleted outside the bot
+                    # and other processes release their reservations
+                    await asyncio.wait_for(self._cond().wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                claim_id = await self._reserve(size)
+        try:
+            yield
+        finally:
+            async with self._cond():
+                await self._call(self.claims.release, [claim_id])
+                self._cond().notify_all()
+
+    async def cleanup(self, path):
+        """
+        Remove a job directory (or anything else inside the root) and wake waiting jobs.
+
+        What running jobs use is kept, see using.
+        """
+        root = os.path.abspath(self.root)
+        path = os.path.abspath(path)
+        if path == root or not path.startswith(root + os.sep):
+            logger.error(f"Refusing to clean up {path} outside {root}")
+            return
+        await self._remove_unused(path, await self._call(self.claims.paths_in_use))
+        async with self._cond():
+            self._cond().notify_all()
+
+    async def clear(self, keep_job_ids=()):
+        """Remove everything under the root except the directories of the given jobs and what running jobs use."""
+        if not os.path.isdir(self.root):
+            return
+        keep = {f"job_{job_id}" for job_id in keep_job_ids}
+        busy = await self._call(self.claims.paths_in_use)
+        for name in os.listdir(self.root):
+            if name in keep:
+                continue
+            await self._remove_unused(os.path.abspath(os.path.join(self.root, name)), busy)
+        async with self._cond():
+            self._cond().notify_all()